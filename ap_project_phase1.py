@@ -1,14 +1,47 @@
 import json
+import time
 from datetime import datetime, timedelta
 from enum import Enum
+from itertools import islice
 import re
 import random
-import requests
 import sqlite3
-
-def get_db_connection():
-    conn = sqlite3.connect('clinic_reservation_system.db')
-    return conn
+from database import get_db_connection
+from schema import migrate
+from notification_dispatcher import get_dispatcher
+from timeslots import day_range, epoch_seconds, local_slot, parse_date_time
+from repository import get_repositories
+from capacity import (CapacityTemplate, add_slots, apply_template, reserve_seat, reserved_seats, release_seat,
+                      set_capacity, slot_states)
+from holds import DEFAULT_HOLD_SECONDS, get_holds
+from availability import get_availability
+from day_calendar import slot_mask, slot_times, to_bytes
+from waitlist import get_waitlist
+from service_index import get_service_index
+from response_cache import get_cache
+from circuit_breaker import get_breaker
+from slot_aggregator import fetch_available
+from capacity_outbox import enqueue_capacity_update, get_capacity_outbox
+
+# External slot APIs
+AVAILABLE_APPOINTMENTS_URL = 'http://127.0.0.1:5000/available'
+# The /available endpoints of every federated clinic system, queried concurrently.
+AVAILABLE_APPOINTMENTS_ENDPOINTS = [AVAILABLE_APPOINTMENTS_URL]
+AVAILABLE_APPOINTMENTS_CONCURRENCY = 10
+AVAILABLE_APPOINTMENTS_TIMEOUT = 5.0
+# Seconds the available appointments are served from the cache, and for how
+# long after that they may be served stale while they are refreshed.
+AVAILABLE_APPOINTMENTS_TTL = 30
+AVAILABLE_APPOINTMENTS_STALE_TTL = 300
+# Circuit breaker around each clinic system: consecutive failed fetches that
+# open it, and seconds it stays open before a trial fetch is let through.
+AVAILABLE_APPOINTMENTS_FAILURE_THRESHOLD = 5
+AVAILABLE_APPOINTMENTS_RECOVERY_TIMEOUT = 30.0
+# Free slots listed from the local Slots table when the clinic systems cannot be reached.
+AVAILABLE_APPOINTMENTS_FALLBACK_SLOTS = 50
+
+# Appointments User.iter_appointments reads per query.
+ITER_PAGE_SIZE = 500
 
 # Enums for clarity and safety
 class UserType(Enum):
@@ -20,11 +53,18 @@ class AppointmentStatus(Enum):
     CONFIRMED = "confirmed"
     CANCELED = "canceled"
 
-# Dummy data storage as JSON-like structures (lists of dictionaries)
-users = []
-clinics = []
-appointments = []
-notifications = []
+class BookingStatus(Enum):
+    BOOKED = "booked"
+    CONFLICT = "conflict"
+    ABORTED = "aborted"  # not applied because another move in the same batch conflicted
+
+class _SlotFull(Exception):
+    """
+    Raised inside a booking transaction to roll it back when a slot has no seat left.
+    """
+
+# Users, clinics, appointments and notifications are stored in the database and
+# read and written through the cached repositories in repository.py.
 clinic_id_counter = 1
 appointment_id_counter = 1
 
@@ -59,17 +99,13 @@ class User:
         """
         Registers the user in the system if the username is unique.
         """
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute("INSERT INTO Users (username, email, password, user_type) VALUES (?, ?, ?, ?)", 
-                           (self.username, self.email, self.password, self.user_type))
-            conn.commit()
+            record = get_repositories().users.add({'username': self.username, 'email': self.email,
+                                                   'password': self.password, 'user_type': self.user_type})
+            self.user_id = record['user_id']
             print(f"User {self.username} signed up successfully.")
         except sqlite3.IntegrityError:
             print("Username already exists.")
-        finally:
-            conn.close()
    
     def generate_otp(self):
         """
@@ -86,18 +122,18 @@ class User:
         Attributes:
         - input_password: The password or OTP provided by the user for authentication.
         """
-        for user in users:
-            if user['username'] == self.username:
-                if self.use_otp:
-                    if self.otp == input_password and datetime.now() < self.otp_expiry:
-                        print(f"User {self.username} logged in successfully with OTP.")
-                        return True
-                    else:
-                        print("Invalid or expired OTP.")
-                        return False
-                elif user['password'] == input_password:
-                    print(f"User {self.username} logged in successfully.")
+        user = get_repositories().users.get_by_username(self.username)
+        if user is not None:
+            if self.use_otp:
+                if self.otp == input_password and datetime.now() < self.otp_expiry:
+                    print(f"User {self.username} logged in successfully with OTP.")
                     return True
+                else:
+                    print("Invalid or expired OTP.")
+                    return False
+            elif user['password'] == input_password:
+                print(f"User {self.username} logged in successfully.")
+                return True
         print("Invalid username or password.")
         return False
 
@@ -109,31 +145,127 @@ class User:
         - new_email: New email address to update.
         - new_password: New password to update.
         """
-        for user in users:
-            if user['user_id'] == self.user_id:
-                if new_email:
-                    user['email'] = new_email
-                    print(f"{self.username}'s email updated successfully to {new_email}.")
-                if new_password:
-                    user['password'] = new_password  # In a real-world scenario, you'd hash the password
-                    print(f"{self.username}'s password updated successfully.")
+        try:
+            # In a real-world scenario, you'd hash the password
+            changes = {field: value for field, value in (('email', new_email), ('password', new_password)) if value}
+            user = get_repositories().users.update(self.user_id, **changes)
+        except sqlite3.IntegrityError:
+            print("That email address is already in use. Profile update failed.")
+            return
+        if user is None:
+            print("User not found. Profile update failed.")
+            return
+        if new_email:
+            self.email = new_email
+            print(f"{self.username}'s email updated successfully to {new_email}.")
+        if new_password:
+            self.password = new_password
+            print(f"{self.username}'s password updated successfully.")
+
+    def iter_appointments(self, status=None, start=None, end=None, limit=None, offset=0, after=None):
+        """
+        Yields the user's appointments, oldest first, as dictionaries that include the clinic name.
+
+        Rows come from a join between Appointments and Clinics that uses the
+        (user_id, starts_at) index, so a time range is an index range scan. They
+        are read in pages of ITER_PAGE_SIZE, each seeking from the last row of
+        the one before, so a long history is never loaded at once. No database
+        connection is held between pages, so the caller may write, or stop
+        early, while iterating.
+
+        Attributes:
+        - status: Only return appointments with this status (AppointmentStatus or its value).
+        - start: Only return appointments at or after this date and time, or epoch second
+          (e.g. from timeslots.day_range or week_range).
+        - end: Only return appointments before this date and time, or epoch second.
+        - limit: Largest number of appointments to return.
+        - offset: Number of matching appointments to skip.
+        - after: Keyset cursor, the (starts_at, appointment_id) of the last appointment of the
+          previous page. Prefer it to offset for deep pages.
+        """
+        query = ("SELECT a.appointment_id, a.status, a.date_time, a.starts_at, a.clinic_id, c.name "
+                 "FROM Appointments a LEFT JOIN Clinics c ON c.clinic_id = a.clinic_id "
+                 "WHERE a.user_id = ?")
+        params = [self.user_id]
+        if status is not None:
+            query += " AND a.status = ?"
+            params.append(status.value if isinstance(status, AppointmentStatus) else status)
+        if start is not None:
+            query += " AND a.starts_at >= ?"
+            params.append(epoch_seconds(start))
+        if end is not None:
+            query += " AND a.starts_at < ?"
+            params.append(epoch_seconds(end))
+        if after is not None:
+            after = (epoch_seconds(after[0]), after[1])
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_query = query
+            page_params = list(params)
+            if after is not None:
+                # The plain bound on starts_at lets the index seek straight to the cursor.
+                page_query += " AND a.starts_at >= ? AND (a.starts_at > ? OR a.appointment_id > ?)"
+                page_params.extend((after[0], after[0], after[1]))
+            page_size = ITER_PAGE_SIZE if remaining is None else min(remaining, ITER_PAGE_SIZE)
+            page_query += " ORDER BY a.starts_at, a.appointment_id LIMIT ? OFFSET ?"
+            page_params.extend((page_size, offset))
+            with get_db_connection() as conn:
+                rows = conn.execute(page_query, page_params).fetchall()
+            for appointment_id, appt_status, date_time, starts_at, clinic_id, clinic_name in rows:
+                yield {
+                    'appointment_id': appointment_id,
+                    'status': appt_status,
+                    'date_time': date_time,
+                    'starts_at': starts_at,
+                    'user_id': self.user_id,
+                    'clinic_id': clinic_id,
+                    'clinic_name': clinic_name or 'Unknown Clinic'
+                }
+            if len(rows) < page_size:
                 return
-        print("User not found. Profile update failed.")
+            if remaining is not None:
+                remaining -= len(rows)
+            # The offset only skips rows before the first page.
+            offset = 0
+            after = (rows[-1][3], rows[-1][0])
 
-    def view_appointments(self):
+    def view_appointments(self, status=None, start=None, end=None, limit=None, offset=0):
         """
-        Displays all appointments associated with the user.
+        Displays the appointments associated with the user.
+
+        Attributes:
+        - status, start, end, limit, offset: Optional filters, see iter_appointments.
         """
         print(f"Appointments for {self.username}:")
-        user_appointments = [appt for appt in appointments if appt['user_id'] == self.user_id]
-        if not user_appointments:
+        found = False
+        for appt in self.iter_appointments(status, start, end, limit, offset):
+            found = True
+            print(f"- Appointment {appt['appointment_id']} at {appt['clinic_name']} on {appt['date_time']} "
+                  f"with status {appt['status']}.")
+        if not found:
             print("No appointments found.")
-        for appt in user_appointments:
-            status = appt['status']
-            date_time = appt['date_time']
-            clinic_info = next((clinic for clinic in clinics if clinic['clinic_id'] == appt['clinic_id']), None)
-            clinic_name = clinic_info['name'] if clinic_info else 'Unknown Clinic'
-            print(f"- Appointment {appt['appointment_id']} at {clinic_name} on {date_time} with status {status}.")
+
+    def join_waitlist(self, clinic_id, day, start_time=None, end_time=None, priority=0):
+        """
+        Puts the user on the waitlist of a clinic for a day. When a matching seat
+        is freed it is booked for the waiter with the highest priority, oldest request first.
+
+        Attributes:
+        - clinic_id: The clinic wanted.
+        - day: The day wanted ("YYYY-MM-DD").
+        - start_time: Earliest acceptable time of day ("HH:MM").
+        - end_time: Latest acceptable slot start, exclusive ("HH:MM").
+        - priority: Higher priorities are served first.
+
+        Returns the waitlist record, or None if it could not be stored.
+        """
+        try:
+            record = get_waitlist().join(self.user_id, clinic_id, day, start_time, end_time, priority)
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            return None
+        print(f"You are on the waitlist of clinic {clinic_id} for {day}.")
+        return record
 
     def to_dict(self):
         """
@@ -161,7 +293,7 @@ class Clinic:
     - address: Physical address of the clinic.
     - phone_info: Contact number for the clinic.
     - services: List of services provided by the clinic.
-    - availability: Dictionary holding the availability status for different dates.
+    - availability: Dictionary mapping dates to bitmaps of the 15-minute slots the clinic is open in.
     """
     def __init__(self, clinic_id, name, address, phone_info, services):
         self.clinic_id = clinic_id
@@ -169,7 +301,7 @@ class Clinic:
         self.address = address
         self.phone_info = phone_info
         self.services = services
-        self.availability = {}  # Dictionary to hold availability status
+        self.availability = {}  # Date -> bitmap of open slots (see day_calendar.py)
 
     def to_dict(self):
         """
@@ -181,41 +313,129 @@ class Clinic:
             'address': self.address,
             'phone_info': self.phone_info,
             'services': self.services,
-            'availability': self.availability
+            'availability': {date: to_bytes(bitmap).hex() for date, bitmap in self.availability.items()}
         }
     def update_clinic_info(self, new_address=None, new_phone=None):
-            """
+        """
         Updates the clinic's address or phone information.
         
         Attributes:
         - new_address: New physical address to update.
         - new_phone: New contact number to update.
         """
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            try:
-                if new_address:
-                    cursor.execute("UPDATE Clinics SET address = ? WHERE clinic_id = ?", (new_address, self.clinic_id))
-                if new_phone:
-                    cursor.execute("UPDATE Clinics SET phone_info = ? WHERE clinic_id = ?", (new_phone, self.clinic_id))
-                conn.commit()
-                print(f"Clinic {self.name}'s info updated successfully.")
-            except sqlite3.Error as e:
-                print(f"Clinic Error")
+        changes = {}
+        if new_address:
+            changes['address'] = new_address
+        if new_phone:
+            changes['phone_info'] = new_phone
+        try:
+            if get_repositories().clinics.update(self.clinic_id, **changes) is None:
+                print("Clinic not found.")
+                return
+            self.address = new_address or self.address
+            self.phone_info = new_phone or self.phone_info
+            print(f"Clinic {self.name}'s info updated successfully.")
+        except sqlite3.Error as e:
+            print(f"Clinic Error")
 
         
         
 
-    def set_availability(self, date, available):
+    def update_services(self, services):
+        """
+        Replaces the services the clinic offers, in the Services table and the service index.
+
+        Attributes:
+        - services: Names of the services.
+        """
+        try:
+            if get_repositories().clinics.set_services(self.clinic_id, services) is None:
+                print("Clinic not found.")
+                return
+            self.services = list(services)
+            print(f"Clinic {self.name}'s services updated successfully.")
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+
+    def set_availability(self, date, available, start=None, end=None):
         """
-        Sets the clinic's availability for a specific date.
+        Sets the clinic's availability for a specific date, or for part of it.
         
         Attributes:
         - date: The specific date for which to set the availability.
         - available: Boolean indicating if the clinic is available on that date.
+        - start: First time ("HH:MM") to change. Defaults to midnight.
+        - end: Time ("HH:MM") to change up to. Defaults to the end of the day.
         """
-        self.availability[date] = available
-        print(f"Clinic {self.name} set to {'available' if available else 'unavailable'} on {date}")
+        mask = slot_mask(start or "00:00", end or "24:00")
+        bitmap = self.availability.get(date, 0)
+        self.availability[date] = bitmap | mask if available else bitmap & ~mask
+        hours = f" from {start or '00:00'} to {end or '24:00'}" if start or end else ""
+        print(f"Clinic {self.name} set to {'available' if available else 'unavailable'} on {date}{hours}")
+
+    def is_available(self, date, start=None, end=None):
+        """
+        Checks whether the clinic is open on a date, in every slot from start to
+        end or, given only start, in the slot start falls in.
+        """
+        bitmap = self.availability.get(date, 0)
+        if start is None:
+            return bitmap != 0
+        mask = slot_mask(start, end)
+        return bitmap & mask == mask
+
+    def open_times(self, date):
+        """
+        Returns the start times ("HH:MM") of the clinic's open slots on a date.
+        """
+        return slot_times(self.availability.get(date, 0))
+
+    def view_slots(self, date):
+        """
+        Displays the clinic's slots on a date with their booked, held and free seats.
+        """
+        day = parse_date_time(f"{date} 00:00")
+        try:
+            states = slot_states(self.clinic_id, day, day + timedelta(days=1))
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            return
+        if not states:
+            print(f"Clinic {self.name} has no slots on {date}.")
+        for state in states:
+            print(f"{state['date_time']}: {state['booked']} booked, {state['held']} held, {state['free']} free")
+
+
+class BookingResult:
+    """
+    Outcome of an attempt to book a clinic time slot.
+
+    Attributes:
+    - status: BOOKED if the slot was taken for the patient, CONFLICT if it was already booked.
+    - appointment_id: ID of the new appointment, or None on conflict.
+    - clinic_id: The clinic of the requested slot.
+    - date_time: The requested date and time.
+    """
+    def __init__(self, status: BookingStatus, clinic_id, date_time, appointment_id=None):
+        self.status = status
+        self.clinic_id = clinic_id
+        self.date_time = date_time
+        self.appointment_id = appointment_id
+
+    @property
+    def booked(self):
+        return self.status == BookingStatus.BOOKED
+
+    def to_dict(self):
+        """
+        Converts the booking result to a dictionary for easier handling and storage.
+        """
+        return {
+            'status': self.status.value,
+            'appointment_id': self.appointment_id,
+            'clinic_id': self.clinic_id,
+            'date_time': self.date_time
+        }
 
 
 class Appointment:
@@ -252,63 +472,222 @@ class Appointment:
     
     def register_patient_appointment(self):
         """
-        Registers a new appointment for the patient if the time slot isn't already taken.
+        Registers a new appointment for the patient if the time slot has a seat left.
+
+        The seat is taken with one conditional update of the slot's counter
+        (see capacity.reserve_seat) in the same transaction as the insert, so
+        concurrent patients can never take more seats than the slot has.
+
+        Returns a BookingResult, or None if the input or the database was invalid.
         """
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute("SELECT * FROM Appointments WHERE date_time = ? AND clinic_id = ?", 
-                           (self.date_time, self.clinic_id))
-            if cursor.fetchone():
-                print("This time slot is already booked.")
-            else:
-                cursor.execute("INSERT INTO Appointments (status, date_time, user_id, clinic_id) VALUES (?, ?, ?, ?)", 
-                               (self.status, self.date_time, self.user_id, self.clinic_id))
-                conn.commit()
-                print(f"Appointment registered successfully for user")
-        except:
-            print(f"Appointment Error")
+            # The slot is keyed on the moment, computed from the input as given
+            # so a UTC offset in it is honored; the repository stores the row.
+            starts_at = epoch_seconds(self.date_time)
+        except (TypeError, ValueError):
+            print(f"Invalid date and time: {self.date_time}")
+            return None
+        try:
+            with get_db_connection() as conn:
+                seats_left = reserve_seat(conn, self.clinic_id, starts_at)
+                if seats_left is None:
+                    return BookingResult(BookingStatus.CONFLICT, self.clinic_id, self.date_time)
+                record = get_repositories().appointments.add({'status': self.status, 'date_time': self.date_time,
+                                                              'user_id': self.user_id, 'clinic_id': self.clinic_id})
+        except sqlite3.Error as e:
+            print(f"Appointment Error: {e}")
+            return None
+        self.appointment_id = record['appointment_id']
+        self.date_time = record['date_time']
+        if seats_left == 0:
+            get_availability().mark_booked(self.clinic_id, starts_at)
+        return BookingResult(BookingStatus.BOOKED, self.clinic_id, self.date_time, self.appointment_id)
+
     def cancel_patient_appointment(self):
         """
-        Cancels the appointment by changing its status to canceled.
+        Cancels the appointment by changing its status to canceled and gives its seat back.
+        If someone is on the waitlist for the slot, the seat is booked for them in
+        the same transaction and they are notified.
         """
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        backfill = None
         try:
-            cursor.execute("UPDATE Appointments SET status = ? WHERE appointment_id = ?", 
-                        (AppointmentStatus.CANCELED.value, self.appointment_id))
-            if cursor.rowcount == 0:
-                print("Appointment not found.")
-            else:
-                conn.commit()
-                print(f"Appointment {self.appointment_id} has been canceled.")
+            with get_db_connection() as conn:
+                record = get_repositories().appointments.cancel(self.appointment_id)
+                seats_left = release_seat(conn, record['clinic_id'], record['starts_at']) if record else None
+                if seats_left:
+                    backfill = get_waitlist().offer(conn, record['clinic_id'], record['starts_at'])
         except sqlite3.Error as e:
             print(f"An error occurred: {e}")
-        finally:
-            conn.close()
+            return
+        if record is None:
+            print("Appointment not found.")
+            return
+        if backfill:
+            notify_waitlist_booking(backfill)
+        elif seats_left:
+            get_availability().mark_free(record['clinic_id'], record['starts_at'])
+        print(f"Appointment {self.appointment_id} has been canceled.")
+
+
+    def hold_patient_slot(self, ttl=DEFAULT_HOLD_SECONDS):
+        """
+        Holds a seat of the appointment's slot for the patient while they decide,
+        so nobody else can take it in the meantime. The hold lapses after ttl
+        seconds unless it is confirmed with confirm_patient_hold.
 
+        Attributes:
+        - ttl: Seconds the seat is held.
+
+        Returns the hold as a dictionary, or None if the slot has no free seat or the input or database was invalid.
+        """
+        try:
+            return get_holds().hold(self.user_id, self.clinic_id, self.date_time, ttl)
+        except ValueError:
+            print(f"Invalid date and time: {self.date_time}")
+        except sqlite3.Error as e:
+            print(f"Appointment Error: {e}")
+        return None
+
+    def confirm_patient_hold(self, hold_id):
+        """
+        Books the appointment on a seat held with hold_patient_slot.
+
+        Returns a BookingResult, CONFLICT if the hold has expired or its slot has no seat left,
+        or None if the database failed.
+        """
+        try:
+            record = get_holds().confirm(hold_id, self.status)
+        except sqlite3.Error as e:
+            print(f"Appointment Error: {e}")
+            return None
+        if record is None:
+            return BookingResult(BookingStatus.CONFLICT, self.clinic_id, self.date_time)
+        self.appointment_id = record['appointment_id']
+        return BookingResult(BookingStatus.BOOKED, record['clinic_id'], record['date_time'], self.appointment_id)
+
+    def release_patient_hold(self, hold_id):
+        """
+        Gives a held seat back before its hold lapses.
+        """
+        try:
+            get_holds().release(hold_id)
+        except sqlite3.Error as e:
+            print(f"Appointment Error: {e}")
 
     def reschedule_patient_appointment(self, new_time):
         """
         Reschedules the appointment to a new time and resets its status to pending.
+        The new slot is taken and the old one released in the same transaction,
+        see move_appointments.
         
         Attributes:
         - new_time: The new time to which the appointment is rescheduled.
+
+        Returns a BookingResult, or None if the appointment does not exist or the database failed.
         """
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        results = Appointment.move_appointments([(self.appointment_id, new_time)])
+        if results is None:
+            return None
+        result = results[0]
+        if result.booked:
+            self.date_time = new_time
+            print(f"Appointment {self.appointment_id} rescheduled to {new_time}.")
+        else:
+            print(f"The time slot {new_time} is not available.")
+        return result
+
+    @staticmethod
+    def move_appointments(moves):
+        """
+        Moves a batch of appointments to new times, all or nothing.
+
+        In a single transaction the old slots' seats are given back, a seat of
+        every new slot is taken with one conditional update each and the rows
+        are updated with one executemany. If a new slot has no seat left the
+        transaction is rolled back and every appointment keeps its old slot.
+        Old seats are released first, so appointments in a batch can swap slots.
+
+        Attributes:
+        - moves: Iterable of (appointment_id, new_time) pairs.
+
+        Returns one BookingResult per move: all BOOKED, or CONFLICT for the move
+        that failed and ABORTED for the rest. Returns None if an appointment
+        does not exist or the database failed.
+        """
+        moves = [(appointment_id, date_time) for appointment_id, date_time in moves]
+        for _, date_time in moves:
+            try:
+                parse_date_time(date_time)
+            except (TypeError, ValueError):
+                print(f"Invalid date and time: {date_time}")
+                return None
         try:
-            cursor.execute("UPDATE Appointments SET date_time = ?, status = ? WHERE appointment_id = ?", 
-                        (new_time, AppointmentStatus.PENDING.value, self.appointment_id))
-            if cursor.rowcount == 0:
-                print("Appointment not found.")
-            else:
-                conn.commit()
-                print(f"Appointment {self.appointment_id} rescheduled to {new_time}.")
+            with get_db_connection() as conn:
+                clinics, seats_left = Appointment._apply_moves(conn, moves)
+        except LookupError as missing:
+            print(f"Appointment {missing.args[0]} not found.")
+            return None
+        except _SlotFull as full:
+            conflicting, clinics = full.args
+            return [BookingResult(BookingStatus.CONFLICT if i == conflicting else BookingStatus.ABORTED,
+                                  clinics[i], date_time, appointment_id)
+                    for i, (appointment_id, date_time) in enumerate(moves)]
         except sqlite3.Error as e:
             print(f"An error occurred: {e}")
-        finally:
-            conn.close()
+            return None
+        _update_availability(seats_left)
+        return [BookingResult(BookingStatus.BOOKED, clinic_id, date_time, appointment_id)
+                for clinic_id, (appointment_id, date_time) in zip(clinics, moves)]
+
+    @staticmethod
+    def _apply_moves(conn, moves):
+        """
+        Moves appointments to new times inside the caller's transaction: gives
+        the old seats back, takes a seat of every new slot and updates the rows.
+
+        Returns the clinic of each move and the seats left in every slot
+        touched, by (clinic_id, starts_at). Raises LookupError with the ID of
+        a missing appointment, or _SlotFull with the index of the move whose
+        slot is full and the clinics; the caller's transaction must then be
+        rolled back.
+        """
+        appointments = get_repositories().appointments
+        canceled = AppointmentStatus.CANCELED.value
+        # The last operation on a slot wins.
+        seats_left = {}
+        # Read from the rows under the write lock, not the cache: an old seat is
+        # given back only if the appointment is still live in the database.
+        records = appointments.get_many_for_update(appointment_id for appointment_id, _ in moves)
+        for appointment_id, _ in moves:
+            if appointment_id not in records:
+                raise LookupError(appointment_id)
+        clinics = [records[appointment_id]['clinic_id'] for appointment_id, _ in moves]
+        for appointment_id, _ in moves:
+            record = records[appointment_id]
+            if record['status'] != canceled:
+                seats_left[record['clinic_id'], record['starts_at']] = release_seat(
+                    conn, record['clinic_id'], record['starts_at'])
+        for i, (appointment_id, date_time) in enumerate(moves):
+            slot = clinics[i], epoch_seconds(date_time)
+            seats_left[slot] = reserve_seat(conn, *slot)
+            if seats_left[slot] is None:
+                raise _SlotFull(i, clinics)
+        appointments.update_many({appointment_id: (date_time, AppointmentStatus.PENDING.value)
+                                  for appointment_id, date_time in moves}, ('date_time', 'status'))
+        return clinics, seats_left
+
+
+def _update_availability(seats_left):
+    """
+    Brings the availability index in line with committed seat changes, given
+    as the seats left in each slot by (clinic_id, starts_at).
+    """
+    availability = get_availability()
+    for (clinic_id, date_time), left in seats_left.items():
+        if left:
+            availability.mark_free(clinic_id, date_time)
+        elif left == 0:
+            availability.mark_booked(clinic_id, date_time)
 
 
 class Notification:
@@ -335,35 +714,73 @@ class Notification:
             'date_time': self.date_time
         }
 
-    def send_notification(self):
+    def send_notification(self, block=True, timeout=None):
         """
-        Simulates sending a notification by printing it to the console.
+        Sends the notification by handing it to the background dispatcher, which
+        stores it in the Notifications table. The call returns as soon as the
+        notification is queued.
+
+        Attributes:
+        - block: Whether to wait for room when the dispatcher's queue is full.
+        - timeout: Longest time to wait for room, in seconds.
+
+        Returns True if the notification was queued.
         """
-        print(f"Notification sent to {self.username} at {self.date_time}: {self.message}")
-        notifications.append(self.to_dict())
+        queued = get_dispatcher().submit(self.username, self.message, self.date_time, block=block, timeout=timeout)
+        if queued:
+            print(f"Notification sent to {self.username} at {self.date_time}: {self.message}")
+        else:
+            print(f"Notification to {self.username} was not sent: the notification queue is full.")
+        return queued
         
     @staticmethod
-    def send_bulk_notifications(users, message):
+    def send_bulk_notifications(users, message, chunk_size=1000):
         """
         Sends a notification to a list of users.
+
+        Users are consumed lazily, so a generator over a very large user base
+        works without loading it into memory. Rows are written with executemany
+        and committed once per chunk, which keeps each write lock short.
         
         Attributes:
-        - users: List of users to whom the notification is to be sent.
+        - users: Iterable of users (dictionaries or User objects) to whom the notification is to be sent.
         - message: The content of the notification.
+        - chunk_size: Number of notifications inserted and committed together.
+
+        Returns a dictionary with the number of notifications sent, chunks committed and elapsed seconds.
         """
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        users = iter(users)
+        sent = chunks = 0
+        started = time.perf_counter()
         try:
-            for user in users:
-                notification = Notification(user['username'], message)
-                cursor.execute("INSERT INTO Notifications (username, message, date_time) VALUES (?, ?, ?)", 
-                            (notification.username, notification.message, notification.date_time))
-                print(f"Sent notification to {user['username']}")
-            conn.commit()
+            while True:
+                batch = list(islice(users, chunk_size))
+                if not batch:
+                    break
+                date_time = datetime.now().isoformat()
+                get_repositories().notifications.add_many(
+                    ((user['username'] if isinstance(user, dict) else user.username, message, date_time) for user in batch),
+                    ('username', 'message', 'date_time'))
+                sent += len(batch)
+                chunks += 1
         except sqlite3.Error as e:
             print(f"An error occurred: {e}")
-        finally:
-            conn.close()
+        elapsed = time.perf_counter() - started
+        rate = sent / elapsed if elapsed else 0.0
+        print(f"Sent {sent} notifications in {chunks} chunks in {elapsed:.2f}s ({rate:,.0f}/s).")
+        return {'sent': sent, 'chunks': chunks, 'seconds': elapsed}
+
+
+def notify_waitlist_booking(appointment):
+    """
+    Tells a waitlisted patient that a freed seat was booked for them.
+    """
+    user = get_repositories().users.get(appointment['user_id'])
+    if user is None:
+        return
+    Notification(user['username'],
+                 f"A slot opened up: appointment {appointment['appointment_id']} at clinic "
+                 f"{appointment['clinic_id']} on {appointment['date_time']} is booked for you.").send_notification()
 
 
 # Admin-specific functionalities
@@ -418,9 +835,116 @@ class Admin(User):
                 print("Invalid input. Please enter a valid appointment ID.")
                 return
         
-        global appointments
-        appointments = [appt for appt in appointments if appt['appointment_id'] != appointment_id]
-        print(f"Appointment {appointment_id} has been removed.")
+        if self.remove_appointments([appointment_id]):
+            print(f"Appointment {appointment_id} has been removed.")
+        else:
+            print("Appointment not found.")
+
+    def remove_appointments(self, appointment_ids):
+        """
+        Removes a batch of appointments from the system in one transaction.
+
+        Attributes:
+        - appointment_ids: Iterable of appointment IDs to remove.
+
+        Returns the number of appointments removed.
+        """
+        appointment_ids = list(appointment_ids)
+        appointments = get_repositories().appointments
+        try:
+            with get_db_connection() as conn:
+                # The rows come back as they were deleted, so a seat is given
+                # back only for an appointment that was still live.
+                records = appointments.remove(appointment_ids)
+                removed = len(records)
+                freed = []
+                backfills = []
+                for record in records:
+                    if record['status'] == AppointmentStatus.CANCELED.value:
+                        continue
+                    if release_seat(conn, record['clinic_id'], record['starts_at']):
+                        backfill = get_waitlist().offer(conn, record['clinic_id'], record['starts_at'])
+                        if backfill:
+                            backfills.append(backfill)
+                        else:
+                            freed.append((record['clinic_id'], record['starts_at']))
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            return 0
+        availability = get_availability()
+        for clinic_id, starts_at in freed:
+            availability.mark_free(clinic_id, starts_at)
+        for backfill in backfills:
+            notify_waitlist_booking(backfill)
+        return removed
+
+    def reschedule_clinic_day(self, clinic_id, day):
+        """
+        Moves every live appointment of a clinic on one day to the clinic's
+        earliest free slots after that day, e.g. when the doctor calls in sick.
+        The free slots are read from the Slots table in the same transaction
+        that applies the moves, after it has taken the write lock, so they are
+        still free when they are booked.
+
+        Attributes:
+        - clinic_id: The clinic whose day is cleared.
+        - day: The day to clear ("YYYY-MM-DD").
+
+        Returns a dictionary with the moved appointments' new times, the IDs
+        that could not be placed for lack of free slots and the elapsed seconds,
+        or None if the move failed.
+        """
+        started = time.perf_counter()
+        try:
+            first, next_day = day_range(day)
+            with get_db_connection() as conn:
+                if not conn.in_transaction:
+                    conn.execute("BEGIN IMMEDIATE")
+                appointment_ids = [appointment_id for (appointment_id,) in conn.execute(
+                    "SELECT appointment_id FROM Appointments WHERE clinic_id = ? AND status != 'canceled' "
+                    "AND starts_at >= ? AND starts_at < ? ORDER BY starts_at",
+                    (clinic_id, first, next_day))]
+                targets = [date_time for (date_time,) in conn.execute(
+                    "SELECT date_time FROM Slots WHERE clinic_id = ? AND starts_at >= ? "
+                    "AND reserved + held < capacity ORDER BY starts_at LIMIT ?",
+                    (clinic_id, next_day, len(appointment_ids)))]
+                moves = list(zip(appointment_ids, targets))
+                seats_left = Appointment._apply_moves(conn, moves)[1] if moves else {}
+        except (ValueError, sqlite3.Error) as e:
+            print(f"Appointments of clinic {clinic_id} on {day} could not be moved: {e}")
+            return None
+        except (LookupError, _SlotFull):
+            print(f"Appointments of clinic {clinic_id} on {day} could not be moved.")
+            return None
+        _update_availability(seats_left)
+        unplaced = appointment_ids[len(moves):]
+        print(f"Moved {len(moves)} appointments of clinic {clinic_id} from {day}; "
+              f"{len(unplaced)} could not be placed.")
+        return {'moved': dict(moves), 'unplaced': unplaced, 'seconds': time.perf_counter() - started}
+
+    def view_clinic_schedule(self, clinic_id, start, end, status=None, page_size=50):
+        """
+        Displays a clinic's appointments in a time range, one page at a time.
+
+        Attributes:
+        - clinic_id: The clinic whose schedule is shown.
+        - start: First moment of the range ("YYYY-MM-DD HH:MM").
+        - end: End of the range, exclusive.
+        - status: Only show appointments with this status.
+        - page_size: Appointments shown before asking whether to continue.
+        """
+        print(f"Schedule of clinic {clinic_id} from {start} to {end}:")
+        cursor = None
+        while True:
+            page = list_clinic_appointments(clinic_id, start, end, status, cursor, page_size)
+            if page is None:
+                return
+            for appt in page['appointments']:
+                print(f"- Appointment {appt['appointment_id']} on {appt['date_time']} for user "
+                      f"{appt['user_id']} with status {appt['status']}.")
+            cursor = page['next']
+            if cursor is None or input("Show more? (y/n): ").lower() != 'y':
+                return
 
     def add_appointment_capacity(self):
         """
@@ -430,51 +954,218 @@ class Admin(User):
         time = input("Enter the time for the new appointment slot (HH:MM): ")
         datetime_str = f"{date} {time}"
         try:
-            # Simulate checking for existing slots before adding
-            existing_slots = [appt for appt in appointments if appt['date_time'] == datetime_str]
-            if existing_slots:
-                print("An appointment slot already exists at this time.")
-            else:
-                global appointment_id_counter
-                new_appointment = {
-                    'appointment_id': appointment_id_counter,
-                    'status': AppointmentStatus.PENDING.value,  # Use a valid status from the AppointmentStatus enum
-                    'date_time': datetime_str,
-                    'user_id': None,  # No user assigned yet
-                    'clinic_id': self.clinic_id  # Assuming the admin is associated with a clinic
-                }
-                appointments.append(new_appointment)
-                appointment_id_counter += 1
+            datetime_str = parse_date_time(datetime_str).strftime("%Y-%m-%d %H:%M")
+            # Assuming the admin is associated with a clinic
+            if add_slots(self.clinic_id, [datetime_str])['inserted']:
                 print(f"Added new appointment slot on {datetime_str}.")
+            else:
+                print("An appointment slot already exists at this time.")
         except Exception as e:
             print(f"An error occurred: {e}")
 
+    def add_recurring_capacity(self, weekdays, opening, closing, slot_minutes, start_date, end_date, capacity=1):
+        """
+        Opens every slot of a recurring schedule for the admin's clinic in one transaction.
 
-def fetch_available_appointments():
+        Attributes:
+        - weekdays: Days the clinic opens, as numbers (0 is Monday) or names such as "mon".
+        - opening: Time of the first slot of the day ("HH:MM").
+        - closing: Time the last slot must end by ("HH:MM").
+        - slot_minutes: Length of one slot in minutes.
+        - start_date: First day of the range ("YYYY-MM-DD").
+        - end_date: Last day of the range, inclusive.
+        - capacity: Number of appointments each slot takes, e.g. the number of doctors on duty.
+
+        Returns a dictionary with the number of slots inserted and skipped.
+        """
+        template = CapacityTemplate(weekdays, opening, closing, slot_minutes, start_date, end_date)
+        try:
+            stats = apply_template(self.clinic_id, template, capacity)
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            return None
+        print(f"Added {stats['inserted']} appointment slots ({stats['skipped']} already existed).")
+        return stats
+
+
+def find_earliest_slots(n=5, service=None, start=None, end=None):
     """
-    Fetches available appointments from an external API and displays them.
+    Returns the n earliest free appointment slots across all clinics as
+    (date_time, clinic_id) pairs, answered from the in-memory availability index.
+
+    Attributes:
+    - n: Number of slots to return.
+    - service: Only search clinics offering a service whose name starts with this (case-insensitive),
+      e.g. "cardio" for Cardiology. Looked up in the in-memory service index.
+    - start: Only return slots at or after this time ("YYYY-MM-DD HH:MM"). Defaults to now.
+    - end: Only return slots before this time.
     """
+    clinic_ids = get_service_index().clinics_with_prefix(service) if service else None
+    return get_availability().earliest(n, start, end, clinic_ids)
+
+
+def list_clinic_appointments(clinic_id, start, end, status=None, after=None, limit=50):
+    """
+    Returns one page of a clinic's schedule for a time range, oldest first,
+    with keyset pagination on (starts_at, appointment_id).
+
+    Attributes:
+    - clinic_id: The clinic whose schedule is listed.
+    - start: First moment of the range ("YYYY-MM-DD HH:MM", a datetime or epoch seconds).
+    - end: End of the range, exclusive.
+    - status: Only return appointments with this status (AppointmentStatus or its value).
+    - after: The 'next' cursor of the previous page. Leave out for the first page.
+    - limit: Page size.
+
+    Returns a dictionary with the page's appointments and the cursor of the
+    next page ('next', None on the last page), or None if the input or the
+    database was invalid.
+    """
+    if isinstance(status, AppointmentStatus):
+        status = status.value
     try:
-        response = requests.get('http://127.0.0.1:5000/available')
-        if response.status_code == 200:
-            available_appointments = response.json()
-            print("Available appointments:")
-            for appt in available_appointments:
-                print(appt)
-        else:
-            print("Failed to fetch available appointments.")
-    except Exception as e:
+        # One extra row tells whether there is a next page.
+        rows = get_repositories().appointments.clinic_page(clinic_id, start, end, status,
+                                                          None if after is None else tuple(after), limit + 1)
+    except (TypeError, ValueError) as e:
+        print(f"Invalid range: {e}")
+        return None
+    except sqlite3.Error as e:
         print(f"An error occurred: {e}")
+        return None
+    page = rows[:limit]
+    cursor = (page[-1]['starts_at'], page[-1]['appointment_id']) if len(rows) > limit else None
+    return {'appointments': page, 'next': cursor}
 
 
+def _request_available_appointments(endpoints):
+    """
+    Calls the clinic systems' /available endpoints concurrently and returns
+    their merged slots, sorted by date and time. Each endpoint is called
+    through its own circuit breaker. Endpoints that fail, or whose circuit is
+    open, are reported and left out; raises RuntimeError if every one of them failed.
+    """
+    result = fetch_available(endpoints, AVAILABLE_APPOINTMENTS_CONCURRENCY, AVAILABLE_APPOINTMENTS_TIMEOUT,
+                             breakers=available_appointments_breaker)
+    if result['failed']:
+        if len(result['failed']) == len(set(endpoints)):
+            raise RuntimeError(f"no clinic system answered: {next(iter(result['failed'].values()))}")
+        print(f"Could not reach {len(result['failed'])} of {len(set(endpoints))} clinic systems: "
+              f"{', '.join(result['failed'])}")
+    return result['slots']
+
 
-def adjust_clinic_capacity(code, reserved):
+def available_appointments_cache():
+    """
+    Returns the cache in front of the external available-appointments API, e.g. for its stats().
     """
-    Adjusts the capacity of a clinic by sending a POST request to an external API.
+    return get_cache('available_appointments', AVAILABLE_APPOINTMENTS_TTL, AVAILABLE_APPOINTMENTS_STALE_TTL)
 
-    This function aims to update the number of reserved appointments for a specific clinic.
-    It sends a payload with the clinic code and the number of reserved appointments to the external API endpoint.
-    Upon success, it confirms the adjustment; otherwise, it reports a failure.
+
+def available_appointments_breaker(endpoint):
+    """
+    Returns the circuit breaker around one clinic system's /available endpoint, e.g. for its stats().
+    """
+    return get_breaker(f"available_appointments {endpoint}", AVAILABLE_APPOINTMENTS_FAILURE_THRESHOLD,
+                       AVAILABLE_APPOINTMENTS_RECOVERY_TIMEOUT)
+
+
+def _local_available_appointments(service=None):
+    # The earliest free seats in the local Slots table, shaped like the clinic systems' answer.
+    return [{'date_time': date_time, 'clinic_id': clinic_id, 'source': 'local'}
+            for date_time, clinic_id in find_earliest_slots(AVAILABLE_APPOINTMENTS_FALLBACK_SLOTS, service)]
+
+
+def fetch_available_appointments(service=None, endpoints=None):
+    """
+    Fetches available appointments from the external clinic systems and displays them.
+    The answer is cached for AVAILABLE_APPOINTMENTS_TTL seconds and served
+    stale while one background refresh runs, so the APIs see at most one call at a time.
+
+    Every clinic system is called through its own circuit breaker: after
+    AVAILABLE_APPOINTMENTS_FAILURE_THRESHOLD failures in a row it is not
+    called for AVAILABLE_APPOINTMENTS_RECOVERY_TIMEOUT seconds, while the
+    others still are. Whenever no clinic system answers, the last answer they
+    gave is shown however old it is, or, if there was none, the free slots in
+    the local Slots table.
+
+    Attributes:
+    - service: Only show appointments at clinics offering a service whose name starts with this.
+    - endpoints: The /available endpoints to query. Defaults to AVAILABLE_APPOINTMENTS_ENDPOINTS.
+
+    Returns the list of available appointments, or None if they could not be fetched.
+    """
+    endpoints = tuple(endpoints or AVAILABLE_APPOINTMENTS_ENDPOINTS)
+    cache = available_appointments_cache()
+    try:
+        available_appointments = cache.get(endpoints, lambda: _request_available_appointments(endpoints))
+    except Exception as e:
+        last_good = cache.last_good(endpoints)
+        if last_good is None:
+            try:
+                available_appointments = _local_available_appointments(service)
+            except sqlite3.Error as local_error:
+                print(f"Failed to fetch available appointments: {e}; local slots: {local_error}")
+                return None
+            print(f"Failed to fetch available appointments ({e}); showing free slots from the local schedule.")
+            service = None  # already applied to the local slots
+        else:
+            available_appointments, age = last_good
+            print(f"Failed to fetch available appointments ({e}); showing those fetched {age:.0f} seconds ago.")
+    if service:
+        clinic_ids = get_service_index().clinics_with_prefix(service)
+        available_appointments = [appt for appt in available_appointments if appt.get('clinic_id') in clinic_ids]
+    print("Available appointments:")
+    for appt in available_appointments:
+        print(appt)
+    return available_appointments
+
+
+
+def adjust_clinic_capacity(code, capacity, start=None, end=None, sync=False):
+    """
+    Adjusts the capacity of a clinic: how many appointments each of its slots
+    takes, e.g. the number of doctors on duty. The change is made in the local
+    Slots table, where bookings take and release seats with atomic counters.
+
+    Attributes:
+    code: int
+        The unique code (ID) of the clinic whose capacity is adjusted.
+    capacity: int
+        The number of appointments each slot takes. Slots never drop below the seats already reserved.
+    start, end: str
+        Only adjust slots from start up to end ("YYYY-MM-DD HH:MM"). Defaults to every slot.
+    sync: bool
+        Also report the clinic's reserved appointments to the external slot API. The
+        report is queued in the same transaction as the change and sent in the background.
+
+    Returns a dictionary with the number of slots updated and the seats reserved in them,
+    or None if the database failed.
+    """
+    try:
+        with get_db_connection() as conn:
+            stats = set_capacity(code, capacity, start, end)
+            if sync:
+                # The API is told the whole clinic's count, not just the adjusted range's.
+                enqueue_capacity_update(code, reserved_seats(conn, code))
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+        return None
+    if sync:
+        get_capacity_outbox().wake()
+    print(f"Clinic {code} now takes {capacity} appointments per slot "
+          f"({stats['updated']} slots, {stats['reserved']} appointments reserved).")
+    return stats
+
+
+def sync_clinic_capacity(code, reserved):
+    """
+    Reports the number of reserved appointments of a clinic to the external slot API.
+
+    The update is stored in the CapacityOutbox table and sent by its
+    background flusher (see capacity_outbox.py), so this returns without
+    waiting on the network. Unsent updates for the same clinic are coalesced
+    into the latest count, and failed sends are retried until they succeed.
 
     Attributes:
     code: int
@@ -482,19 +1173,16 @@ def adjust_clinic_capacity(code, reserved):
     reserved: int
         The number of reserved appointments to set for the clinic.
 
-    The function catches and reports any exceptions that occur during the process,
-    such as network issues or problems with the external API.
+    Returns True if the update was queued.
     """
     try:
-        payload = {'clinic code': code, 'reserved appointments': reserved}
-        response = requests.post('https://localhost/slots', json=payload)
-   
-        if response.status_code == 200:
-            print(f"Clinic capacity adjusted successfully: {response.json()}")
-        else:
-            print("Failed to adjust clinic capacity.")
-    except Exception as e:
+        enqueue_capacity_update(code, reserved)
+    except sqlite3.Error as e:
         print(f"An error occurred: {e}")
+        return False
+    get_capacity_outbox().wake()
+    print(f"Capacity update for clinic {code} queued.")
+    return True
 
 
 
@@ -576,21 +1264,21 @@ def sign_up_command():
     user_type = input("Enter your user type (Patient/Staff): ")
 
     # Validate user type
-    if user_type.lower() not in [UserType.PATIENT.lower(), UserType.STAFF.lower()]:
+    user_types = {'patient': UserType.PATIENT, 'staff': UserType.STAFF}
+    if user_type.lower() not in user_types:
         print("Invalid user type. Please choose either Patient or Staff.")
         return None
 
     # Create a new User object
-    new_user = User(username=username, password=password, user_type=user_type)
+    new_user = User(None, username, None, password, user_types[user_type.lower()])
 
-    # Add additional details if needed
-    if user_type.lower() == UserType.PATIENT.lower():
-        # Additional details for patients
-        new_user.email = input("Enter your email: ")
+    # The Users table requires an email for every account
+    new_user.email = input("Enter your email: ")
 
-    # Add logic for storing the user details in a database or list
-    # For example, you might have a list like this:
-    users.append(new_user)
+    # Store the user in the Users table and the user registry
+    new_user.sign_up()
+    if new_user.user_id is None:
+        return None
 
     print("Sign up successful!")
     return new_user
@@ -601,12 +1289,13 @@ def log_in_command():
     username = input("Enter your username: ")
     password = input("Enter your password: ")
 
-    # Find the user in the list or database
-    user = next((u for u in users if u.username == username and u.password == password), None)
+    # Find the user in the registry
+    record = get_repositories().users.get_by_username(username)
 
-    if user:
+    if record and record['password'] == password:
         print("Login successful!")
-        return user
+        user_type = UserType.PATIENT if record['user_type'] == UserType.PATIENT.value else UserType.STAFF
+        return User(record['user_id'], record['username'], record['email'], record['password'], user_type)
     else:
         print("Invalid username or password. Please try again.")
         return None
@@ -620,16 +1309,40 @@ def handle_patient_command(user, choice):
         user.view_appointments()
     elif choice == "3":
         # Book Appointment
+        service = input("Enter a service to search for (leave empty for any): ").strip()
+        suggestions = find_earliest_slots(5, service=service or None)
+        if suggestions:
+            print("Earliest available slots:")
+            for slot_time, slot_clinic in suggestions:
+                print(f"  {slot_time} at clinic {slot_clinic}")
+        else:
+            print("No open slots found.")
         date_time = input("Enter the date and time for the appointment (YYYY-MM-DD HH:MM): ")
         clinic_id = int(input("Enter the clinic ID for the appointment: "))
         new_appointment = Appointment(status=AppointmentStatus.PENDING, date_time=date_time, user_id=user.user_id, clinic_id=clinic_id)
-        new_appointment.register_patient_appointment()
+        hold = new_appointment.hold_patient_slot()
+        result = None
+        if hold is None:
+            result = BookingResult(BookingStatus.CONFLICT, clinic_id, date_time)
+        elif input(f"The slot is held for you for {DEFAULT_HOLD_SECONDS // 60} minutes. "
+                   f"Confirm the booking? (y/n): ").strip().lower() == "y":
+            result = new_appointment.confirm_patient_hold(hold['hold_id'])
+        else:
+            new_appointment.release_patient_hold(hold['hold_id'])
+            print("The slot was released.")
+        if result and result.booked:
+            print(f"Appointment {result.appointment_id} registered successfully.")
+        elif result:
+            print("This time slot is already booked.")
+            if input("Join the waitlist for this day? (y/n): ").strip().lower() == "y":
+                user.join_waitlist(clinic_id, local_slot(date_time)[1][:10])
     elif choice == "4":
         # Cancel Appointment
         appointment_id = int(input("Enter the appointment ID to cancel: "))
-        appointment_to_cancel = next((appt for appt in appointments if appt['appointment_id'] == appointment_id), None)
+        appointment_to_cancel = get_repositories().appointments.get(appointment_id)
         if appointment_to_cancel:
             cancel_appointment = Appointment(AppointmentStatus.PENDING, appointment_to_cancel['date_time'], user.user_id, appointment_to_cancel['clinic_id'])
+            cancel_appointment.appointment_id = appointment_id
             cancel_appointment.cancel_patient_appointment()
         else:
             print("Appointment not found.")
@@ -671,6 +1384,9 @@ def handle_admin_command(user, choice):
 
 def main():
     print("Welcome to the Clinic Reservation System!")
+    migrate()
+    # Sends capacity updates left in the outbox by an earlier run.
+    get_capacity_outbox()
 
     current_user = None
 
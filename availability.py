@@ -0,0 +1,161 @@
+import heapq
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+
+from database import get_db_connection
+from timeslots import epoch_seconds, local_slot
+
+
+def to_minutes(value):
+    """
+    Converts a datetime, an ISO date and time string (naive ones are local
+    time) or epoch seconds to whole minutes since 1970-01-01 UTC.
+    """
+    return epoch_seconds(value) // 60
+
+
+def from_minutes(minutes):
+    """
+    Converts minutes since 1970-01-01 UTC back to a local "YYYY-MM-DD HH:MM" string.
+    """
+    return local_slot(minutes * 60)[1]
+
+
+# Open slots with at least one seat left.
+FREE_SLOTS_QUERY = "SELECT clinic_id, starts_at FROM Slots WHERE reserved + held < capacity"
+
+
+class AvailabilityIndex:
+    """
+    Precomputed free slots of every clinic, used to answer "earliest available
+    slot" searches without touching the database.
+
+    Each clinic's free slots are a sorted array of minutes since 1970, which
+    keeps a year of 15-minute slots for a thousand clinics in tens of MB. A
+    search bisects each candidate clinic's array and merges the heads with a
+    heap, so it costs O(clinics * log slots + n log clinics).
+    """
+    def __init__(self):
+        self._free = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Rebuilds the index from the Slots table.
+        """
+        free = {}
+        with get_db_connection() as conn:
+            for clinic_id, starts_at in conn.execute(FREE_SLOTS_QUERY + " ORDER BY clinic_id, starts_at"):
+                free.setdefault(clinic_id, array('q')).append(starts_at // 60)
+        with self._lock:
+            self._free = free
+        return self
+
+    def reload_clinic(self, clinic_id):
+        """
+        Rebuilds one clinic's free slots, e.g. after new capacity was opened.
+        """
+        with get_db_connection() as conn:
+            minutes = array('q', sorted(starts_at // 60 for _, starts_at in conn.execute(
+                FREE_SLOTS_QUERY + " AND clinic_id = ?", (clinic_id,))))
+        with self._lock:
+            self._free[clinic_id] = minutes
+
+    def add_free(self, clinic_id, date_times):
+        """
+        Adds free slots to a clinic. Slots that are already listed are ignored.
+        """
+        with self._lock:
+            slots = self._free.setdefault(clinic_id, array('q'))
+            for date_time in date_times:
+                minute = to_minutes(date_time)
+                i = bisect_left(slots, minute)
+                if i == len(slots) or slots[i] != minute:
+                    slots.insert(i, minute)
+
+    def mark_booked(self, clinic_id, date_time):
+        """
+        Removes a slot from a clinic's free slots, e.g. when its last seat was taken.
+        Returns False if it was not free.
+        """
+        minute = to_minutes(date_time)
+        with self._lock:
+            slots = self._free.get(clinic_id)
+            if not slots:
+                return False
+            i = bisect_left(slots, minute)
+            if i < len(slots) and slots[i] == minute:
+                del slots[i]
+                return True
+            return False
+
+    def mark_free(self, clinic_id, date_time):
+        """
+        Puts a slot back among a clinic's free slots, e.g. when a seat was released.
+        """
+        self.add_free(clinic_id, [date_time])
+
+    def free_count(self, clinic_id=None):
+        """
+        Returns the number of free slots of one clinic, or of all clinics.
+        """
+        if clinic_id is not None:
+            return len(self._free.get(clinic_id, ()))
+        return sum(len(slots) for slots in self._free.values())
+
+    def earliest(self, n=5, start=None, end=None, clinic_ids=None):
+        """
+        Returns the n earliest free slots across clinics as (date_time, clinic_id) pairs.
+
+        Attributes:
+        - n: Number of slots to return.
+        - start: Only return slots at or after this time. Defaults to now.
+        - end: Only return slots before this time.
+        - clinic_ids: Only search these clinics. Defaults to all clinics.
+        """
+        low = to_minutes(start if start is not None else datetime.now())
+        high = to_minutes(end) if end is not None else None
+        heads = []
+        with self._lock:
+            candidates = self._free if clinic_ids is None else {
+                clinic_id: self._free[clinic_id] for clinic_id in clinic_ids if clinic_id in self._free}
+            for clinic_id, slots in candidates.items():
+                i = bisect_left(slots, low)
+                if i < len(slots) and (high is None or slots[i] < high):
+                    heads.append((slots[i], clinic_id, i))
+            heapq.heapify(heads)
+            found = []
+            while heads and len(found) < n:
+                minute, clinic_id, i = heapq.heappop(heads)
+                found.append((from_minutes(minute), clinic_id))
+                slots = candidates[clinic_id]
+                if i + 1 < len(slots) and (high is None or slots[i + 1] < high):
+                    heapq.heappush(heads, (slots[i + 1], clinic_id, i + 1))
+        return found
+
+
+_availability = None
+_availability_lock = threading.Lock()
+
+
+def get_availability():
+    """
+    Returns the shared availability index, loading it from the database on first use.
+    """
+    global _availability
+    with _availability_lock:
+        if _availability is None:
+            _availability = AvailabilityIndex().load()
+        return _availability
+
+
+def refresh_clinic(clinic_id):
+    """
+    Reloads one clinic in the shared availability index, if the index has been built.
+    """
+    with _availability_lock:
+        availability = _availability
+    if availability is not None:
+        availability.reload_clinic(clinic_id)
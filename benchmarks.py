@@ -0,0 +1,870 @@
+"""
+Benchmarks and stress checks for the Clinic Reservation System.
+
+Each benchmark runs against a throwaway database in a temporary directory.
+Run them all with `python benchmarks.py`, or one by name, for example
+`python benchmarks.py concurrent_booking`.
+"""
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, redirect_stdout
+from datetime import date, datetime, timedelta, timezone
+
+import availability
+import capacity_outbox
+import circuit_breaker
+import database
+import holds
+import http_client
+import response_cache
+import schema
+import repository
+import service_index
+import waitlist
+
+# Module-level shared objects, created on first use by each module's get_*()
+# function and guarded by a lock of the same name with a _lock suffix.
+SHARED_OBJECTS = (
+    (repository, '_repositories'),
+    (availability, '_availability'),
+    (waitlist, '_waitlist'),
+    (holds, '_holds'),
+    (service_index, '_service_index'),
+    (capacity_outbox, '_capacity_outbox'),
+    (http_client, '_http_client'),
+    (response_cache, '_caches'),
+    (circuit_breaker, '_breakers'),
+)
+
+
+def reset_shared_objects():
+    """
+    Drops every shared object so the next get_*() call builds a new one
+    against the current database. Background threads are stopped and HTTP
+    connections closed first.
+    """
+    for module, name in SHARED_OBJECTS:
+        with getattr(module, name + '_lock'):
+            shared = getattr(module, name)
+            setattr(module, name, {} if isinstance(shared, dict) else None)
+        if hasattr(shared, 'stop'):
+            shared.stop()
+        elif hasattr(shared, 'close'):
+            shared.close()
+
+
+@contextmanager
+def scratch_database(pool_size=8, schema_version=schema.SCHEMA_VERSION):
+    """
+    Points the shared connection manager at a fresh, migrated database for the
+    duration of a benchmark, with the shared objects rebuilt against it.
+    """
+    previous = database.connection_manager
+    with tempfile.TemporaryDirectory() as tmp:
+        database.connection_manager = database.ConnectionManager(os.path.join(tmp, 'bench.db'), pool_size=pool_size)
+        reset_shared_objects()
+        try:
+            schema.migrate(schema_version)
+            yield database.connection_manager
+        finally:
+            database.connection_manager.close_all()
+            database.connection_manager = previous
+            reset_shared_objects()
+
+
+@contextmanager
+def stand_in_server(respond):
+    """
+    Serves HTTP on a free local port for the duration of a benchmark, with
+    keep-alive. respond(handler) returns (status, body) for each request;
+    body is encoded as JSON. Yields the server's base URL.
+    """
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out as separate writes; without this, delayed
+        # ACKs stall every reply on a kept-alive connection by ~40 ms.
+        disable_nagle_algorithm = True
+
+        def _reply(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            self.body = self.rfile.read(length) if length else b''
+            status, payload = respond(self)
+            data = json.dumps(payload).encode()
+            try:
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up waiting, e.g. a timeout being tested.
+                self.close_connection = True
+
+        do_GET = do_POST = _reply
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def seed(users=0, clinics=0):
+    """
+    Inserts numbered users and clinics so foreign keys resolve.
+    """
+    with database.get_db_connection() as conn:
+        conn.executemany("INSERT INTO Users (username, email, password, user_type) VALUES (?, ?, ?, ?)",
+                         ((f"user{i}", f"user{i}@example.com", "secret", "patient") for i in range(1, users + 1)))
+        conn.executemany("INSERT INTO Clinics (name, address, phone_info) VALUES (?, ?, ?)",
+                         ((f"Clinic {i}", f"{i} Health St.", "555-0100") for i in range(1, clinics + 1)))
+
+
+def bench_concurrent_booking(threads=32, attempts_per_thread=200, clinics=4, slots_per_clinic=50, capacity=3):
+    """
+    Many threads race to book a small set of slots, first with one seat per
+    slot and then with several. Every slot must end up with exactly as many
+    live appointments as it has seats and every other attempt must report a
+    conflict. Half of the threads give the slot times with a UTC offset
+    instead of as local time, which must not open extra seats.
+    """
+    for seats in sorted({1, capacity}):
+        _race_for_slots(threads, attempts_per_thread, clinics, slots_per_clinic, seats)
+
+
+def _race_for_slots(threads, attempts_per_thread, clinics, slots_per_clinic, capacity):
+    from ap_project_phase1 import Appointment, AppointmentStatus, BookingStatus
+    from capacity import add_slots
+
+    first_day = datetime(2024, 1, 1, 10, 0)
+    slots = [(clinic_id, (first_day + timedelta(days=day)).strftime("%Y-%m-%d %H:%M"))
+             for clinic_id in range(1, clinics + 1) for day in range(slots_per_clinic)]
+    with scratch_database(pool_size=threads):
+        seed(users=threads, clinics=clinics)
+        for clinic_id in range(1, clinics + 1):
+            add_slots(clinic_id, [date_time for slot_clinic, date_time in slots if slot_clinic == clinic_id], capacity)
+        booked = [0] * threads
+        conflicts = [0] * threads
+        start_line = threading.Barrier(threads)
+
+        def worker(index):
+            start_line.wait()
+            for attempt in range(attempts_per_thread):
+                clinic_id, date_time = slots[(index * 7 + attempt) % len(slots)]
+                if index % 2:
+                    zone = timezone(timedelta(hours=index % 5 - 2))
+                    date_time = datetime.fromisoformat(date_time).astimezone(zone).isoformat()
+                appointment = Appointment(AppointmentStatus.PENDING, date_time, index + 1, clinic_id)
+                result = appointment.register_patient_appointment()
+                if result.status == BookingStatus.BOOKED:
+                    booked[index] += 1
+                else:
+                    conflicts[index] += 1
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        with database.get_db_connection() as conn:
+            overbooked = conn.execute(
+                "SELECT COUNT(*) FROM (SELECT 1 FROM Appointments WHERE status != 'canceled' "
+                "GROUP BY clinic_id, starts_at HAVING COUNT(*) > ?)", (capacity,)).fetchone()[0]
+            live = conn.execute("SELECT COUNT(*) FROM Appointments WHERE status != 'canceled'").fetchone()[0]
+
+    total = threads * attempts_per_thread
+    print(f"concurrent_booking: {capacity} seat(s) per slot, {total} attempts from {threads} threads in "
+          f"{elapsed:.2f}s ({total / elapsed:,.0f}/s), {sum(booked)} booked, {sum(conflicts)} conflicts, "
+          f"{overbooked} overbooked slots")
+    assert overbooked == 0, "a slot took more appointments than it has seats"
+    assert sum(booked) == live == len(slots) * capacity, "booked count does not match the number of seats"
+
+
+def bench_bulk_notifications(recipients=200000, chunk_size=5000):
+    """
+    Broadcasts one message to a generated recipient list and checks every row landed.
+    """
+    from ap_project_phase1 import Notification
+
+    with scratch_database():
+        seed(users=1)
+        # Notifications.username references Users, so every recipient is user1.
+        stats = Notification.send_bulk_notifications(({'username': 'user1'} for _ in range(recipients)),
+                                                     "Clinic closed on Friday.", chunk_size=chunk_size)
+        with database.get_db_connection() as conn:
+            stored = conn.execute("SELECT COUNT(*) FROM Notifications").fetchone()[0]
+
+    assert stored == stats['sent'] == recipients, "some notifications were not stored"
+
+
+def bench_login_latency(sizes=(1000, 10000, 100000, 1000000), logins=20000, active_users=5000):
+    """
+    Measures User.login against user bases of growing size, with logins
+    spread over a fixed set of active users. A first login looks the user up
+    through the unique username index and later ones are served from the
+    bounded cache, so the per-login cost should stay flat as the Users table
+    grows and the cache should not grow with it.
+    """
+    from ap_project_phase1 import User, UserType
+
+    for size in sizes:
+        with scratch_database():
+            seed(users=size)
+            active = random.sample(range(1, size + 1), min(active_users, size))
+            candidates = [User(None, f"user{random.choice(active)}", None, None, UserType.PATIENT)
+                          for _ in range(logins)]
+            with redirect_stdout(io.StringIO()):
+                started = time.perf_counter()
+                succeeded = sum(user.login("secret") for user in candidates)
+                elapsed = time.perf_counter() - started
+            users = repository.get_repositories().users
+            stats = users.stats()
+            hit_ratio = users.ids_by_username.stats()['hit_ratio']
+        print(f"login_latency: {size:>9,} users, {elapsed / logins * 1e6:.2f} us per login, "
+              f"{hit_ratio:.0%} username cache hits, {stats['size']:,} users cached")
+        assert succeeded == logins, "some logins failed"
+        assert stats['size'] <= repository.DEFAULT_CACHE_SIZE
+
+
+def bench_capacity_template(clinics=100, days=91):
+    """
+    Opens a quarter of weekday 08:00-18:00 schedules in 15-minute slots for many
+    clinics, then applies the same templates again to check that existing
+    slots are skipped.
+    """
+    from capacity import CapacityTemplate, apply_template
+
+    start = date(2024, 1, 1)
+    template = CapacityTemplate(['mon', 'tue', 'wed', 'thu', 'fri'], "08:00", "18:00", 15,
+                                start, start + timedelta(days=days - 1))
+    with scratch_database():
+        seed(clinics=clinics)
+        started = time.perf_counter()
+        inserted = sum(apply_template(clinic_id, template)['inserted'] for clinic_id in range(1, clinics + 1))
+        elapsed = time.perf_counter() - started
+        skipped = apply_template(1, template)['skipped']
+    print(f"capacity_template: {inserted:,} slots for {clinics} clinics in {elapsed:.2f}s "
+          f"({inserted / elapsed:,.0f}/s)")
+    assert inserted == clinics * len(template.generate()) and skipped == len(template.generate())
+
+
+def bench_earliest_slots(clinics=1000, days=365, queries=2000, service_share=10):
+    """
+    Searches for the five earliest free slots across a year of weekday
+    08:00-18:00 half-hour slots at many clinics, over all clinics and over a
+    subset standing in for the clinics offering one service.
+    """
+    from capacity import CapacityTemplate
+
+    start = date(2024, 1, 1)
+    slots = CapacityTemplate(['mon', 'tue', 'wed', 'thu', 'fri'], "08:00", "18:00", 30,
+                             start, start + timedelta(days=days - 1)).generate()
+    index = availability.AvailabilityIndex()
+    for clinic_id in range(1, clinics + 1):
+        # Every other slot is free, offset per clinic, so the clinics' free slots interleave.
+        index.add_free(clinic_id, slots[clinic_id % 7::2])
+    subset = list(range(1, clinics + 1, service_share))
+    starts = [datetime(2024, 1, 1) + timedelta(minutes=random.randrange(days * 24 * 60)) for _ in range(queries)]
+
+    for label, clinic_ids in (('all clinics', None), (f'{len(subset)} clinics', subset)):
+        worst = 0.0
+        started = time.perf_counter()
+        for query_start in starts:
+            began = time.perf_counter()
+            found = index.earliest(5, start=query_start, clinic_ids=clinic_ids)
+            worst = max(worst, time.perf_counter() - began)
+            assert [slot for slot, _ in found] == sorted(slot for slot, _ in found)
+        elapsed = time.perf_counter() - started
+        print(f"earliest_slots: {label}, {index.free_count():,} free slots, "
+              f"{elapsed / queries * 1e3:.2f} ms per search, worst {worst * 1e3:.2f} ms")
+        assert elapsed / queries < 0.010, "searches are slower than 10 ms"
+
+
+def bench_day_calendars(clinics=1000, days=366, intersections=10000):
+    """
+    Builds a year of 15-minute day calendars for a clinic network, then measures
+    their memory, whole-year utilization and free-slot intersection across clinics.
+    """
+    from day_calendar import CalendarStore, slot_mask
+
+    start = date(2024, 1, 1)
+    store = CalendarStore(start, days)
+    opening_hours = slot_mask("08:00", "18:00")
+    rng = random.Random(13)
+    for clinic_id in range(1, clinics + 1):
+        calendar = store.calendar(clinic_id)
+        for n in range(days):
+            day = start + timedelta(days=n)
+            if day.weekday() < 5:
+                calendar.set_open(day, opening_hours)
+                calendar.book(day, rng.getrandbits(96) & opening_hours)
+
+    started = time.perf_counter()
+    utilization = store.utilization()
+    utilization_elapsed = time.perf_counter() - started
+    groups = [(rng.sample(range(1, clinics + 1), 5), start + timedelta(days=rng.randrange(days)))
+              for _ in range(intersections)]
+    started = time.perf_counter()
+    for clinic_ids, day in groups:
+        store.free_everywhere(clinic_ids, day)
+    intersect_elapsed = time.perf_counter() - started
+    print(f"day_calendars: {clinics} clinics x {days} days in {store.nbytes / 2**20:.1f} MB, "
+          f"utilization of all clinics in {utilization_elapsed * 1e3:.1f} ms, "
+          f"5-clinic intersection in {intersect_elapsed / intersections * 1e6:.1f} us")
+    assert 0.4 < sum(utilization.values()) / clinics < 0.6
+
+
+def bench_bulk_reschedule(appointments=5000, single=500):
+    """
+    Moves a block of booked appointments to later free slots in one batch and
+    compares the per-appointment cost with rescheduling one at a time.
+    """
+    from ap_project_phase1 import Appointment, AppointmentStatus
+    from capacity import add_slots
+
+    start = datetime(2030, 1, 1)
+    times = [(start + timedelta(minutes=30 * n)).strftime("%Y-%m-%d %H:%M")
+             for n in range(2 * appointments + 2 * single)]
+    with scratch_database():
+        seed(users=1, clinics=1)
+        add_slots(1, times)
+        booked = []
+        with redirect_stdout(io.StringIO()):
+            for date_time in times[:appointments + single]:
+                appointment = Appointment(AppointmentStatus.PENDING, date_time, 1, 1)
+                appointment.register_patient_appointment()
+                booked.append(appointment)
+            targets = times[appointments + single:]
+            started = time.perf_counter()
+            results = Appointment.move_appointments(
+                (appointment.appointment_id, date_time) for appointment, date_time in zip(booked, targets))
+            batch_elapsed = time.perf_counter() - started
+            started = time.perf_counter()
+            for appointment, date_time in zip(booked[appointments:], targets[appointments:]):
+                appointment.reschedule_patient_appointment(date_time)
+            single_elapsed = time.perf_counter() - started
+        with database.get_db_connection() as conn:
+            moved = conn.execute("SELECT COUNT(*) FROM Appointments WHERE date_time >= ?",
+                                 (targets[0],)).fetchone()[0]
+    print(f"bulk_reschedule: {appointments:,} moves in one batch in {batch_elapsed:.2f}s "
+          f"({batch_elapsed / appointments * 1e6:.0f} us each), one at a time "
+          f"{single_elapsed / single * 1e6:.0f} us each")
+    assert all(result.booked for result in results) and moved == appointments + single
+
+
+def bench_waitlist_backfill(clinics=100, days=30, waiters=200000, cancellations=5000):
+    """
+    Cancels booked appointments while a large waitlist is waiting and checks
+    that every freed seat is booked for a waiter. The waiters are inserted
+    straight into the table, as another process would, and each backfill
+    reads only the queue index entries of the freed slot's clinic and day,
+    so the rate should not depend on the size of the waitlist.
+    """
+    from ap_project_phase1 import Appointment, AppointmentStatus
+    from capacity import add_slots
+    from notification_dispatcher import get_dispatcher
+
+    start = date(2030, 1, 1)
+    day_names = [(start + timedelta(days=n)).isoformat() for n in range(days)]
+    rng = random.Random(16)
+    with scratch_database():
+        seed(users=1000, clinics=clinics)
+        for clinic_id in range(1, clinics + 1):
+            add_slots(clinic_id, [f"{day} {hour:02d}:00" for day in day_names for hour in range(8, 18)])
+        booked = []
+        with redirect_stdout(io.StringIO()):
+            for clinic_id, day, hour in rng.sample([(c, d, h) for c in range(1, clinics + 1)
+                                                    for d in day_names for h in range(8, 18)], cancellations):
+                appointment = Appointment(AppointmentStatus.PENDING, f"{day} {hour:02d}:00", 1, clinic_id)
+                appointment.register_patient_appointment()
+                booked.append(appointment)
+        requested_at = datetime(2029, 12, 1).isoformat()
+        repository.get_repositories().waitlist.add_many(
+            ((rng.randint(2, 1000), rng.randint(1, clinics), rng.choice(day_names), rng.randint(0, 9),
+              requested_at, 'waiting') for _ in range(waiters)),
+            ('user_id', 'clinic_id', 'day', 'priority', 'requested_at', 'status'))
+        with redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            for appointment in booked:
+                appointment.cancel_patient_appointment()
+            elapsed = time.perf_counter() - started
+            get_dispatcher().flush()
+        with database.get_db_connection() as conn:
+            backfilled = conn.execute("SELECT COUNT(*) FROM Waitlist WHERE status = 'booked'").fetchone()[0]
+            notified = conn.execute("SELECT COUNT(*) FROM Notifications").fetchone()[0]
+    print(f"waitlist_backfill: {cancellations:,} cancellations against {waiters:,} waiters in {elapsed:.2f}s "
+          f"({cancellations / elapsed * 60:,.0f}/min), {backfilled:,} backfilled")
+    assert backfilled == notified == cancellations, "a freed seat was not offered to the waitlist"
+
+
+def bench_hold_expiry(live_holds=(1000, 100000), expiring=1000):
+    """
+    Expires a fixed number of holds while a growing number of other holds stay
+    live. The sweep deletes only expired holds through the expiry index, so its
+    time should follow the number of expiring holds, not the number of live
+    ones, and it also releases the holds of a process that has exited.
+    """
+    from capacity import add_slots
+    from holds import SlotHolds
+    from timeslots import to_epoch
+
+    for live in live_holds:
+        with scratch_database():
+            seed(users=1, clinics=1)
+            times = [(datetime(2030, 1, 1) + timedelta(minutes=15 * n)).strftime("%Y-%m-%d %H:%M")
+                     for n in range(live + expiring)]
+            add_slots(1, times)
+            later = time.time() + 3600
+            with database.get_db_connection() as conn:
+                conn.executemany("INSERT INTO Holds (clinic_id, date_time, starts_at, user_id, expires_at) "
+                                 "VALUES (1, ?, ?, 1, ?)",
+                                 ((date_time, to_epoch(date_time)[0], later) for date_time in times[:live]))
+                conn.execute("UPDATE Slots SET held = 1 WHERE date_time < ?", (times[live],))
+            slot_holds = SlotHolds().load()
+            # Half of the expiring holds are made by another process that has since exited.
+            exited = SlotHolds()
+            for n, date_time in enumerate(times[live:]):
+                (exited if n % 2 else slot_holds).hold(1, 1, date_time, ttl=0)
+            started = time.perf_counter()
+            released = slot_holds.sweep()
+            elapsed = time.perf_counter() - started
+            with database.get_db_connection() as conn:
+                held = conn.execute("SELECT SUM(held) FROM Slots").fetchone()[0]
+        print(f"hold_expiry: {expiring:,} expiring among {live:,} live holds swept in {elapsed * 1e3:.1f} ms")
+        assert released == expiring and held == live and len(slot_holds) == live
+
+
+def bench_timestamp_ranges(appointments=200000, weeks=1000):
+    """
+    Converts appointments stored with differently spelled date_time text to
+    epoch timestamps (migration 8), then lists random weeks of one patient's
+    appointments, which must be index range scans on (user_id, starts_at).
+    """
+    from ap_project_phase1 import User, UserType
+    from timeslots import week_range
+
+    start = datetime(2030, 1, 7)
+    spellings = ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", " %Y-%m-%d %H:%M:%S.000 ")
+    with scratch_database(schema_version=7):
+        seed(users=1, clinics=1)
+        with database.get_db_connection() as conn:
+            conn.executemany("INSERT INTO Appointments (status, date_time, user_id, clinic_id) VALUES (?, ?, 1, 1)",
+                             (('pending', (start + timedelta(minutes=30 * n)).strftime(spellings[n % 3]))
+                              for n in range(appointments)))
+        started = time.perf_counter()
+        schema.migrate()
+        migrate_elapsed = time.perf_counter() - started
+        user = User(1, 'user1', 'user1@example.com', 'secret', UserType.PATIENT)
+        with database.get_db_connection() as conn:
+            plan = ' '.join(row[-1] for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT appointment_id FROM Appointments "
+                "WHERE user_id = ? AND starts_at >= ? AND starts_at < ?", (1, *week_range(start))))
+        full_weeks = appointments // (48 * 7)
+        started = time.perf_counter()
+        for _ in range(weeks):
+            week = start + timedelta(weeks=random.randrange(full_weeks))
+            low, high = week_range(week)
+            found = sum(1 for _ in user.iter_appointments(start=low, end=high))
+            assert found == 48 * 7, f"week of {week:%Y-%m-%d} has {found} appointments"
+        query_elapsed = time.perf_counter() - started
+    print(f"timestamp_ranges: {appointments:,} appointments converted in {migrate_elapsed:.2f}s, "
+          f"week listing in {query_elapsed / weeks * 1e3:.2f} ms")
+    assert 'idx_appointments_user_starts' in plan, plan
+
+
+def bench_clinic_pages(appointments=1000000, page_size=50, deep_page=1000, repeats=200):
+    """
+    Lists one clinic's schedule a page at a time and compares fetching the
+    first page with fetching a deep one through the keyset cursor, and with
+    the same deep page fetched with OFFSET.
+    """
+    from ap_project_phase1 import list_clinic_appointments
+    from timeslots import to_epoch
+
+    first, offset = to_epoch(datetime(2030, 1, 1))
+    with scratch_database():
+        seed(users=1, clinics=2)
+        with database.get_db_connection() as conn:
+            # Two clinics interleaved, so the index has to skip the other clinic's rows.
+            conn.executemany("INSERT INTO Appointments (status, date_time, user_id, clinic_id, starts_at, tz_offset) "
+                             "VALUES ('pending', '', 1, ?, ?, ?)",
+                             ((n % 2 + 1, first + 900 * (n // 2), offset) for n in range(appointments)))
+            skipped = (deep_page - 1) * page_size
+            cursor = conn.execute("SELECT starts_at, appointment_id FROM Appointments WHERE clinic_id = 1 "
+                                  "ORDER BY starts_at, appointment_id LIMIT 1 OFFSET ?", (skipped - 1,)).fetchone()
+        start, end = first, first + 900 * appointments
+
+        def timed(after):
+            started = time.perf_counter()
+            for _ in range(repeats):
+                page = list_clinic_appointments(1, start, end, after=after, limit=page_size)
+            return (time.perf_counter() - started) / repeats, page
+
+        first_elapsed, first_page = timed(None)
+        deep_elapsed, deep = timed(cursor)
+        started = time.perf_counter()
+        with database.get_db_connection() as conn:
+            for _ in range(repeats // 10):
+                conn.execute("SELECT * FROM Appointments WHERE clinic_id = 1 AND starts_at >= ? AND starts_at < ? "
+                             "ORDER BY starts_at, appointment_id LIMIT ? OFFSET ?",
+                             (start, end, page_size, skipped)).fetchall()
+        offset_elapsed = (time.perf_counter() - started) / (repeats // 10)
+    print(f"clinic_pages: {appointments:,} appointments, page 1 in {first_elapsed * 1e3:.2f} ms, "
+          f"page {deep_page:,} in {deep_elapsed * 1e3:.2f} ms by cursor, {offset_elapsed * 1e3:.2f} ms by OFFSET")
+    assert len(first_page['appointments']) == len(deep['appointments']) == page_size
+    assert deep['appointments'][0]['starts_at'] == first + 900 * skipped
+    assert deep_elapsed < 3 * first_elapsed
+
+
+def bench_service_lookup(clinics=10000, services_per_clinic=5, names=500, lookups=20000):
+    """
+    Finds the clinics offering a service by name prefix through the inverted
+    service index, and compares it with a scan of the Services table.
+    """
+    specialties = [f"Specialty {i:03d} care" for i in range(names)]
+    with scratch_database():
+        seed(clinics=clinics)
+        with database.get_db_connection() as conn:
+            conn.executemany("INSERT INTO Services (clinic_id, name) VALUES (?, ?)",
+                             ((clinic_id, random.choice(specialties).upper() if n % 2 else random.choice(specialties))
+                              for clinic_id in range(1, clinics + 1) for n in range(services_per_clinic)))
+        started = time.perf_counter()
+        index = service_index.get_service_index()
+        load_elapsed = time.perf_counter() - started
+        prefixes = [f"specialty {random.randrange(names):03d}" for _ in range(lookups)]
+        started = time.perf_counter()
+        found = [index.clinics_with_prefix(prefix) for prefix in prefixes]
+        index_elapsed = time.perf_counter() - started
+        started = time.perf_counter()
+        with database.get_db_connection() as conn:
+            scanned = [{clinic_id for (clinic_id,) in conn.execute(
+                "SELECT DISTINCT clinic_id FROM Services WHERE lower(name) LIKE ? || '%'", (prefix,))}
+                for prefix in prefixes[:lookups // 100]]
+        scan_elapsed = time.perf_counter() - started
+        # A new clinic is searchable as soon as it is added.
+        clinic = repository.get_repositories().clinics.add(
+            {'name': 'New clinic', 'address': '1 New St.', 'services': ['  Rare   Specialty ']})
+        assert index.clinics_with_prefix('rare spec') == {clinic['clinic_id']}
+    print(f"service_lookup: {len(index)} service names over {clinics:,} clinics indexed in "
+          f"{load_elapsed * 1e3:.0f} ms, prefix lookup in {index_elapsed / lookups * 1e6:.1f} us, "
+          f"table scan in {scan_elapsed / (lookups // 100) * 1e3:.2f} ms")
+    assert found[:lookups // 100] == scanned
+    assert index_elapsed / lookups < 1e-3
+
+
+def bench_http_client(calls=1000):
+    """
+    Calls a local stand-in slot API through the pooled client and with bare
+    requests.get, then checks retries of a flaky endpoint and the read timeout
+    of a hanging one.
+    """
+    import requests
+    from http_client import HTTPClient
+
+    failures = {'count': 0}
+
+    def respond(handler):
+        if handler.path == '/flaky':
+            failures['count'] += 1
+            if failures['count'] % 3:
+                return 503, {'error': 'busy'}
+        elif handler.path == '/slow':
+            time.sleep(1.0)
+        return 200, [{'date_time': '2030-01-01 09:00', 'clinic_id': 1}]
+
+    with stand_in_server(respond) as url:
+        client = HTTPClient(backoff=0.01)
+        started = time.perf_counter()
+        for _ in range(calls):
+            client.get(f"{url}/available").json()
+        pooled_elapsed = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(calls):
+            requests.get(f"{url}/available").json()
+        bare_elapsed = time.perf_counter() - started
+        flaky = [client.get(f"{url}/flaky").status_code for _ in range(10)]
+        started = time.perf_counter()
+        try:
+            client.get(f"{url}/slow", timeout=(1.0, 0.2), retries=0)
+            timed_out = False
+        except requests.Timeout:
+            timed_out = True
+        timeout_elapsed = time.perf_counter() - started
+        stats = client.stats()
+        client.close()
+    print(f"http_client: {pooled_elapsed / calls * 1e3:.2f} ms per pooled call, "
+          f"{bare_elapsed / calls * 1e3:.2f} ms per bare call, "
+          f"{stats[f'GET {url}/flaky']['retries']} retries for 10 flaky calls, "
+          f"hanging call cut off after {timeout_elapsed * 1e3:.0f} ms")
+    assert flaky == [200] * 10 and timed_out and timeout_elapsed < 0.5
+    assert stats[f"GET {url}/available"]['calls'] == calls and stats[f"GET {url}/slow"]['errors'] == 1
+
+
+def bench_available_cache(threads=32, calls_per_thread=300, ttl=0.2, upstream_delay=0.05):
+    """
+    Many threads read the available appointments through the stale-while-
+    revalidate cache in front of a slow local stand-in API. The API must see
+    about one call per TTL, never two at once.
+    """
+    from http_client import HTTPClient
+    from response_cache import ResponseCache
+
+    upstream = {'calls': 0, 'in_flight': 0, 'max_in_flight': 0}
+    upstream_lock = threading.Lock()
+
+    def respond(handler):
+        with upstream_lock:
+            upstream['calls'] += 1
+            upstream['in_flight'] += 1
+            upstream['max_in_flight'] = max(upstream['max_in_flight'], upstream['in_flight'])
+        time.sleep(upstream_delay)
+        with upstream_lock:
+            upstream['in_flight'] -= 1
+        return 200, [{'date_time': '2030-01-01 09:00', 'clinic_id': 1}]
+
+    with stand_in_server(respond) as url:
+        client = HTTPClient()
+        cache = ResponseCache(ttl=ttl, stale_ttl=10.0)
+
+        def fetch():
+            response = client.get(f"{url}/available")
+            response.raise_for_status()
+            return response.json()
+
+        def worker():
+            for _ in range(calls_per_thread):
+                assert cache.get('available', fetch)
+                time.sleep(0.001)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        client.close()
+    stats = cache.stats()
+    lookups = threads * calls_per_thread
+    print(f"available_cache: {lookups:,} lookups in {elapsed:.2f}s, {upstream['calls']} upstream calls, "
+          f"hit ratio {stats['hit_ratio']:.3f}, {stats['coalesced']} coalesced, "
+          f"max staleness served {stats['max_staleness'] * 1e3:.0f} ms")
+    assert upstream['max_in_flight'] == 1
+    assert upstream['calls'] <= elapsed / ttl + 2
+
+
+def bench_availability_fanout(endpoints=60, concurrency=20, delay=0.1, timeout=0.5):
+    """
+    Queries many stand-in clinic systems at once through the asyncio
+    aggregator. Some answer with an error and some hang; the rest must be
+    merged into one sorted list in about (endpoints / concurrency) round trips.
+    """
+    from http_client import HTTPClient
+    from slot_aggregator import fetch_available
+
+    def respond(handler):
+        clinic = int(handler.path.split('/')[2])
+        if clinic % 10 == 0:
+            return 500, {'error': 'down'}
+        time.sleep(2.0 if clinic % 15 == 7 else delay)
+        # Each system lists its own clinic's slots, newest first, to check the merge sorts them.
+        return 200, [{'date_time': f"2030-01-0{day} {clinic % 24:02d}:00", 'clinic_id': clinic}
+                     for day in (3, 2, 1)]
+
+    with stand_in_server(respond) as url:
+        client = HTTPClient(pool_size=concurrency)
+        urls = [f"{url}/clinic/{n}/available" for n in range(1, endpoints + 1)]
+        result = fetch_available(urls, concurrency=concurrency, timeout=timeout, client=client)
+        client.close()
+    failed = {n for n in range(1, endpoints + 1) if n % 10 == 0 or n % 15 == 7}
+    keys = [(slot['date_time'], slot['clinic_id']) for slot in result['slots']]
+    print(f"availability_fanout: {endpoints} endpoints, {concurrency} at a time, in {result['seconds']:.2f}s "
+          f"(serially at least {endpoints * delay:.1f}s), {len(result['slots'])} slots merged, "
+          f"{len(result['failed'])} endpoints failed")
+    assert {int(endpoint.split('/')[4]) for endpoint in result['failed']} == failed
+    assert len(keys) == 3 * (endpoints - len(failed)) and keys == sorted(keys)
+    assert result['seconds'] < (endpoints / concurrency + 1) * delay + timeout + 0.5
+
+
+def bench_capacity_outbox(clinics=20, updates=20000, failing_sends=30):
+    """
+    Queues a burst of capacity updates while the stand-in slot API rejects the
+    first sends. Queuing must not wait on the network, every clinic must end
+    up with its latest count, and coalescing must keep the API calls far
+    below the number of updates. Then updates are queued with no flusher
+    running, as after a crash, and a new flusher must deliver them.
+    """
+    import json
+    from http_client import HTTPClient
+
+    received = {}
+    calls = {'count': 0}
+    calls_lock = threading.Lock()
+
+    def respond(handler):
+        with calls_lock:
+            calls['count'] += 1
+            if calls['count'] <= failing_sends:
+                return 503, {'error': 'busy'}
+        payload = json.loads(handler.body)
+        received[payload['clinic code']] = payload['reserved appointments']
+        return 200, payload
+
+    retry_delay = capacity_outbox.RETRY_DELAY
+    capacity_outbox.RETRY_DELAY = 0.01
+    with stand_in_server(respond) as url, scratch_database():
+        client = HTTPClient()
+
+        def send(code, reserved):
+            response = client.post(f"{url}/slots", json={'clinic code': code, 'reserved appointments': reserved},
+                                   idempotent=True, retries=0)
+            response.raise_for_status()
+
+        try:
+            outbox = capacity_outbox.CapacityOutbox(send, flush_interval=0.01).start()
+            latest = {}
+            started = time.perf_counter()
+            for n in range(updates):
+                code = n % clinics + 1
+                latest[code] = n
+                capacity_outbox.enqueue_capacity_update(code, n)
+            enqueue_elapsed = time.perf_counter() - started
+            deadline = time.monotonic() + 30
+            while outbox.pending() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            outbox.stop()
+
+            for code in latest:
+                latest[code] += updates
+                capacity_outbox.enqueue_capacity_update(code, latest[code])
+            restarted = capacity_outbox.CapacityOutbox(send)
+            while restarted.flush():
+                pass
+            pending = restarted.pending()
+        finally:
+            capacity_outbox.RETRY_DELAY = retry_delay
+            client.close()
+    print(f"capacity_outbox: {updates:,} updates queued at {enqueue_elapsed / updates * 1e6:.0f} us each, "
+          f"{calls['count']} API calls ({outbox.failed} failed and retried), {outbox.sent} delivered by the "
+          f"first flusher, {restarted.sent} left over and delivered after a restart")
+    assert received == latest and pending == 0 and restarted.sent == clinics
+    assert calls['count'] < updates / 10
+
+
+def bench_circuit_breaker(failure_threshold=3, recovery_timeout=0.3, upstream_timeout=0.2, calls=200):
+    """
+    Takes one of two stand-in clinic systems down by making it hang. The
+    first failure_threshold fetches wait for the timeout; after that its
+    breaker is open and fetches must return the healthy system's slots
+    without waiting, while that system's breaker stays closed. A lookup of
+    the hung system alone must fall back to its last good answer, and one of
+    an endpoint never fetched to the local free slots. Once the system is
+    back, a trial fetch after recovery_timeout must close its breaker again.
+    """
+    import ap_project_phase1
+    from capacity import add_slots
+    from circuit_breaker import CLOSED, OPEN
+    from response_cache import get_cache
+
+    upstream = {'down': False, 'hung_calls': 0}
+
+    def respond(handler):
+        if handler.path == '/healthy':
+            return 200, [{'date_time': '2030-01-01 10:00', 'clinic_id': 2}]
+        upstream['hung_calls'] += 1
+        if upstream['down']:
+            time.sleep(1.0)
+        return 200, [{'date_time': '2030-01-01 09:00', 'clinic_id': 1}]
+
+    settings = {name: getattr(ap_project_phase1, name) for name in (
+        'AVAILABLE_APPOINTMENTS_TIMEOUT', 'AVAILABLE_APPOINTMENTS_FAILURE_THRESHOLD',
+        'AVAILABLE_APPOINTMENTS_RECOVERY_TIMEOUT')}
+    ap_project_phase1.AVAILABLE_APPOINTMENTS_TIMEOUT = upstream_timeout
+    ap_project_phase1.AVAILABLE_APPOINTMENTS_FAILURE_THRESHOLD = failure_threshold
+    ap_project_phase1.AVAILABLE_APPOINTMENTS_RECOVERY_TIMEOUT = recovery_timeout
+    with stand_in_server(respond) as url, scratch_database():
+        seed(clinics=1)
+        add_slots(1, ['2030-01-02 09:00', '2030-01-02 10:00'])
+        hung, healthy = f"{url}/hung", f"{url}/healthy"
+        breaker = ap_project_phase1.available_appointments_breaker(hung)
+        healthy_breaker = ap_project_phase1.available_appointments_breaker(healthy)
+        # Nothing is served stale: every lookup after the TTL calls the clinic systems.
+        get_cache('available_appointments', ttl=0.01, stale_ttl=0)
+        fetch = ap_project_phase1.fetch_available_appointments
+        try:
+            with redirect_stdout(io.StringIO()):
+                good_hung = fetch(endpoints=[hung])
+                good = fetch(endpoints=[hung, healthy])
+                upstream['down'] = True
+                hung_calls = upstream['hung_calls']
+                latencies = []
+                for _ in range(calls):
+                    time.sleep(0.01)
+                    started = time.perf_counter()
+                    assert fetch(endpoints=[hung, healthy]) == [slot for slot in good if slot['source'] == healthy]
+                    latencies.append(time.perf_counter() - started)
+                opened = breaker.state
+                calls_while_down = upstream['hung_calls'] - hung_calls
+                stale = fetch(endpoints=[hung])
+                local = fetch(endpoints=[f"{url}/never-fetched"])
+                upstream['down'] = False
+                time.sleep(recovery_timeout)
+                recovered = fetch(endpoints=[hung, healthy])
+        finally:
+            for name, value in settings.items():
+                setattr(ap_project_phase1, name, value)
+    # Only the fetches that opened the breaker and its half-open trials wait for the timeout.
+    waited = [seconds for seconds in latencies if seconds >= upstream_timeout]
+    fast = sorted(seconds for seconds in latencies if seconds < upstream_timeout)
+    print(f"circuit_breaker: {len(waited)} of {calls} fetches with one hung clinic system waited for the "
+          f"{upstream_timeout * 1e3:.0f} ms timeout ({failure_threshold} to open its breaker, the rest half-open "
+          f"trials), the others got the healthy system's slots in {fast[int(len(fast) * 0.95)] * 1e3:.2f} ms "
+          f"(p95); {len(local)} local slots served for unfetched endpoints, breaker {breaker.state} after recovery")
+    assert opened == OPEN and healthy_breaker.opened == 0
+    assert breaker.state == CLOSED and recovered == good and stale == good_hung
+    assert all(seconds >= upstream_timeout for seconds in latencies[:failure_threshold])
+    assert len(waited) == calls_while_down and fast[-1] < upstream_timeout / 2
+    assert [slot['source'] for slot in local] == ['local', 'local']
+
+BENCHMARKS = {
+    'concurrent_booking': bench_concurrent_booking,
+    'bulk_notifications': bench_bulk_notifications,
+    'login_latency': bench_login_latency,
+    'capacity_template': bench_capacity_template,
+    'earliest_slots': bench_earliest_slots,
+    'day_calendars': bench_day_calendars,
+    'bulk_reschedule': bench_bulk_reschedule,
+    'waitlist_backfill': bench_waitlist_backfill,
+    'hold_expiry': bench_hold_expiry,
+    'timestamp_ranges': bench_timestamp_ranges,
+    'clinic_pages': bench_clinic_pages,
+    'service_lookup': bench_service_lookup,
+    'http_client': bench_http_client,
+    'available_cache': bench_available_cache,
+    'availability_fanout': bench_availability_fanout,
+    'capacity_outbox': bench_capacity_outbox,
+    'circuit_breaker': bench_circuit_breaker,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
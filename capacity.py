@@ -0,0 +1,200 @@
+import time
+from datetime import date, timedelta
+
+from availability import refresh_clinic
+from database import get_db_connection, on_commit
+from timeslots import epoch_seconds, local_slot
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def _as_minutes(value):
+    """
+    Converts "HH:MM" to minutes after midnight.
+    """
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+class CapacityTemplate:
+    """
+    A recurring opening schedule, e.g. every Monday to Friday from 09:00 to
+    17:00 in 30-minute slots, for a date range.
+
+    Attributes:
+    - weekdays: Days the clinic opens, as numbers (0 is Monday) or names such as "mon".
+    - opening: Time of the first slot of the day ("HH:MM").
+    - closing: Time the last slot must end by ("HH:MM").
+    - slot_minutes: Length of one slot in minutes.
+    - start_date: First day of the range (date or "YYYY-MM-DD").
+    - end_date: Last day of the range, inclusive.
+    """
+    def __init__(self, weekdays, opening, closing, slot_minutes, start_date, end_date):
+        self.weekdays = {day if isinstance(day, int) else WEEKDAYS.index(day.lower()[:3]) for day in weekdays}
+        self.opening = opening
+        self.closing = closing
+        self.slot_minutes = slot_minutes
+        self.start_date = _as_date(start_date)
+        self.end_date = _as_date(end_date)
+
+    def generate(self):
+        """
+        Returns every slot of the template as a "YYYY-MM-DD HH:MM" string, in order.
+
+        The day strings and the time-of-day strings are each formatted once and
+        then combined, so the per-slot cost is a single string concatenation
+        rather than a datetime calculation.
+        """
+        first = _as_minutes(self.opening)
+        last = _as_minutes(self.closing) - self.slot_minutes
+        times = [f" {minute // 60:02d}:{minute % 60:02d}" for minute in range(first, last + 1, self.slot_minutes)]
+        day_count = (self.end_date - self.start_date).days + 1
+        days = [day.isoformat() for day in (self.start_date + timedelta(days=n) for n in range(day_count))
+                if day.weekday() in self.weekdays]
+        return [day + slot_time for day in days for slot_time in times]
+
+
+def add_slots(clinic_id, date_times, capacity=1):
+    """
+    Opens slots for a clinic in one transaction. Slots that already exist are skipped.
+
+    Attributes:
+    - clinic_id: The clinic the slots belong to.
+    - date_times: Iterable of "YYYY-MM-DD HH:MM" strings, or other forms local_slot() accepts.
+    - capacity: Number of appointments each slot takes, e.g. the number of doctors on duty.
+
+    Returns a dictionary with the number of slots inserted and skipped and the elapsed seconds.
+    """
+    started = time.perf_counter()
+    requested = 0
+
+    def rows():
+        nonlocal requested
+        for date_time in date_times:
+            requested += 1
+            yield (clinic_id, *local_slot(date_time), capacity)
+
+    with get_db_connection() as conn:
+        before = conn.total_changes
+        # The UNIQUE (clinic_id, starts_at) constraint does the deduplication.
+        conn.executemany("INSERT OR IGNORE INTO Slots (clinic_id, starts_at, date_time, capacity) "
+                         "VALUES (?, ?, ?, ?)", rows())
+        inserted = conn.total_changes - before
+        if inserted:
+            # Rebuilt from committed rows only, so a caller's rollback cannot leave it out of step.
+            on_commit(lambda: refresh_clinic(clinic_id))
+    return {'inserted': inserted, 'skipped': requested - inserted, 'seconds': time.perf_counter() - started}
+
+
+def apply_template(clinic_id, template, capacity=1):
+    """
+    Generates a template's slots and opens them for a clinic in one transaction.
+    """
+    return add_slots(clinic_id, template.generate(), capacity)
+
+
+# A seat of a slot is either booked (counted in `reserved`), held for a
+# patient who has not confirmed yet (`held`) or free.
+SEAT_COUNTERS = ('reserved', 'held')
+
+
+def reserve_seat(conn, clinic_id, date_time, counter='reserved'):
+    """
+    Takes one free seat of a slot with a single conditional upsert, inside the
+    caller's transaction. A time nobody opened becomes a one-seat slot.
+
+    Slots are identified by clinic and start moment, so date_time may be a
+    datetime, an ISO string with or without a UTC offset, or epoch seconds
+    (such as an appointment's starts_at).
+
+    Attributes:
+    - counter: "reserved" to book the seat, "held" to hold it.
+
+    Returns the number of seats left, or None if the slot was already full.
+    """
+    assert counter in SEAT_COUNTERS
+    row = conn.execute(
+        f"INSERT INTO Slots (clinic_id, starts_at, date_time, {counter}) VALUES (?, ?, ?, 1) "
+        f"ON CONFLICT (clinic_id, starts_at) DO UPDATE SET {counter} = {counter} + 1 "
+        f"WHERE reserved + held < capacity RETURNING capacity - reserved - held",
+        (clinic_id, *local_slot(date_time))).fetchone()
+    return row[0] if row else None
+
+
+def release_seat(conn, clinic_id, date_time, counter='reserved'):
+    """
+    Gives one booked (or, with counter="held", held) seat of a slot back, inside the caller's transaction.
+
+    Returns the number of seats left, or None if the slot had no such seat taken.
+    """
+    assert counter in SEAT_COUNTERS
+    row = conn.execute(
+        f"UPDATE Slots SET {counter} = {counter} - 1 WHERE clinic_id = ? AND starts_at = ? AND {counter} > 0 "
+        f"RETURNING capacity - reserved - held", (clinic_id, epoch_seconds(date_time))).fetchone()
+    return row[0] if row else None
+
+
+def book_held_seat(conn, clinic_id, date_time):
+    """
+    Turns one held seat of a slot into a booked one, inside the caller's transaction.
+
+    Returns False if the slot had no held seat.
+    """
+    return conn.execute("UPDATE Slots SET held = held - 1, reserved = reserved + 1 "
+                        "WHERE clinic_id = ? AND starts_at = ? AND held > 0",
+                        (clinic_id, epoch_seconds(date_time))).rowcount == 1
+
+
+def set_capacity(clinic_id, capacity, start=None, end=None):
+    """
+    Sets how many appointments each of a clinic's slots takes, e.g. the number
+    of doctors on duty. A slot never drops below the seats already booked or held.
+
+    Attributes:
+    - clinic_id: The clinic whose slots change.
+    - capacity: New number of seats per slot.
+    - start: First slot time to change ("YYYY-MM-DD HH:MM"). Defaults to every slot.
+    - end: Change slots before this time only.
+
+    Returns a dictionary with the number of slots updated and the seats reserved in them.
+    """
+    conditions = ["clinic_id = ?"]
+    params = [clinic_id]
+    if start is not None:
+        conditions.append("starts_at >= ?")
+        params.append(epoch_seconds(start))
+    if end is not None:
+        conditions.append("starts_at < ?")
+        params.append(epoch_seconds(end))
+    where = " AND ".join(conditions)
+    with get_db_connection() as conn:
+        updated = conn.execute(f"UPDATE Slots SET capacity = max(?, reserved + held) WHERE {where}",
+                               (capacity, *params)).rowcount
+        reserved = conn.execute(f"SELECT COALESCE(SUM(reserved), 0) FROM Slots WHERE {where}", params).fetchone()[0]
+        if updated:
+            on_commit(lambda: refresh_clinic(clinic_id))
+    return {'updated': updated, 'reserved': reserved}
+
+
+def reserved_seats(conn, clinic_id):
+    """
+    Returns the number of booked seats across all of a clinic's slots, inside the caller's transaction.
+    """
+    return conn.execute("SELECT COALESCE(SUM(reserved), 0) FROM Slots WHERE clinic_id = ?",
+                        (clinic_id,)).fetchone()[0]
+
+
+def slot_states(clinic_id, start, end):
+    """
+    Lists a clinic's slots in [start, end) with how many seats are booked, held and free.
+    """
+    with get_db_connection() as conn:
+        rows = conn.execute("SELECT date_time, capacity, reserved, held FROM Slots "
+                            "WHERE clinic_id = ? AND starts_at >= ? AND starts_at < ? ORDER BY starts_at",
+                            (clinic_id, epoch_seconds(start), epoch_seconds(end))).fetchall()
+    return [{'date_time': date_time, 'capacity': capacity, 'booked': reserved, 'held': held,
+             'free': capacity - reserved - held} for date_time, capacity, reserved, held in rows]
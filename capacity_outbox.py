@@ -0,0 +1,158 @@
+import atexit
+import threading
+import time
+
+from database import get_db_connection
+from http_client import get_http_client
+
+SLOT_API_URL = 'https://localhost/slots'
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 1.0
+# Seconds before the first retry of a failed send; doubled after each failure, up to MAX_RETRY_DELAY.
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 300.0
+
+
+def enqueue_capacity_update(code, reserved):
+    """
+    Records that a clinic's reserved-appointment count must be reported to the
+    external slot API. Runs in the caller's transaction when there is one, so
+    the update is stored if and only if the change it reports is.
+
+    A count still waiting to be sent for the same clinic is replaced: only the
+    latest value is ever sent. The shared flusher, if it is running, is woken
+    to send it; start it with get_capacity_outbox().
+    """
+    with get_db_connection() as conn:
+        conn.execute("INSERT INTO CapacityOutbox (clinic_code, reserved, next_attempt_at) VALUES (?, ?, ?) "
+                     "ON CONFLICT (clinic_code) DO UPDATE SET reserved = excluded.reserved, version = version + 1, "
+                     "attempts = 0, next_attempt_at = excluded.next_attempt_at, last_error = NULL",
+                     (code, reserved, time.time()))
+    with _capacity_outbox_lock:
+        outbox = _capacity_outbox
+    if outbox is not None:
+        outbox.wake()
+
+
+def post_capacity_update(code, reserved):
+    """
+    Reports one clinic's reserved-appointment count to the external slot API.
+    Raises requests.RequestException if it was not accepted.
+    """
+    # The outbox schedules its own retries, so a failed call is not repeated here.
+    response = get_http_client().post(SLOT_API_URL, json={'clinic code': code, 'reserved appointments': reserved},
+                                      idempotent=True, retries=0)
+    response.raise_for_status()
+
+
+class CapacityOutbox:
+    """
+    Delivers the updates stored in the CapacityOutbox table from a background thread.
+
+    Each flush reads up to batch_size due rows and sends them outside any
+    transaction, so bookings never wait on the network. A sent row is deleted
+    only if its version is unchanged; one updated while it was being sent
+    stays queued with its newer value. A failed send is retried later with
+    exponential backoff. Rows survive a crash and are sent after a restart.
+
+    Attributes:
+    - send: Function taking (code, reserved) that delivers one update or raises.
+    - batch_size: Largest number of updates sent per flush.
+    - flush_interval: Seconds between flushes when nothing wakes the flusher.
+    - sent, failed: Counters of deliveries and failed attempts.
+    """
+    def __init__(self, send=post_capacity_update, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.send = send
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sent = 0
+        self.failed = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def pending(self):
+        """
+        Returns the number of updates waiting to be sent.
+        """
+        with get_db_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM CapacityOutbox").fetchone()[0]
+
+    def flush(self, now=None):
+        """
+        Sends one batch of due updates. Returns the number delivered.
+        """
+        now = time.time() if now is None else now
+        with self._flush_lock:
+            with get_db_connection() as conn:
+                due = conn.execute("SELECT clinic_code, reserved, version, attempts FROM CapacityOutbox "
+                                   "WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                                   (now, self.batch_size)).fetchall()
+            delivered = []
+            failures = []
+            for code, reserved, version, attempts in due:
+                try:
+                    self.send(code, reserved)
+                    delivered.append((code, version))
+                except Exception as e:
+                    delay = min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** attempts)
+                    failures.append((now + delay, str(e) or type(e).__name__, code, version))
+            with get_db_connection() as conn:
+                conn.executemany("DELETE FROM CapacityOutbox WHERE clinic_code = ? AND version = ?", delivered)
+                conn.executemany("UPDATE CapacityOutbox SET attempts = attempts + 1, next_attempt_at = ?, "
+                                 "last_error = ? WHERE clinic_code = ? AND version = ?", failures)
+            self.sent += len(delivered)
+            self.failed += len(failures)
+            return len(delivered)
+
+    def wake(self):
+        """
+        Asks the flusher to run now rather than at the end of its interval.
+        """
+        self._wake.set()
+
+    def start(self):
+        """
+        Starts the background flusher thread if it is not already running.
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='capacity-outbox', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                # Keep going while full batches come back, so a burst drains without waiting.
+                while self.flush() == self.batch_size and not self._stop.is_set():
+                    pass
+            except Exception as e:
+                print(f"An error occurred while sending capacity updates: {e}")
+
+
+_capacity_outbox = None
+_capacity_outbox_lock = threading.Lock()
+
+
+def get_capacity_outbox():
+    """
+    Returns the shared capacity outbox, starting its flusher on first use.
+    """
+    global _capacity_outbox
+    with _capacity_outbox_lock:
+        if _capacity_outbox is None:
+            _capacity_outbox = CapacityOutbox().start()
+            atexit.register(_capacity_outbox.stop)
+        return _capacity_outbox
@@ -0,0 +1,168 @@
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Consecutive failures that open the circuit.
+DEFAULT_FAILURE_THRESHOLD = 5
+# Seconds the circuit stays open before trial calls are let through.
+DEFAULT_RECOVERY_TIMEOUT = 30.0
+# Trial calls that must succeed in a row, half-open, to close the circuit again.
+DEFAULT_HALF_OPEN_CALLS = 1
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of calling an upstream whose circuit is open.
+
+    Attributes:
+    - name: The circuit breaker's name.
+    - retry_in: Seconds until trial calls are let through again.
+    """
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} is unavailable; calls are suspended for another {retry_in:.1f} seconds")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing, so callers fail fast
+    instead of each waiting for a timeout.
+
+    Closed, calls go through and consecutive failures are counted; at
+    failure_threshold the circuit opens. Open, calls raise CircuitOpenError
+    without reaching the upstream. After recovery_timeout it is half-open:
+    up to half_open_calls trial calls go through at a time, and that many
+    successes in a row close it again, while any failure reopens it.
+
+    Attributes:
+    - name: Names the upstream in errors and stats.
+    - failure_threshold: Consecutive failures that open the circuit.
+    - recovery_timeout: Seconds the circuit stays open before trial calls.
+    - half_open_calls: Trial calls allowed at a time, and successes needed to close.
+    - calls, failures, rejected, opened: Counters of calls made, calls that
+      failed, calls refused while open and times the circuit opened.
+    """
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, recovery_timeout=DEFAULT_RECOVERY_TIMEOUT,
+                 half_open_calls=DEFAULT_HALF_OPEN_CALLS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_calls = half_open_calls
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+        self.last_error = None
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._trial_successes = 0
+        self._trials = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def _current_state(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+            self._trials = 0
+            self._trial_successes = 0
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _open(self, now):
+        self._state = OPEN
+        self._opened_at = now
+        self.opened += 1
+
+    def call(self, fetch, *args, **kwargs):
+        """
+        Calls fetch(*args, **kwargs) through the breaker and returns its result.
+
+        Raises CircuitOpenError without calling fetch if the circuit is open,
+        or half-open with its trial calls already under way; otherwise raises
+        whatever fetch raised, which counts as a failure.
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == OPEN or (state == HALF_OPEN and self._trials >= self.half_open_calls):
+                self.rejected += 1
+                retry_in = max(0.0, self._opened_at + self.recovery_timeout - now)
+                raise CircuitOpenError(self.name, retry_in)
+            if state == HALF_OPEN:
+                self._trials += 1
+            self.calls += 1
+        try:
+            result = fetch(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+                self.last_error = str(e) or type(e).__name__
+                if state == HALF_OPEN:
+                    if self._state == HALF_OPEN:
+                        self._open(time.monotonic())
+                else:
+                    self._consecutive_failures += 1
+                    if self._state == CLOSED and self._consecutive_failures >= self.failure_threshold:
+                        self._open(time.monotonic())
+            raise
+        with self._lock:
+            if state == HALF_OPEN:
+                if self._state == HALF_OPEN:
+                    self._trials -= 1
+                    self._trial_successes += 1
+                    if self._trial_successes >= self.half_open_calls:
+                        self._state = CLOSED
+                        self._consecutive_failures = 0
+            elif self._state == CLOSED:
+                self._consecutive_failures = 0
+        return result
+
+    def reset(self):
+        """
+        Closes the circuit and forgets the failures counted so far.
+        """
+        with self._lock:
+            self._state = CLOSED
+            self._consecutive_failures = 0
+
+    def stats(self):
+        """
+        Returns the state, the counters, the last error and, while open, the seconds until trial calls.
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            return {
+                'state': state,
+                'calls': self.calls,
+                'failures': self.failures,
+                'consecutive_failures': self._consecutive_failures,
+                'rejected': self.rejected,
+                'opened': self.opened,
+                'last_error': self.last_error,
+                'retry_in': max(0.0, self._opened_at + self.recovery_timeout - now) if state == OPEN else 0.0
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, recovery_timeout=DEFAULT_RECOVERY_TIMEOUT,
+                half_open_calls=DEFAULT_HALF_OPEN_CALLS):
+    """
+    Returns the shared circuit breaker with this name, creating it with the given thresholds on first use.
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, failure_threshold, recovery_timeout, half_open_calls)
+        return breaker
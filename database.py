@@ -0,0 +1,191 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DEFAULT_DATABASE = 'clinic_reservation_system.db'
+
+# PRAGMAs applied to every new connection. WAL lets readers run alongside the
+# single writer, and NORMAL synchronous is durable enough in WAL mode.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,       # negative values are KiB, so roughly 16 MB
+    'mmap_size': 134217728,     # 128 MB
+    'busy_timeout': 5000,       # milliseconds
+    'foreign_keys': 'ON',
+}
+
+
+class ConnectionManager:
+    """
+    Hands out tuned SQLite connections from a bounded pool.
+
+    A thread that enters connection() while it already holds one gets the same
+    connection back, so nested calls share a single transaction. The
+    outermost exit commits (or rolls back on an exception) and returns the
+    connection to the pool. Work that must only happen once the transaction
+    has committed, or be undone if it rolls back, such as updating an
+    in-memory cache, is registered with on_commit and on_rollback.
+
+    Attributes:
+    - database: Path of the SQLite database file.
+    - pool_size: Maximum number of connections open at the same time.
+    - timeout: Seconds to wait for a free connection before giving up.
+    - pragmas: PRAGMA name/value pairs applied to every new connection.
+    """
+    def __init__(self, database=DEFAULT_DATABASE, pool_size=5, timeout=30.0, **pragmas):
+        self.database = database
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(pragmas)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all = []
+
+    def _connect(self):
+        """
+        Opens a new connection and applies the configured PRAGMAs.
+        """
+        conn = sqlite3.connect(self.database, timeout=self.pragmas['busy_timeout'] / 1000,
+                               check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    def _acquire(self):
+        """
+        Takes an idle connection from the pool, opening one if none is idle.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No database connection available after {self.timeout} seconds.")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                return self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+
+    def _release(self, conn):
+        """
+        Returns a connection to the pool.
+        """
+        self._idle.put(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Yields the calling thread's connection, checking one out of the pool if needed.
+        """
+        depth = getattr(self._local, 'depth', 0)
+        if depth:
+            self._local.depth += 1
+            try:
+                yield self._local.conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        self._local.depth = 1
+        self._local.on_commit = []
+        self._local.on_rollback = []
+        committed = False
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+            committed = True
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            callbacks = self._local.on_commit if committed else self._local.on_rollback
+            self._local.depth = 0
+            self._local.conn = None
+            self._local.on_commit = self._local.on_rollback = None
+            self._release(conn)
+            # Run with the connection back in the pool, so a callback that
+            # reads the database starts a transaction of its own.
+            for callback in callbacks:
+                callback()
+
+    def on_commit(self, callback):
+        """
+        Calls callback() once the calling thread's transaction commits, or
+        right away if the thread holds no connection. Dropped if it rolls back.
+        """
+        if getattr(self._local, 'depth', 0):
+            self._local.on_commit.append(callback)
+        else:
+            callback()
+
+    def on_rollback(self, callback):
+        """
+        Calls callback() if the calling thread's transaction rolls back. Does
+        nothing if the thread holds no connection.
+        """
+        if getattr(self._local, 'depth', 0):
+            self._local.on_rollback.append(callback)
+
+    def close_all(self):
+        """
+        Closes every connection opened by this manager. Connections still in use are closed too.
+        """
+        with self._lock:
+            conns, self._all = self._all, []
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+        for conn in conns:
+            conn.close()
+
+
+connection_manager = ConnectionManager()
+
+
+def configure(database=DEFAULT_DATABASE, pool_size=5, timeout=30.0, **pragmas):
+    """
+    Replaces the shared connection manager, closing the connections of the previous one.
+    """
+    global connection_manager
+    connection_manager.close_all()
+    connection_manager = ConnectionManager(database, pool_size, timeout, **pragmas)
+    return connection_manager
+
+
+def get_db_connection():
+    """
+    Returns a context manager that yields a pooled connection to the reservation database.
+
+    Usage:
+        with get_db_connection() as conn:
+            conn.execute(...)
+    """
+    return connection_manager.connection()
+
+
+def on_commit(callback):
+    """
+    Calls callback() once the current transaction commits. See ConnectionManager.on_commit.
+    """
+    connection_manager.on_commit(callback)
+
+
+def on_rollback(callback):
+    """
+    Calls callback() if the current transaction rolls back. See ConnectionManager.on_rollback.
+    """
+    connection_manager.on_rollback(callback)
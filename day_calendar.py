@@ -0,0 +1,228 @@
+import threading
+from datetime import date, datetime, time
+
+from database import get_db_connection
+from timeslots import day_range, parse_date_time
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+DAY_BYTES = SLOTS_PER_DAY // 8
+FULL_DAY = (1 << SLOTS_PER_DAY) - 1
+
+
+def slot_number(value):
+    """
+    Returns the slot of the day a time falls in (0 is 00:00-00:15).
+
+    Attributes:
+    - value: A time, a datetime or an "HH:MM" string.
+    """
+    if isinstance(value, str):
+        value = time.fromisoformat(value.strip())
+    return (value.hour * 60 + value.minute) // SLOT_MINUTES
+
+
+def slot_mask(start, end=None):
+    """
+    Returns the bitmap of the slots from start up to, but not including, end.
+    Without an end, only the slot start falls in is set. An end of "24:00"
+    runs to midnight.
+    """
+    first = slot_number(start)
+    if end is None:
+        return 1 << first
+    last = SLOTS_PER_DAY if end == "24:00" else slot_number(end)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def slot_times(bitmap):
+    """
+    Returns the start times ("HH:MM") of the slots set in a bitmap, in order.
+    """
+    times = []
+    while bitmap:
+        low = bitmap & -bitmap
+        slot = low.bit_length() - 1
+        times.append(f"{slot * SLOT_MINUTES // 60:02d}:{slot * SLOT_MINUTES % 60:02d}")
+        bitmap ^= low
+    return times
+
+
+def intersect(bitmaps):
+    """
+    Returns the slots set in every bitmap, e.g. the times all of several clinics are free.
+    """
+    result = FULL_DAY
+    for bitmap in bitmaps:
+        result &= bitmap
+    return result
+
+
+def to_bytes(bitmap):
+    return bitmap.to_bytes(DAY_BYTES, 'little')
+
+
+def from_bytes(data):
+    return int.from_bytes(data, 'little') if data else 0
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+class ClinicCalendar:
+    """
+    Day-by-day opening hours and bookings of one clinic, as two bitmaps of
+    SLOTS_PER_DAY bits per day: "open" has the slots the clinic takes
+    appointments in, "busy" the slots taken by one. A slot is free when it is
+    open and not busy.
+
+    Both bitmaps are packed back to back in a bytearray, DAY_BYTES per day, so
+    a year of one clinic's calendar takes under 9 KB and free/busy questions
+    are a few integer operations rather than a scan of the day's appointments.
+
+    Attributes:
+    - start_date: First day covered.
+    - days: Number of days covered.
+    """
+    def __init__(self, start_date, days=366):
+        self.start_date = _as_date(start_date)
+        self.days = days
+        self._open = bytearray(days * DAY_BYTES)
+        self._busy = bytearray(days * DAY_BYTES)
+
+    @property
+    def nbytes(self):
+        return len(self._open) + len(self._busy)
+
+    def _offset(self, day):
+        n = (_as_date(day) - self.start_date).days
+        if not 0 <= n < self.days:
+            raise ValueError(f"{day} is outside this calendar")
+        return n * DAY_BYTES
+
+    @staticmethod
+    def _get(data, offset):
+        return int.from_bytes(data[offset:offset + DAY_BYTES], 'little')
+
+    @staticmethod
+    def _set(data, offset, bitmap):
+        data[offset:offset + DAY_BYTES] = to_bytes(bitmap)
+
+    def opened(self, day):
+        return self._get(self._open, self._offset(day))
+
+    def busy(self, day):
+        return self._get(self._busy, self._offset(day))
+
+    def free(self, day):
+        offset = self._offset(day)
+        return self._get(self._open, offset) & ~self._get(self._busy, offset)
+
+    def set_open(self, day, mask, available=True):
+        """
+        Opens (or, with available=False, closes) the slots of a mask on one day.
+        """
+        offset = self._offset(day)
+        bitmap = self._get(self._open, offset)
+        self._set(self._open, offset, bitmap | mask if available else bitmap & ~mask)
+
+    def is_free(self, day, mask):
+        return self.free(day) & mask == mask
+
+    def book(self, day, mask, check=True):
+        """
+        Marks the slots of a mask busy. Raises ValueError if any of them is
+        already busy, unless check is False.
+        """
+        offset = self._offset(day)
+        bitmap = self._get(self._busy, offset)
+        if check and bitmap & mask:
+            raise ValueError(f"{', '.join(slot_times(bitmap & mask))} on {day} already booked")
+        self._set(self._busy, offset, bitmap | mask)
+
+    def release(self, day, mask):
+        offset = self._offset(day)
+        self._set(self._busy, offset, self._get(self._busy, offset) & ~mask)
+
+    def utilization(self, start=None, end=None):
+        """
+        Returns the share of open slots that are busy, over one day or a range of days.
+
+        Attributes:
+        - start: First day. Defaults to the first day of the calendar.
+        - end: Last day, inclusive. Defaults to start, or to the last day of the calendar when start is not given.
+        """
+        first = 0 if start is None else self._offset(start)
+        if end is not None:
+            last = self._offset(end) + DAY_BYTES
+        else:
+            last = len(self._open) if start is None else first + DAY_BYTES
+        # One big integer per bitmap, so the popcount runs over the whole range at once.
+        opened = int.from_bytes(self._open[first:last], 'little')
+        busy = int.from_bytes(self._busy[first:last], 'little') & opened
+        total = opened.bit_count()
+        return busy.bit_count() / total if total else 0.0
+
+
+class CalendarStore:
+    """
+    The calendars of every clinic for one date range, built from the Slots table.
+
+    Attributes:
+    - start_date: First day covered.
+    - days: Number of days covered.
+    """
+    def __init__(self, start_date, days=366):
+        self.start_date = _as_date(start_date)
+        self.days = days
+        self._calendars = {}
+        self._lock = threading.Lock()
+
+    def calendar(self, clinic_id):
+        """
+        Returns a clinic's calendar, creating an empty one if needed.
+        """
+        with self._lock:
+            calendar = self._calendars.get(clinic_id)
+            if calendar is None:
+                calendar = self._calendars[clinic_id] = ClinicCalendar(self.start_date, self.days)
+            return calendar
+
+    @property
+    def nbytes(self):
+        return sum(calendar.nbytes for calendar in self._calendars.values())
+
+    def load(self):
+        """
+        Opens one slot per Slots row of the days covered and marks the slots
+        with no seat left (booked or held) busy. Only those days' rows are
+        read, through the index on Slots.starts_at.
+        """
+        with get_db_connection() as conn:
+            slots = conn.execute("SELECT clinic_id, date_time, reserved + held >= capacity FROM Slots "
+                                 "WHERE starts_at >= ? AND starts_at < ? AND capacity > 0",
+                                 day_range(self.start_date, self.days)).fetchall()
+        for clinic_id, date_time, full in slots:
+            moment = parse_date_time(date_time)
+            calendar = self.calendar(clinic_id)
+            calendar.set_open(moment, 1 << slot_number(moment))
+            if full:
+                calendar.book(moment, 1 << slot_number(moment), check=False)
+        return self
+
+    def free_everywhere(self, clinic_ids, day):
+        """
+        Returns the bitmap of the slots free at every one of these clinics on a day.
+        """
+        return intersect(self.calendar(clinic_id).free(day) for clinic_id in clinic_ids)
+
+    def utilization(self, start=None, end=None):
+        """
+        Returns each clinic's utilization over a range of days, keyed by clinic ID.
+        """
+        return {clinic_id: calendar.utilization(start, end) for clinic_id, calendar in self._calendars.items()}
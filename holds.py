@@ -0,0 +1,195 @@
+import atexit
+import heapq
+import json
+import threading
+import time
+
+from availability import get_availability
+from capacity import book_held_seat, release_seat, reserve_seat
+from database import get_db_connection
+from repository import get_repositories
+from timeslots import parse_date_time, to_epoch
+
+DEFAULT_HOLD_SECONDS = 300
+
+
+class SlotHolds:
+    """
+    Seats held for a patient between picking a slot and confirming it.
+
+    A hold takes a seat of the slot (the Slots.held counter) until it is
+    confirmed into an appointment, released, or expires. A sweep deletes the
+    expired rows of the Holds table through the expiry index, so it costs
+    O(k log n) for k expiring holds however many holds are live, and also
+    frees the holds of other processes, including ones that have exited.
+    Expiry times of this process's holds are kept in a min-heap only to wake
+    the sweeper when the next one is due. confirm() checks the expiry itself,
+    so a hold the sweeper has not reached yet still cannot be confirmed late.
+
+    Attributes:
+    - sweep_interval: Longest time in seconds between sweeps of the background sweeper thread.
+    """
+    def __init__(self, sweep_interval=1.0):
+        self.sweep_interval = sweep_interval
+        self._expiries = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.expired = 0
+
+    def load(self):
+        """
+        Rebuilds the wake-up heap from the Holds table.
+        """
+        with get_db_connection() as conn:
+            expiries = [(expires_at, hold_id) for hold_id, expires_at in
+                        conn.execute("SELECT hold_id, expires_at FROM Holds")]
+        heapq.heapify(expiries)
+        with self._lock:
+            self._expiries = expiries
+        return self
+
+    def __len__(self):
+        return len(self._expiries)
+
+    def hold(self, user_id, clinic_id, date_time, ttl=DEFAULT_HOLD_SECONDS):
+        """
+        Holds one seat of a slot for a patient.
+
+        Attributes:
+        - user_id: The patient the seat is held for.
+        - clinic_id: The clinic of the slot.
+        - date_time: The slot ("YYYY-MM-DD HH:MM", optionally with a UTC offset).
+        - ttl: Seconds the hold lasts unless it is confirmed or released.
+
+        Returns the hold as a dictionary, or None if the slot has no free seat.
+        """
+        # Kept with its UTC offset, if it had one, for the appointment it becomes.
+        date_time = parse_date_time(date_time).isoformat(' ', 'minutes')
+        starts_at = to_epoch(date_time)[0]
+        expires_at = time.time() + ttl
+        with get_db_connection() as conn:
+            seats_left = reserve_seat(conn, clinic_id, starts_at, counter='held')
+            if seats_left is None:
+                return None
+            hold_id = conn.execute("INSERT INTO Holds (clinic_id, date_time, starts_at, user_id, expires_at) "
+                                   "VALUES (?, ?, ?, ?, ?)",
+                                   (clinic_id, date_time, starts_at, user_id, expires_at)).lastrowid
+        with self._lock:
+            heapq.heappush(self._expiries, (expires_at, hold_id))
+        if seats_left == 0:
+            get_availability().mark_booked(clinic_id, starts_at)
+        return {'hold_id': hold_id, 'clinic_id': clinic_id, 'date_time': date_time,
+                'user_id': user_id, 'expires_at': expires_at}
+
+    def confirm(self, hold_id, status='pending'):
+        """
+        Turns a live hold into an appointment in one transaction.
+
+        Returns the appointment record, or None if the hold does not exist, has
+        expired, or no longer holds a seat and the slot has none free.
+        """
+        with get_db_connection() as conn:
+            row = conn.execute("DELETE FROM Holds WHERE hold_id = ? AND expires_at > ? "
+                               "RETURNING clinic_id, date_time, starts_at, user_id", (hold_id, time.time())).fetchone()
+            if row is None:
+                return None
+            clinic_id, date_time, starts_at, user_id = row
+            # A slot whose held counter no longer covers the hold (e.g. it was
+            # reset by hand) is booked like a new appointment, if a seat is free.
+            if not book_held_seat(conn, clinic_id, starts_at) and reserve_seat(conn, clinic_id, starts_at) is None:
+                return None
+            return get_repositories().appointments.add({'status': status, 'date_time': date_time,
+                                                        'user_id': user_id, 'clinic_id': clinic_id})
+
+    def release(self, hold_id):
+        """
+        Gives a held seat back. Returns False if the hold no longer exists.
+        """
+        return self._release([hold_id]) == 1
+
+    def _release(self, hold_ids):
+        """
+        Deletes holds and gives their seats back in one transaction. Returns the number released.
+        """
+        return self._delete("hold_id IN (SELECT value FROM json_each(?))", (json.dumps(hold_ids),))
+
+    def _delete(self, where, params):
+        with get_db_connection() as conn:
+            released = conn.execute(f"DELETE FROM Holds WHERE {where} RETURNING clinic_id, starts_at",
+                                    params).fetchall()
+            freed = [(clinic_id, starts_at, release_seat(conn, clinic_id, starts_at, counter='held'))
+                     for clinic_id, starts_at in released]
+        availability = get_availability()
+        for clinic_id, starts_at, seats_left in freed:
+            if seats_left:
+                availability.mark_free(clinic_id, starts_at)
+        return len(released)
+
+    def sweep(self, now=None):
+        """
+        Releases every hold in the Holds table that has expired, whichever
+        process made it. If the release fails nothing is lost: the holds stay
+        in the table and the next sweep releases them.
+
+        Returns the number of holds released.
+        """
+        now = time.time() if now is None else now
+        released = self._delete("expires_at <= ?", (now,))
+        # Only once the release has committed are this process's due holds
+        # dropped from the wake-up heap.
+        with self._lock:
+            while self._expiries and self._expiries[0][0] <= now:
+                heapq.heappop(self._expiries)
+        self.expired += released
+        return released
+
+    def _next_wait(self):
+        # Sleep until this process's next hold expires, but never longer than
+        # sweep_interval, so other processes' holds are swept as well.
+        with self._lock:
+            if not self._expiries:
+                return self.sweep_interval
+            return min(self.sweep_interval, max(0.0, self._expiries[0][0] - time.time()))
+
+    def start(self):
+        """
+        Starts the background sweeper thread if it is not already running.
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='hold-sweeper', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        wait = self.sweep_interval
+        while not self._stop.wait(wait):
+            try:
+                self.sweep()
+                wait = self._next_wait()
+            except Exception as e:
+                print(f"An error occurred while releasing expired holds: {e}")
+                wait = self.sweep_interval
+
+
+_holds = None
+_holds_lock = threading.Lock()
+
+
+def get_holds():
+    """
+    Returns the shared slot holds, loading them and starting the sweeper on first use.
+    """
+    global _holds
+    with _holds_lock:
+        if _holds is None:
+            _holds = SlotHolds().load().start()
+            atexit.register(_holds.stop)
+        return _holds
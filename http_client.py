@@ -0,0 +1,176 @@
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) timeouts in seconds. The connect timeout is just over a
+# multiple of 3 s, the TCP retransmission window.
+DEFAULT_TIMEOUT = (3.05, 10.0)
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.2
+MAX_BACKOFF = 5.0
+# Methods that can be repeated without changing the result.
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+# Statuses worth retrying: the upstream is overloaded or briefly unavailable.
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+
+class EndpointMetrics:
+    """
+    Call counters and recent latencies of one endpoint (method, scheme, host and path).
+
+    Attributes:
+    - calls: Calls made, each counted once however many attempts it took.
+    - errors: Calls that raised or ended with a 5xx status.
+    - retries: Attempts repeated after a failure.
+    - latencies: Seconds taken by the most recent calls, retries included.
+    """
+    def __init__(self, window=1000):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, retries, failed):
+        with self._lock:
+            self.calls += 1
+            self.retries += retries
+            self.errors += failed
+            self.latencies.append(seconds)
+
+    def stats(self):
+        """
+        Returns the counters with the error rate and mean, 95th percentile and maximum latency in milliseconds.
+        """
+        with self._lock:
+            latencies = sorted(self.latencies)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'error_rate': self.errors / self.calls if self.calls else 0.0,
+            'mean_ms': sum(latencies) / len(latencies) * 1e3 if latencies else 0.0,
+            'p95_ms': latencies[int(len(latencies) * 0.95)] * 1e3 if latencies else 0.0,
+            'max_ms': latencies[-1] * 1e3 if latencies else 0.0
+        }
+
+
+class HTTPClient:
+    """
+    Shared client for the external slot APIs.
+
+    One requests.Session keeps a pool of open connections per host, so calls
+    reuse TCP and TLS connections instead of opening one each time. Every call
+    has connect and read timeouts, so a slow upstream cannot hold the caller
+    forever. Idempotent calls that fail with a connection error, a timeout or a
+    retryable status are retried a bounded number of times with exponential
+    backoff and jitter.
+
+    Attributes:
+    - pool_size: Connections kept open per host.
+    - timeout: Default (connect, read) timeouts in seconds.
+    - retries: Default number of retries of an idempotent call.
+    - backoff: Seconds before the first retry; doubled for each further retry, up to MAX_BACKOFF.
+    """
+    def __init__(self, pool_size=10, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, method, url):
+        parts = urlsplit(url)
+        key = f"{method} {parts.scheme}://{parts.netloc}{parts.path}"
+        with self._lock:
+            metrics = self._metrics.get(key)
+            if metrics is None:
+                metrics = self._metrics[key] = EndpointMetrics()
+            return metrics
+
+    def _delay(self, attempt):
+        # Full jitter keeps clients that failed together from retrying together.
+        return random.uniform(0, min(MAX_BACKOFF, self.backoff * 2 ** attempt))
+
+    def request(self, method, url, timeout=None, retries=None, idempotent=None, **kwargs):
+        """
+        Sends a request through the pooled session.
+
+        Attributes:
+        - method: HTTP method, e.g. 'GET'.
+        - url: The URL to call.
+        - timeout: (connect, read) timeouts in seconds, or one number for both. Defaults to the client's.
+        - retries: Retries allowed for this call. Defaults to the client's.
+        - idempotent: Whether the call may be repeated. Defaults to True for IDEMPOTENT_METHODS;
+          pass True for e.g. a POST that sets an absolute value.
+        - kwargs: Passed on to requests, e.g. json or params.
+
+        Returns the response, which may have an error status. Raises
+        requests.RequestException if the last attempt failed to get one.
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        retries = (self.retries if retries is None else retries) if idempotent else 0
+        timeout = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        attempt = 0
+        failed = True
+        try:
+            while True:
+                try:
+                    response = self.session.request(method, url, timeout=timeout, **kwargs)
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt >= retries:
+                        raise
+                else:
+                    if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                        failed = response.status_code >= 500
+                        return response
+                    response.close()
+                time.sleep(self._delay(attempt))
+                attempt += 1
+        finally:
+            self._endpoint(method, url).record(time.perf_counter() - started, attempt, failed)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """
+        Returns the metrics of every endpoint called so far, keyed by "METHOD scheme://host/path".
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {endpoint: endpoint_metrics.stats() for endpoint, endpoint_metrics in metrics.items()}
+
+    def close(self):
+        self.session.close()
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """
+    Returns the shared HTTP client, creating it on first use.
+    """
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = HTTPClient()
+        return _http_client
@@ -0,0 +1,29 @@
+import os
+import sys
+
+from django.apps import AppConfig
+
+
+def _serves_requests():
+    # Management commands other than runserver (migrate, shell, test...) never
+    # serve requests, and with autoreload runserver serves from a child process
+    # marked with RUN_MAIN; the parent only watches files. Anything else is a
+    # WSGI or ASGI server.
+    command = os.path.basename(sys.argv[0]) if sys.argv else ''
+    if command not in ('manage.py', 'django-admin', '__main__.py'):
+        return True
+    return sys.argv[1:2] == ['runserver'] and (os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv)
+
+
+class MysiteConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'mysite'
+
+    def ready(self):
+        # Start sending capacity updates when serving, like the command-line
+        # app's main(), so updates a previous process left in the outbox go out
+        # without waiting for the next booking. Elsewhere the flusher starts on
+        # the first update queued (see capacity_outbox.wake).
+        if _serves_requests():
+            from . import capacity_outbox
+            capacity_outbox.start()
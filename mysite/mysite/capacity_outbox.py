@@ -0,0 +1,57 @@
+import threading
+
+from django.db import close_old_connections
+
+from http_client import get_http_client
+from .models import CapacityUpdate
+
+SLOT_API_URL = 'https://localhost/slots'
+FLUSH_INTERVAL = 1.0
+
+_wake = threading.Event()
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def post_capacity_update(code, reserved):
+    """
+    Reports one clinic's reserved-appointment count to the external slot API.
+    Raises requests.RequestException if it was not accepted.
+    """
+    # CapacityUpdate.flush schedules its own retries, so a failed call is not repeated here.
+    response = get_http_client().post(SLOT_API_URL, json={'clinic code': code, 'reserved appointments': reserved},
+                                      idempotent=True, retries=0)
+    response.raise_for_status()
+
+
+def _run():
+    while True:
+        _wake.wait(FLUSH_INTERVAL)
+        _wake.clear()
+        # The thread outlives requests, so drop database connections Django considers stale.
+        close_old_connections()
+        try:
+            while CapacityUpdate.flush(post_capacity_update) == CapacityUpdate.BATCH_SIZE:
+                pass
+        except Exception as e:
+            print(f"An error occurred while sending capacity updates: {e}")
+
+
+def start():
+    """
+    Starts the background flusher of the capacity outbox unless it is running.
+    Called when the app starts serving requests (see apps.py) and by wake().
+    """
+    global _thread
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name='capacity-outbox', daemon=True)
+            _thread.start()
+
+
+def wake():
+    """
+    Asks the background flusher of the capacity outbox to run now, starting it if needed.
+    """
+    start()
+    _wake.set()
@@ -1,7 +1,8 @@
 from datetime import datetime, timedelta
 from enum import Enum
 import random
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import AbstractUser, BaseUserManager, Group, Permission
 from django.core.exceptions import ValidationError
 from django.utils import timezone
@@ -88,24 +89,178 @@ class Clinic(models.Model):
             self.phone_info = new_phone
         self.save()
 
+    def set_services(self, names):
+        """
+        Replaces the services the clinic offers in one transaction.
+        """
+        with transaction.atomic():
+            self.services.all().delete()
+            Service.objects.bulk_create(
+                Service(clinic=self, name=name, normalized_name=normalize_service(name)) for name in names)
+
+
+def normalize_service(name):
+    """
+    Returns the form service names are indexed under: case-folded, with runs of whitespace collapsed.
+    """
+    return ' '.join(name.casefold().split())
+
+
+class Service(models.Model):
+    """
+    A service a clinic offers. normalized_name is the inverted index from
+    service name to clinics: lookups and prefix searches on it are index
+    range scans, not a scan of every clinic.
+    """
+    clinic = models.ForeignKey(Clinic, related_name='services', on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    normalized_name = models.CharField(max_length=255, editable=False)
+    description = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['normalized_name', 'clinic'])]
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_service(self.name)
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def clinic_ids_for(prefix):
+        """
+        Returns the IDs of the clinics offering a service whose name starts with a prefix.
+        """
+        prefix = normalize_service(prefix)
+        # A range rather than __startswith, whose LIKE cannot use the index on every backend.
+        return set(Service.objects.filter(normalized_name__gte=prefix, normalized_name__lt=prefix + '\U0010ffff')
+                   .values_list('clinic_id', flat=True).distinct())
+
+# Day calendars are bitmaps of 15-minute slots: bit n is the slot starting
+# n * 15 minutes after midnight, stored little-endian in DAY_BYTES bytes.
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+DAY_BYTES = SLOTS_PER_DAY // 8
+FULL_DAY = (1 << SLOTS_PER_DAY) - 1
+
+
+def slot_mask(start=None, end=None):
+    """
+    Returns the bitmap of the slots from start ("HH:MM") up to, but not including, end.
+    Leaving out start or end runs from or to midnight.
+    """
+    def slot(value, default):
+        if value is None:
+            return default
+        hours, minutes = str(value)[:5].split(':')
+        return (int(hours) * 60 + int(minutes)) // SLOT_MINUTES
+
+    first, last = slot(start, 0), slot(end, SLOTS_PER_DAY)
+    return ((1 << (last - first)) - 1) << first if last > first else 0
+
+
 # Moved outside of the Clinic class
 class Availability(models.Model):
     clinic = models.ForeignKey(Clinic, related_name='availabilities', on_delete=models.CASCADE)
     date = models.DateField()
     is_available = models.BooleanField()
+    slots = models.BinaryField(max_length=DAY_BYTES, default=bytes(DAY_BYTES))
 
     class Meta:
         unique_together = ('clinic', 'date')
 
+    @property
+    def bitmap(self):
+        return int.from_bytes(bytes(self.slots or b''), 'little')
+
+    @bitmap.setter
+    def bitmap(self, value):
+        self.slots = (value & FULL_DAY).to_bytes(DAY_BYTES, 'little')
+        self.is_available = bool(value & FULL_DAY)
+
+    def is_free(self, start, end=None):
+        """
+        Checks whether every slot from start to end is open, or just the slot at start.
+        """
+        mask = slot_mask(start, end)
+        if end is None:
+            mask &= -mask  # only the slot start falls in
+        return self.bitmap & mask == mask
+
+    def utilization(self):
+        """
+        Returns the share of the day's slots that are open.
+        """
+        return self.bitmap.bit_count() / SLOTS_PER_DAY
+
     @staticmethod
-    def set_availability_for_clinic(clinic, date, available):
+    def set_availability_for_clinic(clinic, date, available, start=None, end=None):
         """
-        Sets the clinic's availability for a specific date.
+        Sets the clinic's availability for a specific date, or for the slots
+        between start and end ("HH:MM") on that date.
         """
-        availability, created = Availability.objects.get_or_create(clinic=clinic, date=date)
-        availability.is_available = available
+        availability, created = Availability.objects.get_or_create(
+            clinic=clinic, date=date, defaults={'is_available': False})
+        mask = slot_mask(start, end)
+        availability.bitmap = availability.bitmap | mask if available else availability.bitmap & ~mask
         availability.save()
 
+    @staticmethod
+    def free_at_all(clinics, date):
+        """
+        Returns the bitmap of the slots open at every one of the clinics on a date.
+        """
+        clinics = list(clinics)
+        rows = Availability.objects.filter(clinic__in=clinics, date=date)
+        if len(rows) < len(clinics):
+            return 0
+        result = FULL_DAY
+        for row in rows:
+            result &= row.bitmap
+        return result
+
+    @staticmethod
+    def open_slots(start=None, days=7, clinic_ids=None, limit=50):
+        """
+        Returns up to limit open slots from start (default now) over the next
+        days, earliest first, as {'date_time', 'clinic_id'} dictionaries like
+        the external API's: the slots the clinics' availability marks open that
+        no live appointment has taken. Needs only the local tables, so it still
+        answers when the external available-appointments API cannot be reached.
+        """
+        start = start or timezone.now()
+        if settings.USE_TZ:
+            start = timezone.make_naive(start) if timezone.is_aware(start) else start
+            as_stored = timezone.make_aware
+        else:
+            as_stored = lambda moment: moment
+        rows = Availability.objects.filter(date__gte=start.date(), date__lt=start.date() + timedelta(days=days),
+                                           is_available=True)
+        if clinic_ids is not None:
+            rows = rows.filter(clinic_id__in=clinic_ids)
+        candidates = []
+        for row in rows:
+            midnight = datetime.combine(row.date, datetime.min.time())
+            bitmap = row.bitmap
+            while bitmap:
+                slot = (bitmap & -bitmap).bit_length() - 1
+                bitmap &= bitmap - 1
+                moment = midnight + timedelta(minutes=slot * SLOT_MINUTES)
+                if moment >= start:
+                    candidates.append((moment, row.clinic_id))
+        if not candidates:
+            return []
+        candidates.sort()
+        booked = set(Appointment.objects.filter(
+            clinic_id__in={clinic_id for _, clinic_id in candidates},
+            date_time__gte=as_stored(candidates[0][0]), date_time__lte=as_stored(candidates[-1][0])
+        ).exclude(status='canceled').values_list('clinic_id', 'date_time'))
+        found = []
+        for moment, clinic_id in candidates:
+            if (clinic_id, as_stored(moment)) not in booked:
+                found.append({'date_time': moment.strftime('%Y-%m-%d %H:%M'), 'clinic_id': clinic_id})
+                if len(found) == limit:
+                    break
+        return found
+
 
 
 
@@ -120,6 +275,13 @@ class Appointment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     clinic = models.ForeignKey(Clinic, on_delete=models.CASCADE)
 
+    class Meta:
+        # Day, week and range listings per clinic and per patient are index range scans.
+        indexes = [
+            models.Index(fields=['clinic', 'date_time']),
+            models.Index(fields=['user', 'date_time']),
+        ]
+
     def save(self, *args, **kwargs):
         """
         Overrides the save method to check for appointment time slot availability before saving.
@@ -148,10 +310,75 @@ class Appointment(models.Model):
     def reschedule(self, new_time):
         """
         Reschedules the appointment to a new time and resets its status to pending.
+        The new slot is checked and taken in the same transaction.
         """
-        self.date_time = new_time
-        self.status = 'pending'
-        self.save()
+        Appointment.reschedule_many([(self, new_time)])
+
+    @staticmethod
+    def reschedule_many(moves):
+        """
+        Moves a batch of appointments to new times, all or nothing. The target
+        slots are checked with one query and the rows updated with one bulk
+        update inside a single transaction.
+
+        Raises ValidationError, without moving anything, if a target slot is
+        taken or two moves target the same slot.
+        """
+        field = Appointment._meta.get_field('date_time')
+
+        def as_datetime(value):
+            # Compare like with like: the database hands back (aware) datetimes.
+            value = field.to_python(value)
+            if settings.USE_TZ and timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            return value
+
+        moves = [(appointment, as_datetime(new_time)) for appointment, new_time in moves]
+        with transaction.atomic():
+            targets = {(appointment.clinic_id, new_time) for appointment, new_time in moves}
+            if len(targets) < len(moves):
+                raise ValidationError("Two appointments cannot be moved to the same time slot.")
+            moving = [appointment.id for appointment, _ in moves]
+            # Lock the live appointments at the target times so a concurrent
+            # booking cannot take one of them before the update commits.
+            taken = Appointment.objects.select_for_update().filter(
+                clinic_id__in={clinic_id for clinic_id, _ in targets},
+                date_time__in={new_time for _, new_time in targets}
+            ).exclude(status='canceled').exclude(id__in=moving).values_list('clinic_id', 'date_time')
+            clashes = targets.intersection(taken)
+            if clashes:
+                raise ValidationError(f"{len(clashes)} of the requested time slots are already booked.")
+            for appointment, new_time in moves:
+                appointment.date_time = new_time
+                appointment.status = 'pending'
+            Appointment.objects.bulk_update([appointment for appointment, _ in moves], ['date_time', 'status'])
+
+    @staticmethod
+    def clinic_schedule(clinic, start, end, status=None, after=None, limit=50):
+        """
+        Returns one page of a clinic's appointments in [start, end), ordered by
+        (date_time, id), and the cursor of the next page (None on the last page).
+        The page is found by seeking the (clinic, date_time) index to the
+        cursor rather than with OFFSET, so a deep page costs the same as the first.
+
+        Attributes:
+        - after: The (date_time, id) of the last appointment of the previous page.
+        """
+        appointments = Appointment.objects.filter(clinic=clinic, date_time__gte=start, date_time__lt=end)
+        if status:
+            appointments = appointments.filter(status=status)
+        if after is not None:
+            after_time, after_id = after
+            # The plain lower bound lets the index seek to the cursor; the OR
+            # alone would be applied as a filter to every row before it.
+            appointments = appointments.filter(
+                models.Q(date_time__gt=after_time) | models.Q(date_time=after_time, id__gt=after_id),
+                date_time__gte=after_time)
+        # One extra row tells whether there is a next page.
+        page = list(appointments.order_by('date_time', 'id')[:limit + 1])
+        if len(page) > limit:
+            return page[:limit], (page[limit - 1].date_time, page[limit - 1].id)
+        return page, None
 
 
 
@@ -180,3 +407,62 @@ class Notification(models.Model):
             Notification.objects.create(user=user, message=message, date_time=timezone.now())
             print(f"Sent notification to {user.username}")
 
+
+class CapacityUpdate(models.Model):
+    """
+    Outbox of reserved-appointment counts waiting to be reported to the external
+    slot API, one row per clinic code. A newer count replaces an unsent one, so
+    bursts of updates for a clinic are sent once, with the latest value. Rows
+    are deleted only once the API accepted them, so nothing is lost on a crash.
+    """
+    BATCH_SIZE = 100
+    # Seconds before the first retry of a failed send; doubled after each failure, up to MAX_RETRY_DELAY.
+    RETRY_DELAY = 1.0
+    MAX_RETRY_DELAY = 300.0
+
+    clinic_code = models.IntegerField(unique=True)
+    reserved = models.IntegerField()
+    version = models.IntegerField(default=1)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(db_index=True)
+    last_error = models.TextField(blank=True)
+
+    @staticmethod
+    def enqueue(code, reserved):
+        """
+        Queues a clinic's latest reserved-appointment count, replacing any unsent one.
+        """
+        changes = {'reserved': reserved, 'attempts': 0, 'next_attempt_at': timezone.now(), 'last_error': ''}
+        if CapacityUpdate.objects.filter(clinic_code=code).update(version=models.F('version') + 1, **changes):
+            return
+        try:
+            with transaction.atomic():
+                CapacityUpdate.objects.create(clinic_code=code, **changes)
+        except IntegrityError:
+            # Another request queued this clinic first; replace its value instead.
+            CapacityUpdate.objects.filter(clinic_code=code).update(version=models.F('version') + 1, **changes)
+
+    @staticmethod
+    def flush(send, batch_size=BATCH_SIZE):
+        """
+        Sends one batch of due updates with send(code, reserved), outside any
+        transaction. A row updated while it was being sent keeps its newer
+        value queued; a failed send is retried later with exponential backoff.
+
+        Returns the number of updates delivered.
+        """
+        now = timezone.now()
+        due = list(CapacityUpdate.objects.filter(next_attempt_at__lte=now).order_by('next_attempt_at')[:batch_size])
+        delivered = 0
+        for update in due:
+            current = CapacityUpdate.objects.filter(pk=update.pk, version=update.version)
+            try:
+                send(update.clinic_code, update.reserved)
+            except Exception as e:
+                delay = min(CapacityUpdate.MAX_RETRY_DELAY, CapacityUpdate.RETRY_DELAY * 2 ** update.attempts)
+                current.update(attempts=models.F('attempts') + 1, next_attempt_at=now + timedelta(seconds=delay),
+                               last_error=str(e) or type(e).__name__)
+            else:
+                current.delete()
+                delivered += 1
+        return delivered
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Appointment, Clinic, User
+
+
+class ClinicAppointmentsTests(TestCase):
+    """
+    Pages through the clinic_appointments endpoint and checks the keyset cursor.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clinic = Clinic.objects.create(name='Clinic', address='Main Street 1')
+        other = Clinic.objects.create(name='Other', address='Main Street 2')
+        patient = User.objects.create(username='patient', email='patient@example.com', user_type='patient')
+        start = timezone.make_aware(datetime(2030, 1, 7, 9, 0))
+        # Two appointments share each time, so the cursor must break ties on id.
+        Appointment.objects.bulk_create(
+            [Appointment(status='pending', date_time=start + timedelta(hours=i // 2), user=patient, clinic=cls.clinic)
+             for i in range(7)]
+            + [Appointment(status='pending', date_time=start, user=patient, clinic=other)])
+        cls.expected = list(Appointment.objects.filter(clinic=cls.clinic).order_by('date_time', 'id')
+                            .values_list('id', flat=True))
+        cls.admin = get_user_model().objects.create_user('admin', 'admin@example.com', 'password', is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.url = reverse('clinic_appointments', args=[self.clinic.id])
+
+    def get_page(self, **params):
+        response = self.client.get(self.url, {'from': '2030-01-07', 'to': '2030-01-08', 'limit': 2, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_cover_the_range_once_in_order(self):
+        seen, page = [], self.get_page()
+        while True:
+            seen += [appointment['id'] for appointment in page['appointments']]
+            if page['next'] is None:
+                break
+            page = self.get_page(after=page['next'])
+        self.assertEqual(seen, self.expected)
+
+    def test_deep_page_seeks_from_the_cursor_time(self):
+        first = self.get_page()
+        with CaptureQueriesContext(connection) as queries:
+            self.get_page(after=first['next'])
+        sql = next(query['sql'] for query in queries if 'mysite_appointment' in query['sql'])
+        # Besides the OR on (date_time, id), the cursor time bounds date_time from below on its own.
+        self.assertEqual(sql.count('"date_time" >='), 2)
+
+    def test_invalid_limit_is_rejected(self):
+        response = self.client.get(self.url, {'from': '2030-01-07', 'to': '2030-01-08', 'limit': 0})
+        self.assertEqual(response.status_code, 400)
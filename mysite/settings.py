@@ -11,11 +11,18 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+import sys
 import os 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# The modules shared with the command-line app (http_client, response_cache,
+# circuit_breaker) live at the top of the repository and are imported from there.
+SHARED_MODULES_DIR = BASE_DIR
+if str(SHARED_MODULES_DIR) not in sys.path:
+    sys.path.append(str(SHARED_MODULES_DIR))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
@@ -125,6 +132,30 @@ STATICFILES_DIRS = [
 
 
 
+# Seconds a page view waits for the external available-appointments API, as
+# (connect, read) timeouts. Failed calls are not retried; the page falls back
+# instead (see the circuit breaker settings below).
+
+AVAILABLE_APPOINTMENTS_TIMEOUT = (1.0, 2.0)
+
+# Seconds the external available-appointments API's answer is cached, and for
+# how long after that it may be served stale while it is refreshed.
+
+AVAILABLE_APPOINTMENTS_TTL = 30
+AVAILABLE_APPOINTMENTS_STALE_TTL = 300
+
+# Circuit breaker around the external available-appointments API: failures in
+# a row that open it, seconds it stays open before trial calls are let through,
+# and how many trials must succeed to close it. While it is open the last good
+# answer is shown, or up to AVAILABLE_APPOINTMENTS_FALLBACK_SLOTS open slots
+# worked out from the local availability and appointments.
+
+AVAILABLE_APPOINTMENTS_FAILURE_THRESHOLD = 5
+AVAILABLE_APPOINTMENTS_RECOVERY_TIMEOUT = 30
+AVAILABLE_APPOINTMENTS_HALF_OPEN_CALLS = 1
+AVAILABLE_APPOINTMENTS_FALLBACK_SLOTS = 50
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -14,6 +14,8 @@ urlpatterns = [
     path('update-clinic-info/<int:clinic_id>/', views.update_clinic_info, name='update_clinic_info'),
     path('available-appointments/', views.fetch_available_appointments, name='available_appointments'),
     path('adjust-clinic-capacity/', views.adjust_clinic_capacity, name='adjust_clinic_capacity'),
+    path('clinics/<int:clinic_id>/appointments/', views.clinic_appointments, name='clinic_appointments'),
+    path('upstream-stats/', views.upstream_stats, name='upstream_stats'),
     # ... other url patterns ...
 ]
 
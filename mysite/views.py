@@ -1,14 +1,25 @@
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.conf import settings
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.admin.views.decorators import staff_member_required
 from django import forms
-import requests
 from .forms import *
+from . import capacity_outbox
+from circuit_breaker import CircuitOpenError, get_breaker
+from http_client import get_http_client
+from response_cache import get_cache
 from django.contrib import messages
-from .models import Notification, Clinic, Appointment
+from .models import Notification, Clinic, Appointment, Availability, CapacityUpdate, Service
+from django.http import JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.contrib.auth.decorators import login_required, user_passes_test
 
+# External slot API, called through the pooled client in http_client.py
+AVAILABLE_APPOINTMENTS_URL = 'http://127.0.0.1:5000/available'
+
 
 def sign_up_view(request):
     if request.method == 'POST':
@@ -79,24 +90,144 @@ def add_appointment_capacity(request):
     return render(request, 'add_appointment_capacity.html', {'form': form})
 
 
+MAX_PAGE_SIZE = 500
+UTC_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _parse_moment(value):
+    """
+    Parses an ISO date or date and time from a query parameter. Raises ValueError if it is missing or invalid.
+    """
+    moment = parse_datetime(value or '')
+    if moment is None:
+        day = parse_date(value or '')
+        if day is None:
+            raise ValueError(f"Invalid date and time: {value!r}")
+        moment = datetime.combine(day, time())
+    if settings.USE_TZ and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _encode_cursor(date_time, appointment_id):
+    # Whole microseconds since 1970 keep the cursor exact and URL-safe.
+    epoch = UTC_EPOCH if timezone.is_aware(date_time) else UTC_EPOCH.replace(tzinfo=None)
+    return f"{(date_time - epoch) // timedelta(microseconds=1)}_{appointment_id}"
+
+
+def _decode_cursor(cursor):
+    micros, appointment_id = cursor.split('_')
+    epoch = UTC_EPOCH if settings.USE_TZ else UTC_EPOCH.replace(tzinfo=None)
+    return epoch + timedelta(microseconds=int(micros)), int(appointment_id)
+
+
+@login_required
+@user_passes_test(is_admin)
+def clinic_appointments(request, clinic_id):
+    """
+    Returns one page of a clinic's appointments as JSON, with keyset pagination.
+
+    Query parameters:
+    - from, to: The range, as ISO dates or dates and times. "to" is exclusive.
+    - status: Only return appointments with this status.
+    - after: The "next" cursor of the previous page. Leave out for the first page.
+    - limit: Page size, at most MAX_PAGE_SIZE.
+    """
+    clinic = get_object_or_404(Clinic, pk=clinic_id)
+    try:
+        start = _parse_moment(request.GET.get('from'))
+        end = _parse_moment(request.GET.get('to'))
+        after = _decode_cursor(request.GET['after']) if request.GET.get('after') else None
+        limit = int(request.GET.get('limit', 50))
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    page, next_after = Appointment.clinic_schedule(clinic, start, end, request.GET.get('status'), after, limit)
+    return JsonResponse({
+        'appointments': [{'id': appointment.id, 'date_time': appointment.date_time.isoformat(),
+                          'status': appointment.status, 'user_id': appointment.user_id}
+                         for appointment in page],
+        'next': _encode_cursor(*next_after) if next_after else None
+    })
+
+
+
+def _request_available_appointments():
+    # A page view waits for one short call, never for a series of retries.
+    response = get_http_client().get(AVAILABLE_APPOINTMENTS_URL, timeout=settings.AVAILABLE_APPOINTMENTS_TIMEOUT,
+                                     retries=0)
+    response.raise_for_status()
+    return response.json()
+
+
+def available_appointments_cache():
+    return get_cache('available_appointments', settings.AVAILABLE_APPOINTMENTS_TTL,
+                     settings.AVAILABLE_APPOINTMENTS_STALE_TTL)
+
+
+def available_appointments_breaker():
+    return get_breaker('available_appointments', settings.AVAILABLE_APPOINTMENTS_FAILURE_THRESHOLD,
+                       settings.AVAILABLE_APPOINTMENTS_RECOVERY_TIMEOUT,
+                       settings.AVAILABLE_APPOINTMENTS_HALF_OPEN_CALLS)
+
 
 def fetch_available_appointments(request):
     """
     Fetches available appointments from an external API and displays them.
+    The answer is cached (see AVAILABLE_APPOINTMENTS_TTL in settings) and served
+    stale while one background refresh runs, so page views do not each call the API.
+    A "service" query parameter keeps only clinics offering a service whose name starts with it.
+
+    Calls go through a circuit breaker (see AVAILABLE_APPOINTMENTS_FAILURE_THRESHOLD
+    in settings), so while the API is down pages do not each wait for it to time
+    out. Meanwhile the last answer it gave is shown however old, or, if there
+    was none, the open slots worked out from the local availability and appointments.
     """
+    cache = available_appointments_cache()
+    breaker = available_appointments_breaker()
+    context = {}
     try:
-        response = requests.get('http://127.0.0.1:5000/available')
-        if response.status_code == 200:
-            available_appointments = response.json()
-            context = {'appointments': available_appointments}
-        else:
-            context = {'error': 'Failed to fetch available appointments.'}
+        service = request.GET.get('service')
+        clinic_ids = Service.clinic_ids_for(service) if service else None
+        try:
+            # Page views that find another one fetching wait no longer than that fetch may take.
+            available_appointments = cache.get(AVAILABLE_APPOINTMENTS_URL,
+                                               lambda: breaker.call(_request_available_appointments),
+                                               wait=sum(settings.AVAILABLE_APPOINTMENTS_TIMEOUT))
+        except Exception as e:
+            reason = 'the service is unavailable' if isinstance(e, CircuitOpenError) else e
+            last_good = cache.last_good(AVAILABLE_APPOINTMENTS_URL)
+            if last_good is None:
+                available_appointments = Availability.open_slots(
+                    clinic_ids=clinic_ids, limit=settings.AVAILABLE_APPOINTMENTS_FALLBACK_SLOTS)
+                context['notice'] = (f'Could not fetch available appointments ({reason}); '
+                                     f'showing open slots from the local schedule.')
+            else:
+                available_appointments, age = last_good
+                context['notice'] = (f'Could not fetch available appointments ({reason}); '
+                                     f'showing those fetched {age:.0f} seconds ago.')
+        if clinic_ids is not None:
+            available_appointments = [appt for appt in available_appointments
+                                      if appt.get('clinic_id') in clinic_ids]
+        context['appointments'] = available_appointments
     except Exception as e:
-        context = {'error': f'An error occurred: {e}'}
+        context = {'error': f'Failed to fetch available appointments: {e}'}
 
     return render(request, 'available_appointments.html', context)
 
 
+@staff_member_required
+def upstream_stats(request):
+    """
+    Returns the available-appointments cache counters (hit ratio, staleness),
+    its circuit breaker's state and the HTTP client's per-endpoint metrics as JSON.
+    """
+    return JsonResponse({'available_appointments_cache': available_appointments_cache().stats(),
+                         'available_appointments_breaker': available_appointments_breaker().stats(),
+                         'http': get_http_client().stats()})
+
+
 class ClinicCapacityForm(forms.Form):
     clinic_code = forms.IntegerField(label='Clinic Code')
     reserved_appointments = forms.IntegerField(label='Reserved Appointments')
@@ -106,18 +237,16 @@ def adjust_clinic_capacity(request):
         form = ClinicCapacityForm(request.POST)
         if form.is_valid():
             try:
+                # Queued in the outbox and sent by a background flusher, so the
+                # request does not wait on the slot API and a failed send is retried.
+                CapacityUpdate.enqueue(form.cleaned_data['clinic_code'], form.cleaned_data['reserved_appointments'])
+                capacity_outbox.wake()
                 payload = {
                     'clinic code': form.cleaned_data['clinic_code'],
-                    'reserved appointments': form.cleaned_data['reserved_appointments']
+                    'reserved appointments': form.cleaned_data['reserved_appointments'],
+                    'queued': True
                 }
-                response = requests.post('https://localhost/slots', json=payload)
-
-                if response.status_code == 200:
-                    # Handle success
-                    return render(request, 'adjust_capacity_success.html', {'response': response.json()})
-                else:
-                    # Handle failure
-                    return render(request, 'adjust_capacity_failure.html', {'error': 'Failed to adjust clinic capacity.'})
+                return render(request, 'adjust_capacity_success.html', {'response': payload})
             except Exception as e:
                 # Handle exception
                 return render(request, 'adjust_capacity_failure.html', {'error': f'An error occurred: {e}'})
@@ -0,0 +1,183 @@
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+
+from repository import get_repositories
+
+_STOP = object()
+NOTIFICATION_COLUMNS = ('username', 'message', 'date_time')
+
+
+class NotificationDispatcher:
+    """
+    Writes notifications to the Notifications table from a background thread.
+
+    Callers put notifications on a bounded queue and return immediately. The
+    worker writes them in batches, flushing when a batch is full or when the
+    oldest queued notification has waited flush_interval seconds. When the
+    queue is full, submit() blocks (or fails, if asked not to block), which
+    keeps a burst of notifications from growing memory without bound.
+
+    Attributes:
+    - batch_size: Largest number of notifications written in one transaction.
+    - flush_interval: Longest time, in seconds, a notification waits before its batch is written.
+    - max_queue_size: Number of notifications that can be waiting before submit() applies back-pressure.
+    """
+    def __init__(self, batch_size=500, flush_interval=0.5, max_queue_size=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.failed_batches = 0
+
+    def start(self):
+        """
+        Starts the worker thread if it is not already running.
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='notification-dispatcher', daemon=True)
+                self._thread.start()
+        return self
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, username, message, date_time, block=True, timeout=None):
+        """
+        Queues a notification for writing.
+
+        Attributes:
+        - username: The username of the recipient.
+        - message: The content of the notification.
+        - date_time: ISO timestamp of when the notification was created.
+        - block: Whether to wait for room when the queue is full.
+        - timeout: Longest time to wait for room, in seconds. None waits indefinitely.
+
+        Returns True if the notification was queued, False if the queue stayed full.
+        """
+        if not self.running:
+            self.start()
+        try:
+            self._queue.put((username, message, date_time), block=block, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def pending(self):
+        """
+        Returns the approximate number of notifications waiting to be written.
+        """
+        return self._queue.qsize()
+
+    def flush(self):
+        """
+        Blocks until every notification queued so far has been written (or has failed).
+        """
+        if self.running:
+            self._queue.join()
+
+    def shutdown(self, drain=True, timeout=None):
+        """
+        Stops the worker thread.
+
+        Attributes:
+        - drain: Write the notifications still in the queue before stopping. If False they are discarded.
+        - timeout: Longest time to wait for the worker to finish, in seconds.
+        """
+        if not self.running:
+            return
+        if not drain:
+            while True:
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                except queue.Empty:
+                    break
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self._write(batch)
+            finally:
+                # flush() waits on these, so they are marked done whatever happened.
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        try:
+            notifications = get_repositories().notifications
+            notifications.add_many(batch, NOTIFICATION_COLUMNS)
+            self.written += len(batch)
+            self.batches += 1
+        except sqlite3.IntegrityError:
+            # One bad row (e.g. an unknown username) should not take the rest of
+            # the batch down with it, so retry the rows one at a time.
+            for row in batch:
+                try:
+                    notifications.add_many([row], NOTIFICATION_COLUMNS)
+                    self.written += 1
+                except Exception as e:
+                    self.failed += 1
+                    print(f"Notification to {row[0]} could not be stored: {e}")
+            self.batches += 1
+        except Exception as e:
+            # Any error, not only a database one, fails the batch instead of ending the worker.
+            self.failed += len(batch)
+            self.failed_batches += 1
+            print(f"An error occurred while writing {len(batch)} notifications: {e}")
+
+    def stats(self):
+        """
+        Returns counters describing the dispatcher's work so far.
+        """
+        return {
+            'written': self.written,
+            'failed': self.failed,
+            'batches': self.batches,
+            'failed_batches': self.failed_batches,
+            'pending': self.pending()
+        }
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+    Returns the shared dispatcher, creating it on first use. It is drained when the interpreter exits.
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher()
+            atexit.register(_dispatcher.shutdown)
+        return _dispatcher
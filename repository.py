@@ -0,0 +1,587 @@
+import json
+import threading
+from collections import OrderedDict
+
+from database import get_db_connection, on_commit, on_rollback
+from service_index import update_clinic_services
+from timeslots import epoch_seconds, format_date_time, to_epoch
+
+DEFAULT_CACHE_SIZE = 10000
+
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used entry when full.
+
+    Attributes:
+    - max_size: Largest number of entries kept, or None for no limit.
+    - hits, misses, evictions: Counters for tuning max_size.
+    """
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns the cached value, or None on a miss.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while self.max_size is not None and len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            return self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache counters and the hit ratio.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0
+        }
+
+
+class Repository:
+    """
+    Reads and writes one table through a write-through LRU cache.
+
+    Reads by primary key are answered from memory when possible and fall back
+    to the database on a miss. A write drops the keys it touches from the
+    cache and caches the new records only once its transaction commits (see
+    _stage), so even inside a larger transaction that later rolls back, the
+    cache never holds data the database does not.
+
+    Records are dictionaries keyed by the table's column names.
+
+    Attributes:
+    - table: Name of the table.
+    - key: Name of the primary key column.
+    - columns: All columns of the table, key first.
+    """
+    table = None
+    key = None
+    columns = ()
+
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE):
+        self.cache = LRUCache(cache_size)
+
+    def _record(self, row):
+        return dict(zip(self.columns, row))
+
+    def _records(self, rows):
+        """
+        Turns a batch of rows into records. Override it, not just _record, when
+        a record needs data from another table, so a batch reads it in one query.
+        """
+        return [self._record(row) for row in rows]
+
+    def _select(self, where, params):
+        with get_db_connection() as conn:
+            row = conn.execute(f"SELECT {', '.join(self.columns)} FROM {self.table} WHERE {where}",
+                               params).fetchone()
+        return self._record(row) if row else None
+
+    def _cache(self, record):
+        self.cache.put(record[self.key], record)
+
+    def _forget(self, key):
+        self.cache.pop(key)
+
+    def _stage(self, records=(), keys=()):
+        """
+        Brings the cache in line with a write made in the current transaction.
+        Call it inside the write's `with get_db_connection()` block.
+
+        The written keys are dropped right away, so reads inside the
+        transaction see its changes from the database. The records are cached
+        once it commits; if it rolls back the keys are dropped again, in case
+        such a read cached the changes that were undone.
+
+        Attributes:
+        - records: The records as written, cached on commit.
+        - keys: Further keys that were changed or deleted, left out of the cache.
+        """
+        records = list(records)
+        keys = [record[self.key] for record in records] + list(keys)
+
+        def forget():
+            for key in keys:
+                self._forget(key)
+
+        def commit():
+            forget()
+            for record in records:
+                self._cache(record)
+
+        forget()
+        on_commit(commit)
+        on_rollback(forget)
+
+    def get(self, key):
+        """
+        Returns the record with this primary key, or None.
+        """
+        record = self.cache.get(key)
+        if record is None:
+            record = self._select(f"{self.key} = ?", (key,))
+            if record is not None:
+                self._cache(record)
+        return record
+
+    def get_many(self, keys):
+        """
+        Returns the records with these primary keys as a dictionary keyed by
+        primary key. Keys without a record are left out. Cache misses are read
+        with one query.
+        """
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            record = self.cache.get(key)
+            if record is None:
+                missing.append(key)
+            else:
+                found[key] = record
+        if missing:
+            with get_db_connection() as conn:
+                rows = conn.execute(f"SELECT {', '.join(self.columns)} FROM {self.table} "
+                                    f"WHERE {self.key} IN (SELECT value FROM json_each(?))",
+                                    (json.dumps(missing),)).fetchall()
+            for record in self._records(rows):
+                self._cache(record)
+                found[record[self.key]] = record
+        return found
+
+    def get_many_for_update(self, keys):
+        """
+        Reads records from the database, not the cache, for a write that
+        depends on them, e.g. giving a seat back only if the appointment was
+        live. The read is a no-op UPDATE ... RETURNING, so the current
+        transaction holds the write lock from then on and the records cannot
+        change before it commits. Call it inside the write's transaction.
+
+        Returns a dictionary keyed by primary key; keys without a record are left out.
+        """
+        with get_db_connection() as conn:
+            rows = conn.execute(f"UPDATE {self.table} SET {self.key} = {self.key} "
+                                f"WHERE {self.key} IN (SELECT value FROM json_each(?)) "
+                                f"RETURNING {', '.join(self.columns)}",
+                                (json.dumps(list(dict.fromkeys(keys))),)).fetchall()
+        return {row[0]: dict(zip(self.columns, row)) for row in rows}
+
+    def add(self, record):
+        """
+        Inserts a record and caches it. The primary key is filled in from the
+        database when the record does not carry one.
+
+        Returns the stored record. Raises sqlite3.IntegrityError on constraint violations.
+        """
+        columns = [column for column in self.columns if column in record and
+                   (column != self.key or record[column] is not None)]
+        with get_db_connection() as conn:
+            cursor = conn.execute(f"INSERT INTO {self.table} ({', '.join(columns)}) "
+                                  f"VALUES ({', '.join('?' for _ in columns)})",
+                                  [record[column] for column in columns])
+            stored = {column: record.get(column) for column in self.columns}
+            if stored[self.key] is None:
+                stored[self.key] = cursor.lastrowid
+            self._stage([stored])
+        return stored
+
+    def add_many(self, rows, columns):
+        """
+        Inserts many rows with one executemany. The rows are not cached, which
+        keeps bulk loads from flushing the records that are actually being read.
+
+        Attributes:
+        - rows: Iterable of value tuples.
+        - columns: Names of the columns the tuples fill, in order.
+        """
+        with get_db_connection() as conn:
+            conn.executemany(f"INSERT INTO {self.table} ({', '.join(columns)}) "
+                             f"VALUES ({', '.join('?' for _ in columns)})", rows)
+
+    def update(self, key, **changes):
+        """
+        Applies column changes to one record.
+
+        Returns the updated record, or None if there is no record with this key.
+        """
+        if not changes:
+            return self.get(key)
+        assignments = ', '.join(f"{column} = ?" for column in changes)
+        with get_db_connection() as conn:
+            row = conn.execute(f"UPDATE {self.table} SET {assignments} WHERE {self.key} = ? "
+                               f"RETURNING {', '.join(self.columns)}", (*changes.values(), key)).fetchone()
+            if row is None:
+                self._stage(keys=[key])
+                return None
+            record = self._record(row)
+            self._stage([record])
+        return record
+
+    def update_many(self, changes, columns):
+        """
+        Applies column changes to many records with one executemany, in one transaction.
+
+        Attributes:
+        - changes: Dictionary mapping primary keys to value tuples.
+        - columns: Names of the columns the tuples set, in order.
+
+        Returns the number of records updated. Raises sqlite3.IntegrityError on
+        constraint violations, in which case nothing is changed.
+        """
+        assignments = ', '.join(f"{column} = ?" for column in columns)
+        with get_db_connection() as conn:
+            cursor = conn.executemany(f"UPDATE {self.table} SET {assignments} WHERE {self.key} = ?",
+                                      ((*values, key) for key, values in changes.items()))
+            # The changed records are read back from the database on their next use.
+            self._stage(keys=changes)
+        return cursor.rowcount
+
+    def remove(self, keys):
+        """
+        Deletes a batch of records in one statement and returns them as they
+        were in the database when deleted, e.g. to undo what they held.
+        """
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return []
+        with get_db_connection() as conn:
+            # json_each expands the key list so the batch is a single statement.
+            rows = conn.execute(f"DELETE FROM {self.table} WHERE {self.key} IN (SELECT value FROM json_each(?)) "
+                                f"RETURNING {', '.join(self.columns)}", (json.dumps(keys),)).fetchall()
+            self._stage(keys=keys)
+        return [dict(zip(self.columns, row)) for row in rows]
+
+    def delete(self, keys):
+        """
+        Deletes a batch of records in one statement and transaction.
+
+        Returns the number of records deleted.
+        """
+        return len(self.remove(keys))
+
+    def stats(self):
+        return self.cache.stats()
+
+
+class UserRepository(Repository):
+    """
+    Users, with an extra lookup by username.
+
+    A username is looked up through the unique username index and only that
+    user is cached, in the same bounded LRU cache as lookups by ID; a second
+    bounded map from username to user ID lets repeated logins skip the
+    database. An entry of that map whose user has since been evicted or
+    renamed just sends the lookup back to the index.
+    """
+    table = 'Users'
+    key = 'user_id'
+    columns = ('user_id', 'username', 'email', 'password', 'user_type')
+
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE):
+        super().__init__(cache_size)
+        self.ids_by_username = LRUCache(cache_size)
+
+    def _cache(self, record):
+        super()._cache(record)
+        self.ids_by_username.put(record['username'], record['user_id'])
+
+    def _forget(self, key):
+        record = self.cache.pop(key)
+        if record is not None:
+            self.ids_by_username.pop(record['username'])
+
+    def get_by_username(self, username):
+        """
+        Returns the record of the user with this username, or None.
+        """
+        user_id = self.ids_by_username.get(username)
+        if user_id is not None:
+            record = self.cache.get(user_id)
+            if record is not None and record['username'] == username:
+                return record
+        record = self._select("username = ?", (username,))
+        if record is not None:
+            self._cache(record)
+        return record
+
+
+class ClinicRepository(Repository):
+    """
+    Clinics. Records carry the clinic's service names, stored in the Services table.
+    """
+    table = 'Clinics'
+    key = 'clinic_id'
+    columns = ('clinic_id', 'name', 'address', 'phone_info')
+
+    def _record(self, row):
+        return self._records([row])[0]
+
+    def _records(self, rows):
+        records = [dict(zip(self.columns, row)) for row in rows]
+        services = {record['clinic_id']: record.setdefault('services', []) for record in records}
+        if services:
+            with get_db_connection() as conn:
+                for clinic_id, name in conn.execute(
+                        "SELECT clinic_id, name FROM Services WHERE clinic_id IN (SELECT value FROM json_each(?)) "
+                        "ORDER BY service_id", (json.dumps(list(services)),)):
+                    services[clinic_id].append(name)
+        return records
+
+    def add(self, record):
+        """
+        Inserts a clinic and its services in one transaction.
+        """
+        with get_db_connection() as conn:
+            stored = super().add(record)
+            stored['services'] = list(record.get('services') or [])
+            conn.executemany("INSERT INTO Services (clinic_id, name) VALUES (?, ?)",
+                             ((stored['clinic_id'], name) for name in stored['services']))
+            on_commit(lambda: update_clinic_services(stored['clinic_id'], stored['services']))
+        return stored
+
+    def set_services(self, clinic_id, names):
+        """
+        Replaces a clinic's services in one transaction and re-indexes them.
+
+        Returns the updated record, or None if there is no clinic with this key.
+        """
+        names = list(names)
+        with get_db_connection() as conn:
+            record = self.get(clinic_id)
+            if record is None:
+                return None
+            conn.execute("DELETE FROM Services WHERE clinic_id = ?", (clinic_id,))
+            conn.executemany("INSERT INTO Services (clinic_id, name) VALUES (?, ?)",
+                             ((clinic_id, name) for name in names))
+            record = {**record, 'services': names}
+            self._stage([record])
+            on_commit(lambda: update_clinic_services(clinic_id, names))
+        return record
+
+    def delete(self, keys):
+        keys = list(keys)
+        with get_db_connection():
+            deleted = super().delete(keys)
+
+            def unindex():
+                for key in keys:
+                    update_clinic_services(key, ())
+            on_commit(unindex)
+        return deleted
+
+
+class AppointmentRepository(Repository):
+    """
+    Appointments. Writes that set date_time parse it once and store it three
+    ways: date_time in the canonical "YYYY-MM-DD HH:MM" form, starts_at as
+    seconds since 1970 UTC and tz_offset as the UTC offset in minutes. Range
+    queries go through the indexed starts_at column.
+    """
+    table = 'Appointments'
+    key = 'appointment_id'
+    columns = ('appointment_id', 'status', 'date_time', 'user_id', 'clinic_id', 'starts_at', 'tz_offset')
+
+    @staticmethod
+    def _timestamped(changes):
+        """
+        Returns the changes with date_time in canonical form and starts_at and
+        tz_offset filled in from it. date_time must be passed as given: the
+        canonical form keeps the wall-clock time but drops the UTC offset.
+        Raises ValueError for an unreadable date_time.
+        """
+        if changes.get('date_time') is None:
+            return changes
+        starts_at, tz_offset = to_epoch(changes['date_time'])
+        return {**changes, 'date_time': format_date_time(changes['date_time']),
+                'starts_at': starts_at, 'tz_offset': tz_offset}
+
+    def add(self, record):
+        return super().add(self._timestamped(record))
+
+    def update(self, key, **changes):
+        return super().update(key, **self._timestamped(changes))
+
+    def update_many(self, changes, columns):
+        if 'date_time' not in columns:
+            return super().update_many(changes, columns)
+        stamped = {}
+        for key, values in changes.items():
+            record = self._timestamped(dict(zip(columns, values)))
+            stamped[key] = tuple(record.values())
+        return super().update_many(stamped, (*columns, 'starts_at', 'tz_offset'))
+
+    def clinic_page(self, clinic_id, start, end, status=None, after=None, limit=50):
+        """
+        Returns one page of a clinic's appointments in a time range, ordered by
+        (starts_at, appointment_id). The page is found by seeking the
+        (clinic_id, starts_at) index to the cursor, so a deep page costs the
+        same as the first. The rows are not cached, so paging through a
+        schedule does not flush the records that are actually being read.
+
+        Attributes:
+        - clinic_id: The clinic whose schedule is listed.
+        - start: First moment of the range, as a date and time or epoch seconds.
+        - end: End of the range, exclusive.
+        - status: Only return appointments with this status.
+        - after: Keyset cursor, the (starts_at, appointment_id) of the last appointment of the previous page.
+        - limit: Largest number of appointments to return.
+        """
+        low = epoch_seconds(start)
+        if after is not None:
+            # Seek straight to the cursor: the index range starts at its time.
+            low = max(low, after[0])
+        query = (f"SELECT {', '.join(self.columns)} FROM {self.table} "
+                 f"WHERE clinic_id = ? AND starts_at >= ? AND starts_at < ?")
+        params = [clinic_id, low, epoch_seconds(end)]
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        if after is not None:
+            query += " AND (starts_at > ? OR appointment_id > ?)"
+            params.extend(after)
+        query += " ORDER BY starts_at, appointment_id LIMIT ?"
+        params.append(limit)
+        with get_db_connection() as conn:
+            return [self._record(row) for row in conn.execute(query, params)]
+
+    def cancel(self, appointment_id):
+        """
+        Cancels a live appointment. The status check is part of the update, so
+        two concurrent cancellations cannot both succeed.
+
+        Returns the canceled record, or None if there is no live appointment with this key.
+        """
+        with get_db_connection() as conn:
+            row = conn.execute(f"UPDATE {self.table} SET status = 'canceled' "
+                               f"WHERE {self.key} = ? AND status != 'canceled' "
+                               f"RETURNING {', '.join(self.columns)}", (appointment_id,)).fetchone()
+            if row is None:
+                return None
+            record = self._record(row)
+            self._stage([record])
+        return record
+
+
+class NotificationRepository(Repository):
+    table = 'Notifications'
+    key = 'notification_id'
+    columns = ('notification_id', 'username', 'message', 'date_time')
+
+
+class WaitlistRepository(Repository):
+    table = 'Waitlist'
+    key = 'waitlist_id'
+    columns = ('waitlist_id', 'user_id', 'clinic_id', 'day', 'start_time', 'end_time', 'priority',
+               'requested_at', 'status', 'appointment_id')
+
+    def claim(self, clinic_id, day, time_of_day):
+        """
+        Marks the top waiter of a clinic and day whose time window contains
+        time_of_day as booked, highest priority first and then oldest request,
+        with one UPDATE ... RETURNING on the queue index. Run it inside the
+        transaction that books their seat: if that rolls back, they are waiting again.
+
+        Returns the claimed record, or None if nobody is waiting for that time.
+        """
+        with get_db_connection() as conn:
+            row = conn.execute(
+                f"UPDATE {self.table} SET status = 'booked' WHERE {self.key} = ("
+                f"SELECT {self.key} FROM {self.table} WHERE clinic_id = ? AND day = ? AND status = 'waiting' "
+                f"AND (start_time IS NULL OR start_time <= ?) AND (end_time IS NULL OR end_time > ?) "
+                f"ORDER BY priority DESC, requested_at LIMIT 1) "
+                f"RETURNING {', '.join(self.columns)}", (clinic_id, day, time_of_day, time_of_day)).fetchone()
+            if row is None:
+                return None
+            record = self._record(row)
+            self._stage([record])
+        return record
+
+    def withdraw(self, waitlist_id):
+        """
+        Takes a waiting entry off the waitlist. Returns False if it was not waiting.
+        """
+        with get_db_connection() as conn:
+            row = conn.execute(f"UPDATE {self.table} SET status = 'withdrawn' "
+                               f"WHERE {self.key} = ? AND status = 'waiting' "
+                               f"RETURNING {', '.join(self.columns)}", (waitlist_id,)).fetchone()
+            if row is None:
+                return False
+            self._stage([self._record(row)])
+        return True
+
+    def waiting(self, clinic_id, day):
+        """
+        Returns the number of patients waiting for a clinic on a day.
+        """
+        with get_db_connection() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {self.table} WHERE clinic_id = ? AND day = ? "
+                                f"AND status = 'waiting'", (clinic_id, day)).fetchone()[0]
+
+
+class Repositories:
+    """
+    The repository of every entity. All but the users share one cache size
+    setting; the users are cached in full (see UserRepository).
+    """
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE):
+        self.users = UserRepository()
+        self.clinics = ClinicRepository(cache_size)
+        self.appointments = AppointmentRepository(cache_size)
+        self.notifications = NotificationRepository(cache_size)
+        self.waitlist = WaitlistRepository(cache_size)
+
+    def stats(self):
+        """
+        Returns the cache counters of each repository, keyed by table name.
+        """
+        return {repo.table: repo.stats()
+                for repo in (self.users, self.clinics, self.appointments, self.notifications, self.waitlist)}
+
+
+_repositories = None
+_repositories_lock = threading.Lock()
+
+
+def get_repositories():
+    """
+    Returns the shared repositories, creating them on first use.
+    """
+    global _repositories
+    with _repositories_lock:
+        if _repositories is None:
+            _repositories = Repositories()
+        return _repositories
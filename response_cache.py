@@ -0,0 +1,177 @@
+import threading
+import time
+
+DEFAULT_TTL = 30.0
+DEFAULT_STALE_TTL = 300.0
+
+
+class _Entry:
+    __slots__ = ('value', 'fetched_at')
+
+    def __init__(self, value, fetched_at):
+        self.value = value
+        self.fetched_at = fetched_at
+
+
+class _Flight:
+    """
+    One fetch in progress. Callers that need its result wait on done.
+    """
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    """
+    Caches the results of slow upstream calls by key, serving stale results
+    while they are refreshed.
+
+    A result younger than ttl is served as is. Up to stale_ttl seconds after
+    that it is still served, but a single background refresh is started so
+    the next caller gets a fresh one. Older results, and keys never fetched,
+    are fetched while the caller waits. Concurrent callers for the same key
+    share one fetch (request coalescing), so the upstream sees at most one
+    call per key at a time. Failed fetches are not cached.
+
+    Attributes:
+    - ttl: Seconds a result is fresh.
+    - stale_ttl: Seconds after ttl a result may still be served while it is refreshed.
+    - hits, stale_hits, misses: How lookups were answered.
+    - coalesced: Lookups that waited for another caller's fetch instead of calling the upstream.
+    - refreshes, refresh_errors: Background refreshes started, and those that failed.
+    - max_staleness: Largest age past ttl, in seconds, of a result served stale.
+    """
+    def __init__(self, ttl=DEFAULT_TTL, stale_ttl=DEFAULT_STALE_TTL):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.max_staleness = 0.0
+
+    def get(self, key, fetch, wait=None):
+        """
+        Returns the cached result for a key, calling fetch() when there is none to serve.
+
+        Attributes:
+        - key: What the result is cached under, e.g. the upstream URL.
+        - fetch: Function without arguments that returns a fresh result, or raises.
+        - wait: Seconds to wait for another caller's fetch of the key. Defaults to no limit.
+
+        Raises whatever fetch() raised if the caller had to wait for a fetch and
+        it failed, or TimeoutError if another caller's fetch took longer than wait.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            age = now - entry.fetched_at if entry is not None else None
+            if age is not None and age < self.ttl:
+                self.hits += 1
+                return entry.value
+            if age is not None and age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self.max_staleness = max(self.max_staleness, age - self.ttl)
+                if key not in self._flights:
+                    flight = self._flights[key] = _Flight()
+                    self.refreshes += 1
+                    threading.Thread(target=self._refresh, args=(key, fetch, flight), daemon=True).start()
+                return entry.value
+            self.misses += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if leader:
+            self._fetch(key, fetch, flight)
+        elif not flight.done.wait(wait):
+            raise TimeoutError(f"no result for {key} within {wait} seconds")
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _fetch(self, key, fetch, flight):
+        try:
+            flight.value = fetch()
+        except Exception as e:
+            flight.error = e
+        with self._lock:
+            if flight.error is None:
+                self._entries[key] = _Entry(flight.value, time.monotonic())
+            del self._flights[key]
+        flight.done.set()
+
+    def _refresh(self, key, fetch, flight):
+        self._fetch(key, fetch, flight)
+        if flight.error is not None:
+            with self._lock:
+                self.refresh_errors += 1
+
+    def last_good(self, key):
+        """
+        Returns (result, age in seconds) of the last successful fetch for a
+        key, however old, or None if it was never fetched. For falling back
+        to when the upstream cannot be reached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return entry.value, time.monotonic() - entry.fetched_at
+
+    def invalidate(self, key=None):
+        """
+        Drops the cached result of one key, or of every key.
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """
+        Returns the counters, the hit ratio (fresh and stale hits over all
+        lookups) and the current age of each cached result in seconds.
+        """
+        now = time.monotonic()
+        with self._lock:
+            ages = {key: now - entry.fetched_at for key, entry in self._entries.items()}
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'refreshes': self.refreshes,
+            'refresh_errors': self.refresh_errors,
+            'hit_ratio': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            'max_staleness': self.max_staleness,
+            'ages': ages
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name, ttl=DEFAULT_TTL, stale_ttl=DEFAULT_STALE_TTL):
+    """
+    Returns the shared cache with this name, creating it with the given TTLs on first use.
+    """
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            cache = _caches[name] = ResponseCache(ttl, stale_ttl)
+        return cache
@@ -0,0 +1,262 @@
+import sys
+from database import get_db_connection, configure
+from timeslots import format_date_time, to_epoch
+
+
+def _convert_appointment_times(conn):
+    """
+    Fills Appointments.starts_at and tz_offset from the free-form date_time
+    text and rewrites date_time in its canonical form. Rows whose date_time
+    cannot be parsed keep a NULL starts_at and are reported.
+    """
+    converted = []
+    unparsed = []
+    for appointment_id, date_time in conn.execute("SELECT appointment_id, date_time FROM Appointments"):
+        try:
+            converted.append((format_date_time(date_time), *to_epoch(date_time), appointment_id))
+        except (TypeError, ValueError):
+            unparsed.append(appointment_id)
+    conn.executemany("UPDATE Appointments SET date_time = ?, starts_at = ?, tz_offset = ? "
+                     "WHERE appointment_id = ?", converted)
+    if unparsed:
+        print(f"{len(unparsed)} appointments have an unreadable date and time: {unparsed[:10]}")
+
+
+def _index_live_slots(conn):
+    """
+    Builds the one-live-appointment-per-slot unique index. Slots that are
+    already double-booked are left as they are and reported, and the index
+    is not built: no patient's appointment is canceled to make room for it.
+    """
+    clashes = conn.execute("SELECT clinic_id, date_time, group_concat(appointment_id) FROM Appointments "
+                           "WHERE status != 'canceled' GROUP BY clinic_id, date_time HAVING COUNT(*) > 1").fetchall()
+    if clashes:
+        print(f"{len(clashes)} slots hold more than one live appointment, so one appointment per slot is "
+              f"not enforced; clinic, time and appointments of the first ones: {clashes[:10]}")
+        return
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_appointments_live_slot "
+                 "ON Appointments(clinic_id, date_time) WHERE status != 'canceled'")
+
+
+# Each migration is a list of statements, or of functions taking the
+# connection for conversions SQL cannot express. A database at version N has had the
+# first N migrations applied; the version is kept in PRAGMA user_version.
+# Never edit a migration that has shipped, append a new one instead.
+MIGRATIONS = [
+    # 1: base tables (SQLite port of appointment_management.sql)
+    [
+        """CREATE TABLE IF NOT EXISTS Users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            email TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            user_type TEXT NOT NULL CHECK (user_type IN ('patient', 'clinic staff', 'staff'))
+        )""",
+        """CREATE TABLE IF NOT EXISTS Clinics (
+            clinic_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            address TEXT NOT NULL,
+            phone_info TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS Appointments (
+            appointment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL CHECK (status IN ('pending', 'confirmed', 'canceled')),
+            date_time TEXT NOT NULL,
+            user_id INTEGER NOT NULL REFERENCES Users(user_id),
+            clinic_id INTEGER NOT NULL REFERENCES Clinics(clinic_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS Notifications (
+            notification_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL REFERENCES Users(username),
+            message TEXT NOT NULL,
+            date_time TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS Services (
+            service_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            clinic_id INTEGER NOT NULL REFERENCES Clinics(clinic_id),
+            name TEXT NOT NULL,
+            description TEXT
+        )""",
+    ],
+    # 2: indexes for the slot check and the per-user / per-clinic listings
+    [
+        "CREATE INDEX IF NOT EXISTS idx_appointments_clinic_time ON Appointments(clinic_id, date_time)",
+        "CREATE INDEX IF NOT EXISTS idx_appointments_user_time ON Appointments(user_id, date_time)",
+        "CREATE INDEX IF NOT EXISTS idx_notifications_user_time ON Notifications(username, date_time)",
+        "CREATE INDEX IF NOT EXISTS idx_services_clinic ON Services(clinic_id)",
+    ],
+    # 3: at most one live (non-canceled) appointment per clinic slot, unless
+    # existing data already breaks the rule (see _index_live_slots)
+    [
+        _index_live_slots,
+    ],
+    # 4: bookable time slots opened by clinic staff
+    [
+        """CREATE TABLE IF NOT EXISTS Slots (
+            slot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            clinic_id INTEGER NOT NULL REFERENCES Clinics(clinic_id),
+            date_time TEXT NOT NULL,
+            UNIQUE (clinic_id, date_time)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_slots_time ON Slots(date_time)",
+    ],
+    # 5: per-slot capacity for clinics running several providers in parallel.
+    # A slot takes up to `capacity` live appointments and `reserved` counts
+    # them, so the one-appointment-per-slot unique index is dropped. Every
+    # live appointment gets a slot (times nobody opened become one-seat
+    # slots) and the counters are filled in from the existing bookings.
+    [
+        "ALTER TABLE Slots ADD COLUMN capacity INTEGER NOT NULL DEFAULT 1 CHECK (capacity >= 0)",
+        "ALTER TABLE Slots ADD COLUMN reserved INTEGER NOT NULL DEFAULT 0 CHECK (reserved BETWEEN 0 AND capacity)",
+        """INSERT OR IGNORE INTO Slots (clinic_id, date_time)
+           SELECT DISTINCT clinic_id, strftime('%Y-%m-%d %H:%M', date_time) FROM Appointments
+           WHERE status != 'canceled'""",
+        """WITH booked AS (
+               SELECT clinic_id, strftime('%Y-%m-%d %H:%M', date_time) AS date_time, COUNT(*) AS n
+               FROM Appointments WHERE status != 'canceled' GROUP BY 1, 2)
+           UPDATE Slots SET reserved = booked.n, capacity = max(Slots.capacity, booked.n)
+           FROM booked WHERE booked.clinic_id = Slots.clinic_id AND booked.date_time = Slots.date_time""",
+        "DROP INDEX IF EXISTS uq_appointments_live_slot",
+    ],
+    # 6: patients waiting for a seat at a clinic on a day, optionally between two times
+    [
+        """CREATE TABLE IF NOT EXISTS Waitlist (
+            waitlist_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES Users(user_id),
+            clinic_id INTEGER NOT NULL REFERENCES Clinics(clinic_id),
+            day TEXT NOT NULL,
+            start_time TEXT,
+            end_time TEXT,
+            priority INTEGER NOT NULL DEFAULT 0,
+            requested_at TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'waiting' CHECK (status IN ('waiting', 'booked', 'withdrawn')),
+            appointment_id INTEGER REFERENCES Appointments(appointment_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_waitlist_waiting ON Waitlist(clinic_id, day) WHERE status = 'waiting'",
+    ],
+    # 7: seats held for a patient for a limited time before they confirm.
+    # A slot's seats are booked (reserved), held or free.
+    [
+        "ALTER TABLE Slots ADD COLUMN held INTEGER NOT NULL DEFAULT 0 CHECK (held >= 0 AND reserved + held <= capacity)",
+        """CREATE TABLE IF NOT EXISTS Holds (
+            hold_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            clinic_id INTEGER NOT NULL REFERENCES Clinics(clinic_id),
+            date_time TEXT NOT NULL,
+            user_id INTEGER NOT NULL REFERENCES Users(user_id),
+            expires_at REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_holds_expiry ON Holds(expires_at)",
+    ],
+    # 8: appointment times as an integer epoch (seconds since 1970 UTC) plus the
+    # UTC offset they were given in, so day, week and range queries are index
+    # range scans instead of comparisons of free-form text.
+    [
+        "ALTER TABLE Appointments ADD COLUMN starts_at INTEGER",
+        "ALTER TABLE Appointments ADD COLUMN tz_offset INTEGER NOT NULL DEFAULT 0",
+        _convert_appointment_times,
+        "DROP INDEX IF EXISTS idx_appointments_clinic_time",
+        "DROP INDEX IF EXISTS idx_appointments_user_time",
+        "CREATE INDEX IF NOT EXISTS idx_appointments_clinic_starts ON Appointments(clinic_id, starts_at)",
+        "CREATE INDEX IF NOT EXISTS idx_appointments_user_starts ON Appointments(user_id, starts_at)",
+    ],
+    # 9: outbox of reserved-appointment counts waiting to be reported to the
+    # external slot API. One row per clinic: a newer count replaces an unsent
+    # one and bumps its version.
+    [
+        """CREATE TABLE IF NOT EXISTS CapacityOutbox (
+            clinic_code INTEGER PRIMARY KEY,
+            reserved INTEGER NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_capacity_outbox_due ON CapacityOutbox(next_attempt_at)",
+    ],
+    # 10: waitlist queue order, so the top waiter of a clinic and day is claimed
+    # straight from the index inside the transaction that frees the seat
+    [
+        """CREATE INDEX IF NOT EXISTS idx_waitlist_queue
+           ON Waitlist(clinic_id, day, priority DESC, requested_at) WHERE status = 'waiting'""",
+        "DROP INDEX IF EXISTS idx_waitlist_waiting",
+    ],
+    # 11: slots and holds keyed on the epoch of their start (see migration 8)
+    # instead of the local date_time text, so one moment given with different
+    # UTC offsets is one slot. SQLite cannot drop the UNIQUE (clinic_id,
+    # date_time) constraint, so Slots is rebuilt; slot texts that name the
+    # same moment (around a daylight saving change) are merged.
+    [
+        """CREATE TABLE Slots_by_epoch (
+            slot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            clinic_id INTEGER NOT NULL REFERENCES Clinics(clinic_id),
+            date_time TEXT NOT NULL,
+            starts_at INTEGER NOT NULL,
+            capacity INTEGER NOT NULL DEFAULT 1 CHECK (capacity >= 0),
+            reserved INTEGER NOT NULL DEFAULT 0 CHECK (reserved BETWEEN 0 AND capacity),
+            held INTEGER NOT NULL DEFAULT 0 CHECK (held >= 0 AND reserved + held <= capacity),
+            UNIQUE (clinic_id, starts_at)
+        )""",
+        """INSERT INTO Slots_by_epoch (slot_id, clinic_id, date_time, starts_at, capacity, reserved, held)
+           SELECT slot_id, clinic_id, date_time, CAST(strftime('%s', date_time, 'utc') AS INTEGER),
+                  capacity, reserved, held
+           FROM Slots WHERE true ORDER BY slot_id
+           ON CONFLICT (clinic_id, starts_at) DO UPDATE SET capacity = capacity + excluded.capacity,
+               reserved = reserved + excluded.reserved, held = held + excluded.held""",
+        "DROP TABLE Slots",
+        "ALTER TABLE Slots_by_epoch RENAME TO Slots",
+        "CREATE INDEX IF NOT EXISTS idx_slots_starts ON Slots(starts_at)",
+        "ALTER TABLE Holds ADD COLUMN starts_at INTEGER",
+        "UPDATE Holds SET starts_at = CAST(strftime('%s', date_time, 'utc') AS INTEGER)",
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn):
+    """
+    Returns the migration version recorded in the database file.
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(target=SCHEMA_VERSION):
+    """
+    Brings the database up to the target version, one migration per transaction.
+    Tables are created with IF NOT EXISTS, so an existing database file that
+    predates versioning is upgraded in place without losing rows.
+
+    Attributes:
+    - target: Version to migrate to. Defaults to the latest one.
+
+    Returns the version the database is at afterwards.
+    """
+    with get_db_connection() as conn:
+        while True:
+            # Read the version under the write lock so two processes starting
+            # at once do not both apply the same migration.
+            conn.execute("BEGIN IMMEDIATE")
+            version = get_schema_version(conn)
+            if version >= target:
+                conn.rollback()
+                return version
+            try:
+                for statement in MIGRATIONS[version]:
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(statement)
+                version += 1
+                # PRAGMA does not accept bound parameters.
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+
+if __name__ == "__main__":
+    # Usage: python schema.py [database file]
+    if len(sys.argv) > 1:
+        configure(sys.argv[1])
+    print(f"Database is at schema version {migrate()}.")
@@ -0,0 +1,135 @@
+import threading
+from bisect import bisect_left
+
+from database import get_db_connection
+
+
+def normalize_service(name):
+    """
+    Returns the form service names are indexed under: case-folded, with runs of whitespace collapsed.
+    """
+    return ' '.join(name.casefold().split())
+
+
+class ServiceIndex:
+    """
+    Inverted index from normalized service name to the IDs of the clinics
+    offering it, built from the Services table.
+
+    The names are also kept sorted, so a prefix search ("cardio" for
+    "Cardiology") bisects to the first matching name and reads the run of
+    names after it, instead of scanning every clinic's service list.
+    """
+    def __init__(self):
+        self._clinics = {}
+        self._services = {}
+        self._names = []
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Rebuilds the index from the Services table.
+        """
+        services = {}
+        with get_db_connection() as conn:
+            for clinic_id, name in conn.execute("SELECT clinic_id, name FROM Services"):
+                services.setdefault(clinic_id, set()).add(normalize_service(name))
+        clinics = {}
+        for clinic_id, names in services.items():
+            for name in names:
+                clinics.setdefault(name, set()).add(clinic_id)
+        with self._lock:
+            self._services = services
+            self._clinics = clinics
+            self._names = sorted(clinics)
+        return self
+
+    def __len__(self):
+        return len(self._names)
+
+    def set_services(self, clinic_id, names):
+        """
+        Replaces the services a clinic is indexed under.
+        """
+        names = {normalize_service(name) for name in names}
+        with self._lock:
+            for name in self._services.pop(clinic_id, set()) - names:
+                self._remove(name, clinic_id)
+            for name in names:
+                clinic_ids = self._clinics.get(name)
+                if clinic_ids is None:
+                    clinic_ids = self._clinics[name] = set()
+                    self._names.insert(bisect_left(self._names, name), name)
+                clinic_ids.add(clinic_id)
+            if names:
+                self._services[clinic_id] = names
+
+    def remove_clinic(self, clinic_id):
+        self.set_services(clinic_id, ())
+
+    def _remove(self, name, clinic_id):
+        clinic_ids = self._clinics.get(name)
+        if clinic_ids is None:
+            return
+        clinic_ids.discard(clinic_id)
+        if not clinic_ids:
+            del self._clinics[name]
+            del self._names[bisect_left(self._names, name)]
+
+    def clinics(self, name):
+        """
+        Returns the IDs of the clinics offering exactly this service, in any case or spacing.
+        """
+        with self._lock:
+            return set(self._clinics.get(normalize_service(name), ()))
+
+    def _with_prefix(self, prefix):
+        prefix = normalize_service(prefix)
+        i = bisect_left(self._names, prefix)
+        found = []
+        while i < len(self._names) and self._names[i].startswith(prefix):
+            found.append(self._names[i])
+            i += 1
+        return found
+
+    def names(self, prefix):
+        """
+        Returns the normalized service names starting with a prefix, in order.
+        """
+        with self._lock:
+            return self._with_prefix(prefix)
+
+    def clinics_with_prefix(self, prefix):
+        """
+        Returns the IDs of the clinics offering any service whose name starts with a prefix.
+        """
+        clinic_ids = set()
+        with self._lock:
+            for name in self._with_prefix(prefix):
+                clinic_ids |= self._clinics[name]
+        return clinic_ids
+
+
+_service_index = None
+_service_index_lock = threading.Lock()
+
+
+def get_service_index():
+    """
+    Returns the shared service index, loading it from the database on first use.
+    """
+    global _service_index
+    with _service_index_lock:
+        if _service_index is None:
+            _service_index = ServiceIndex().load()
+        return _service_index
+
+
+def update_clinic_services(clinic_id, names):
+    """
+    Re-indexes one clinic's services in the shared service index, if the index has been built.
+    """
+    with _service_index_lock:
+        service_index = _service_index
+    if service_index is not None:
+        service_index.set_services(clinic_id, names)
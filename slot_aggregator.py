@@ -0,0 +1,101 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from http_client import get_http_client
+from timeslots import to_epoch
+
+DEFAULT_CONCURRENCY = 10
+# Seconds one endpoint may take, connecting included.
+DEFAULT_ENDPOINT_TIMEOUT = 5.0
+
+
+def _get_slots(client, endpoint, timeout):
+    response = client.get(endpoint, timeout=timeout, retries=0)
+    response.raise_for_status()
+    slots = response.json()
+    if not isinstance(slots, list):
+        raise ValueError(f"expected a list of slots, got {type(slots).__name__}")
+    return slots
+
+
+def _slot_order(key):
+    # Numeric clinic IDs sort as numbers, before any other kind of ID.
+    moment, clinic_id = key
+    return (moment, 0, clinic_id, '') if isinstance(clinic_id, int) else (moment, 1, 0, str(clinic_id))
+
+
+async def gather_available(endpoints, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_ENDPOINT_TIMEOUT, client=None,
+                           breakers=None):
+    """
+    Fetches the available slots of many clinic systems concurrently and merges them.
+
+    Calls go through the pooled HTTP client on a thread pool of `concurrency`
+    workers, so at most that many endpoints are called at once. An endpoint
+    that fails, answers with an error status or takes longer than the timeout
+    is reported in 'failed' and does not hold up or spoil the others.
+
+    With breakers, every endpoint is called through its own circuit breaker,
+    so one that keeps failing is skipped at once (and reported in 'failed')
+    while the others are still called, and its failures never count against them.
+
+    Attributes:
+    - endpoints: URLs of the clinic systems' /available endpoints.
+    - concurrency: Largest number of endpoints called at the same time.
+    - timeout: Seconds each endpoint may take.
+    - client: HTTPClient to call through. Defaults to the shared one.
+    - breakers: Function returning the CircuitBreaker of an endpoint. Defaults to no breakers.
+
+    Returns a dictionary with the merged 'slots', sorted by date and time and
+    then clinic, each tagged with the 'source' endpoint it came from; 'failed',
+    mapping failed endpoints to their error; and the elapsed 'seconds'.
+    """
+    client = client or get_http_client()
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='slot-fetch')
+    started = time.perf_counter()
+
+    async def fetch(endpoint):
+        get_slots = _get_slots if breakers is None else partial(breakers(endpoint).call, _get_slots)
+        async with limit:
+            try:
+                slots = await asyncio.wait_for(loop.run_in_executor(executor, get_slots, client, endpoint, timeout),
+                                               timeout)
+                return endpoint, slots, None
+            except asyncio.TimeoutError:
+                return endpoint, None, f"no answer within {timeout} seconds"
+            except Exception as e:
+                return endpoint, None, str(e) or type(e).__name__
+
+    try:
+        results = await asyncio.gather(*(fetch(endpoint) for endpoint in dict.fromkeys(endpoints)))
+    finally:
+        # A call that timed out may still be running; the HTTP timeout ends it, nobody waits for it here.
+        executor.shutdown(wait=False)
+
+    merged = {}
+    failed = {}
+    for endpoint, slots, error in results:
+        if error is not None:
+            failed[endpoint] = error
+            continue
+        for slot in slots:
+            try:
+                key = to_epoch(slot['date_time'])[0], slot['clinic_id']
+            except (KeyError, TypeError, ValueError):
+                continue
+            # The same clinic slot reported by two systems is listed once.
+            merged.setdefault(key, {**slot, 'source': endpoint})
+    return {'slots': [merged[key] for key in sorted(merged, key=_slot_order)],
+            'failed': failed,
+            'seconds': time.perf_counter() - started}
+
+
+def fetch_available(endpoints, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_ENDPOINT_TIMEOUT, client=None,
+                    breakers=None):
+    """
+    Runs gather_available() to completion from synchronous code. See gather_available for the arguments.
+    """
+    return asyncio.run(gather_available(endpoints, concurrency, timeout, client, breakers))
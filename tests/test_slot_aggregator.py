@@ -0,0 +1,96 @@
+import threading
+import unittest
+
+from benchmarks import stand_in_server
+from circuit_breaker import CircuitBreaker
+from http_client import HTTPClient
+from slot_aggregator import fetch_available
+
+
+class SlotAggregatorTests(unittest.TestCase):
+    """
+    Runs the aggregator against local stand-in clinic systems. Each system's
+    answer is chosen by the first part of the request path.
+    """
+
+    def setUp(self):
+        self.answers = {}
+        self.requests = {}
+        self.requests_lock = threading.Lock()
+        self.release = threading.Event()
+        self.client = HTTPClient()
+        server = stand_in_server(self.respond)
+        self.url = server.__enter__()
+        # The hanging system is let go first, so the server can shut down.
+        self.addCleanup(server.__exit__, None, None, None)
+        self.addCleanup(self.release.set)
+        self.addCleanup(self.client.close)
+
+    def respond(self, handler):
+        name = handler.path.split('/')[1]
+        with self.requests_lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+        answer = self.answers[name]
+        if answer == 'hang':
+            self.release.wait(10)
+            return 200, []
+        return answer
+
+    def endpoint(self, name, answer):
+        self.answers[name] = answer
+        return f"{self.url}/{name}/available"
+
+    def test_merges_sorted_and_lists_a_repeated_slot_once(self):
+        first = self.endpoint('first', (200, [
+            {'date_time': '2030-01-02 09:00', 'clinic_id': 2},
+            {'date_time': '2030-01-01 10:00', 'clinic_id': 'x'},
+            {'date_time': '2030-01-01 10:00', 'clinic_id': 1, 'seats': 1},
+        ]))
+        second = self.endpoint('second', (200, [
+            {'date_time': '2030-01-01T10:00', 'clinic_id': 1, 'seats': 4},
+            {'date_time': '2030-01-01 09:00', 'clinic_id': 3},
+            {'clinic_id': 4},
+        ]))
+        result = fetch_available([first, second, first], client=self.client)
+
+        self.assertEqual(result['failed'], {})
+        self.assertEqual([(slot['date_time'], slot['clinic_id'], slot['source']) for slot in result['slots']], [
+            ('2030-01-01 09:00', 3, second),
+            ('2030-01-01 10:00', 1, first),
+            ('2030-01-01 10:00', 'x', first),
+            ('2030-01-02 09:00', 2, first),
+        ])
+        # The copy of the endpoint listed first is kept, whichever answered first.
+        self.assertEqual(result['slots'][1]['seats'], 1)
+        self.assertEqual(self.requests['first'], 1)
+
+    def test_timed_out_endpoint_is_reported_without_holding_up_the_others(self):
+        slow = self.endpoint('slow', 'hang')
+        fast = self.endpoint('fast', (200, [{'date_time': '2030-01-01 09:00', 'clinic_id': 1}]))
+        broken = self.endpoint('broken', (500, {'error': 'down'}))
+        result = fetch_available([slow, fast, broken], timeout=0.2, client=self.client)
+
+        self.assertEqual(set(result['failed']), {slow, broken})
+        self.assertEqual([slot['source'] for slot in result['slots']], [fast])
+        # The slow system is still hanging: the result did not wait for it.
+        self.assertFalse(self.release.is_set())
+        self.assertLess(result['seconds'], 5)
+
+    def test_each_endpoint_has_its_own_breaker(self):
+        down = self.endpoint('down', (500, {'error': 'down'}))
+        up = self.endpoint('up', (200, [{'date_time': '2030-01-01 09:00', 'clinic_id': 1}]))
+        breakers = {endpoint: CircuitBreaker(endpoint, failure_threshold=2) for endpoint in (down, up)}
+
+        results = [fetch_available([down, up], client=self.client, breakers=breakers.get) for _ in range(4)]
+
+        self.assertEqual([set(result['failed']) for result in results], [{down}] * 4)
+        self.assertEqual([len(result['slots']) for result in results], [1] * 4)
+        # Open after two failures, the breaker stops calls to its endpoint only.
+        self.assertEqual(self.requests, {'down': 2, 'up': 4})
+        self.assertIn('unavailable', results[-1]['failed'][down])
+        self.assertEqual((breakers[down].state, breakers[up].state), ('open', 'closed'))
+        self.assertEqual(breakers[down].rejected, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+from datetime import date, datetime, time, timedelta, timezone
+
+# Length of one appointment.
+SLOT_DURATION = timedelta(minutes=30)
+
+
+def parse_date_time(value):
+    """
+    Accepts a datetime or a string such as "2024-01-02 10:00" and returns a datetime.
+    Raises TypeError for anything else and ValueError for an unreadable string.
+    """
+    if isinstance(value, datetime):
+        return value
+    if not isinstance(value, str):
+        raise TypeError(f"expected a date and time, got {type(value).__name__}")
+    return datetime.fromisoformat(value.strip())
+
+
+def format_date_time(value):
+    """
+    Returns a datetime or any ISO date and time string in the "YYYY-MM-DD HH:MM"
+    form slots are stored in, so different spellings of one moment compare equal.
+    """
+    return parse_date_time(value).strftime("%Y-%m-%d %H:%M")
+
+
+def to_epoch(value):
+    """
+    Returns a date and time as (seconds since 1970-01-01 UTC, UTC offset in minutes).
+    Times without a time zone are taken to be local time.
+    """
+    moment = parse_date_time(value)
+    if moment.tzinfo is None:
+        moment = moment.astimezone()
+    return int(moment.timestamp()), int(moment.utcoffset().total_seconds()) // 60
+
+
+def epoch_seconds(value):
+    """
+    Returns a query bound as seconds since 1970 UTC. Integers are taken to be
+    epoch seconds already; anything else is parsed as a date and time.
+    """
+    if isinstance(value, int):
+        return value
+    return to_epoch(value)[0]
+
+
+def local_slot(value):
+    """
+    Returns a slot's start as (seconds since 1970-01-01 UTC, "YYYY-MM-DD HH:MM"
+    in local time). Slots are keyed on the seconds, so one moment written with
+    different UTC offsets is one slot; the text is what they are listed as.
+
+    Attributes:
+    - value: A datetime, an ISO date and time string, or epoch seconds.
+    """
+    if isinstance(value, int):
+        return value, datetime.fromtimestamp(value).strftime("%Y-%m-%d %H:%M")
+    moment = parse_date_time(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone()
+    return int(moment.timestamp()), moment.strftime("%Y-%m-%d %H:%M")
+
+
+def from_epoch(seconds, offset=0):
+    """
+    Returns the datetime of an epoch timestamp in the time zone it was stored with.
+
+    Attributes:
+    - seconds: Seconds since 1970-01-01 UTC.
+    - offset: UTC offset in minutes.
+    """
+    return datetime.fromtimestamp(seconds, timezone(timedelta(minutes=offset)))
+
+
+def day_range(day, days=1):
+    """
+    Returns the epoch bounds (first second, end exclusive) of a run of local days,
+    e.g. days=7 for a week, for range queries on stored timestamps.
+
+    Attributes:
+    - day: The first day, as a date, a datetime or a "YYYY-MM-DD" string.
+    - days: Number of days covered.
+    """
+    if isinstance(day, datetime):
+        day = day.date()
+    elif not isinstance(day, date):
+        day = date.fromisoformat(day.strip())
+    first = datetime.combine(day, time())
+    return to_epoch(first)[0], to_epoch(first + timedelta(days=days))[0]
+
+
+def week_range(day):
+    """
+    Returns the epoch bounds of the Monday-to-Sunday week a day falls in.
+    """
+    if isinstance(day, str):
+        day = date.fromisoformat(day.strip())
+    elif isinstance(day, datetime):
+        day = day.date()
+    return day_range(day - timedelta(days=day.weekday()), 7)
@@ -0,0 +1,87 @@
+import threading
+from datetime import datetime
+
+from capacity import reserve_seat
+from repository import get_repositories
+from timeslots import local_slot
+
+
+class Waitlist:
+    """
+    Patients waiting for a seat at a clinic on a day, served by priority
+    (highest first) and then by request time.
+
+    The queue lives in the Waitlist table only. A freed seat goes to the top
+    waiter of its clinic and day, found and claimed with one indexed UPDATE in
+    the transaction that frees it (see WaitlistRepository.claim), so waiters
+    who joined from another process are served too, and a rolled back
+    transaction leaves its waiter waiting. The cost of a backfill does not
+    grow with the size of the whole waitlist.
+    """
+    def join(self, user_id, clinic_id, day, start_time=None, end_time=None, priority=0):
+        """
+        Puts a patient on the waitlist of a clinic for one day.
+
+        Attributes:
+        - user_id: The waiting patient.
+        - clinic_id: The clinic the patient wants a seat at.
+        - day: The day wanted ("YYYY-MM-DD").
+        - start_time: Earliest acceptable time of day ("HH:MM"). Defaults to any time.
+        - end_time: Acceptable slots start before this time of day ("HH:MM").
+        - priority: Higher priorities are served first; ties go to the earliest request.
+
+        Returns the stored waitlist record. Raises sqlite3.Error if it cannot be stored.
+        """
+        return get_repositories().waitlist.add({
+            'user_id': user_id, 'clinic_id': clinic_id, 'day': day, 'start_time': start_time,
+            'end_time': end_time, 'priority': priority, 'requested_at': datetime.now().isoformat(),
+            'status': 'waiting'})
+
+    def withdraw(self, waitlist_id):
+        """
+        Takes an entry off the waitlist. Returns False if it was not waiting.
+        """
+        return get_repositories().waitlist.withdraw(waitlist_id)
+
+    def waiting(self, clinic_id, day):
+        """
+        Returns the number of patients waiting for a clinic on a day.
+        """
+        return get_repositories().waitlist.waiting(clinic_id, day)
+
+    def offer(self, conn, clinic_id, date_time):
+        """
+        Books a freed seat for the top waiter of its clinic and day, inside the
+        caller's transaction, so the seat is never visible as free in between.
+        The slot may be given in any form local_slot() accepts, e.g. an
+        appointment's starts_at; waiters' days and times are local time.
+
+        Returns the new appointment record, or None if nobody on the waitlist wants the slot.
+        """
+        starts_at, date_time = local_slot(date_time)
+        repositories = get_repositories()
+        waiter = repositories.waitlist.claim(clinic_id, date_time[:10], date_time[11:])
+        if waiter is None:
+            return None
+        if reserve_seat(conn, clinic_id, starts_at) is None:
+            repositories.waitlist.update(waiter['waitlist_id'], status='waiting')
+            return None
+        record = repositories.appointments.add({'status': 'pending', 'date_time': date_time,
+                                                'user_id': waiter['user_id'], 'clinic_id': clinic_id})
+        repositories.waitlist.update(waiter['waitlist_id'], appointment_id=record['appointment_id'])
+        return record
+
+
+_waitlist = None
+_waitlist_lock = threading.Lock()
+
+
+def get_waitlist():
+    """
+    Returns the shared waitlist, creating it on first use.
+    """
+    global _waitlist
+    with _waitlist_lock:
+        if _waitlist is None:
+            _waitlist = Waitlist()
+        return _waitlist